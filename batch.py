@@ -0,0 +1,334 @@
+# Natural Language Toolkit: Tree-Adjoining Grammar
+#
+# Copyright (C) 2001-2013 NLTK Project
+# Author: WANG Ziqi, Haotian Zhang <{zwa47,haotianz}@sfu.ca>
+#
+# URL: <http://www.nltk.org/>
+# For license information, see LICENSE.TXT
+#
+
+"""
+Assign elementary trees to the words of a corpus of dependency trees,
+without the viewer. The input is read like DependencyGraphView reads it,
+four or five columns per word:
+
+    word    POS tag    head    relation    [tree]
+
+and sentences separated by empty lines, e.g.
+sample-data/wsj_0001.mrg.3.pa.gs.tab. The output has the five columns
+written by DependencyGraphView.exportparsefile().
+
+Usage: python batch.py [options] input [input ...]
+
+An input may be a directory, all the files in it are parsed.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+from util import *
+from parse import format_parse_line
+from chart import (Supertag, lex_candidates, FrequencyPruner,
+                   NaiveBayesPruner, tagged_file_parse)
+
+def parse_file_read(fp):
+    """
+    Read a dependency file
+
+    :param fp: The file
+    :type fp: file
+    :return: The sentences, each a list of the columns of every word
+    :rtype: list(list(list(str)))
+    """
+    sents = []
+    for entry in fp.read().split('\n\n'):
+        sent = []
+        for line in entry.split('\n'):
+            elements = line.split()
+            if len(elements) < 4:
+                continue
+            sent.append(elements[:5])
+        if len(sent) > 0:
+            sents.append(sent)
+    return sents
+
+def head_order(sent):
+    """
+    :param sent: A sentence read by parse_file_read()
+    :type sent: list(list(str))
+    :return: The positions of the words, every head before its dependents.
+    Words not attached to the root, e.g. in a cycle, come last.
+    :rtype: list(int)
+    """
+    dependents = {}
+    for i in range(0, len(sent)):
+        try:
+            head = int(sent[i][2])
+        except ValueError:
+            head = 0
+        if head not in dependents:
+            dependents[head] = []
+        dependents[head].append(i)
+    order = []
+    seen = set()
+    queue = [0]
+    while len(queue) > 0:
+        head = queue.pop(0)
+        for i in dependents.get(head, []):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+                queue.append(i + 1)
+    order += [i for i in range(0, len(sent)) if i not in seen]
+    return order
+
+def can_attach(head, supertag):
+    """
+    :param head: The tree of the head
+    :type head: Supertag
+    :param supertag: A tree of the dependent
+    :type supertag: Supertag
+    :return: True if the tree of the dependent can be substituted into a
+    substitution node of the head, or adjoined at a node of the head with
+    the category of its foot
+    :rtype: bool
+    """
+    for number in range(0, len(head.labels)):
+        if head.kinds[number] == 'subst' and \
+           head.categories[number] == supertag.category:
+            return True
+    return supertag.foot_category in head.categories
+
+def assign_trees(sent, alltrees, pruner=None, start=('S',)):
+    """
+    Choose an elementary tree for every word of a sentence. A head gets its
+    tree before its dependents, and a dependent takes the first of its
+    trees which can be substituted or adjoined into the tree of its head,
+    or its first tree if there is none. The root takes the first tree
+    whose root is in ``start``. The trees are ranked by the pruner, or
+    else kept in the order of the grammar. A tree already given in the
+    fifth column is kept.
+
+    :param sent: A sentence read by parse_file_read()
+    :type sent: list(list(str))
+    :param alltrees: The TAG trees of the grammar
+    :type alltrees: TAGTreeSet
+    :param pruner: The pruning stage of the supertags, or None
+    :type pruner: SupertagPruner
+    :return: The name of the tree of every word, '' if there is none
+    :rtype: list(str)
+    """
+    words = [columns[0] for columns in sent]
+    lex_lists = words_to_features(words)
+    names = [''] * len(sent)
+    chosen_tags = [None] * len(sent)
+    for i in head_order(sent):
+        columns = sent[i]
+        supertags = []
+        for (morph, name, tree) in lex_candidates(lex_lists[i], alltrees):
+            supertag = Supertag(name, tree, i, words, morph[0])
+            if supertag.valid == True:
+                supertags.append(supertag)
+        if len(columns) > 4:
+            names[i] = columns[4]
+            for supertag in supertags:
+                if supertag.name == columns[4]:
+                    chosen_tags[i] = supertag
+                    break
+            continue
+        if pruner != None:
+            supertags = pruner.prune(words[i], columns[1], supertags)
+        if len(supertags) == 0:
+            continue
+        try:
+            head = int(columns[2]) - 1
+        except ValueError:
+            head = -1
+        chosen = supertags[0]
+        if head >= 0 and head < len(sent) and chosen_tags[head] != None:
+            for supertag in supertags:
+                if can_attach(chosen_tags[head], supertag) == True:
+                    chosen = supertag
+                    break
+        elif head == -1 and start != None:
+            for supertag in supertags:
+                if supertag.foot == None and supertag.category in start:
+                    chosen = supertag
+                    break
+        names[i] = chosen.name
+        chosen_tags[i] = chosen
+    return names
+
+####################################
+# Process Pool #####################
+####################################
+
+# The grammar of a worker process, loaded once by init_worker()
+_worker = {}
+
+def init_worker(language, pruner, lexicon_dir=None):
+    """
+    Load the grammar in a worker process. The tree families and the
+    lexicon are read from memory mapped stores, written once by the parent,
+    so a worker only unpickles the entries it uses instead of loading
+    everything.
+
+    :param language: The language of the grammar
+    :type language: str
+    :param pruner: The pruning stage of the supertags, or None
+    :type pruner: SupertagPruner
+    :param lexicon_dir: The lexicon written by dump_lexicon(), which is
+    mapped instead of parsed in every worker
+    :type lexicon_dir: str
+    """
+    _worker['alltrees'] = load(language, lazy=True, mapped=True,
+                               lexicon_dir=lexicon_dir)
+    _worker['pruner'] = pruner
+
+def parse_sentence(sent):
+    """
+    Assign the trees of a sentence in a worker process
+
+    :param sent: A sentence read by parse_file_read()
+    :type sent: list(list(str))
+    :return: The lines of the sentence in the output
+    :rtype: str
+    """
+    names = assign_trees(sent, _worker['alltrees'], _worker['pruner'])
+    lines = ''
+    for i in range(0, len(sent)):
+        lines += format_parse_line(sent[i][:4] + [names[i]])
+    return lines + '\n'
+
+def input_files(paths):
+    """
+    :param paths: Files and directories
+    :type paths: list(str)
+    :return: The files, and the files in the directories in sorted order
+    :rtype: list(str)
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for fn in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, fn)):
+                    files.append(os.path.join(path, fn))
+        else:
+            files.append(path)
+    return files
+
+def batch_parse(paths, output, language='english', processes=None,
+                pruner=None, chunksize=8):
+    """
+    Assign trees to all the sentences of the input files. The sentences
+    are shared out between the processes of a pool, and written in the
+    order of the input. The lexicon is parsed once and written to memory
+    mapped stores, which all the workers map.
+
+    :param paths: The input files and directories
+    :type paths: list(str)
+    :param output: The output file, or a directory to write a file of the
+    same name for every input file
+    :type output: file / str
+    :param language: The language of the grammar
+    :type language: str
+    :param processes: The number of processes, the number of CPUs if None.
+    With 1 the sentences are parsed in this process.
+    :type processes: int
+    :param pruner: The pruning stage of the supertags, or None
+    :type pruner: SupertagPruner
+    :param chunksize: The number of sentences sent to a worker at a time
+    :type chunksize: int
+    :return: The number of sentences
+    :rtype: int
+    """
+    pool = None
+    lexicon_dir = None
+    if processes == 1:
+        init_worker(language, pruner)
+        imap = map
+    else:
+        load(language, lazy=True)
+        lexicon_dir = tempfile.mkdtemp(prefix='xtag-lexicon-')
+        dump_lexicon(lexicon_dir)
+        # The parsed lexicon is not needed here any more
+        map_lexicon(lexicon_dir)
+    count = 0
+    try:
+        if lexicon_dir != None:
+            pool = multiprocessing.Pool(processes, init_worker,
+                                        (language, pruner, lexicon_dir))
+            imap = lambda func, sents: pool.imap(func, sents, chunksize)
+        for path in input_files(paths):
+            fp = open(path)
+            sents = parse_file_read(fp)
+            fp.close()
+            if isinstance(output, basestring):
+                out = open(os.path.join(output, os.path.basename(path)), 'w')
+            else:
+                out = output
+            for lines in imap(parse_sentence, sents):
+                out.write(lines)
+            if out is not output:
+                out.close()
+            count += len(sents)
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+        if lexicon_dir != None:
+            shutil.rmtree(lexicon_dir)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Assign elementary trees to a corpus of dependency trees')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='a dependency file or a directory of them')
+    parser.add_argument('-l', '--language', default='english',
+                        help='the XTAG grammar (default: english)')
+    parser.add_argument('-o', '--output',
+                        help='the output file, or a directory for one file '
+                             'per input (default: standard output)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='the number of worker processes '
+                             '(default: the number of CPUs)')
+    parser.add_argument('-k', '--top', type=int, default=None,
+                        help='the number of trees kept for every word')
+    parser.add_argument('-t', '--train', action='append', default=[],
+                        help='a supertagged file to rank the trees, e.g. '
+                             'sample-data/input_tagged.txt')
+    parser.add_argument('--naive-bayes', action='store_true',
+                        help='rank with a naive Bayes classifier instead of '
+                             'frequencies')
+    args = parser.parse_args(argv)
+
+    pruner = None
+    if args.top != None or len(args.train) > 0:
+        if args.naive_bayes:
+            pruner = NaiveBayesPruner(args.top)
+        else:
+            pruner = FrequencyPruner(args.top)
+        for path in args.train:
+            fp = open(path)
+            pruner.train(tagged_file_parse(fp))
+            fp.close()
+
+    if args.output == None:
+        output = sys.stdout
+    elif os.path.isdir(args.output):
+        output = args.output
+    else:
+        output = open(args.output, 'w')
+    count = batch_parse(args.inputs, output, args.language, args.processes,
+                        pruner)
+    if output is not sys.stdout and not isinstance(output, basestring):
+        output.close()
+    print >> sys.stderr, '%d sentences' % (count)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,764 @@
+# Natural Language Toolkit: Tree-Adjoining Grammar
+#
+# Copyright (C) 2001-2013 NLTK Project
+# Author: WANG Ziqi, Haotian Zhang <{zwa47,haotianz}@sfu.ca>
+#
+# URL: <http://www.nltk.org/>
+# For license information, see LICENSE.TXT
+#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import feature
+import parse
+from util import *
+
+def timeit(func, repeat=3):
+    """
+    Call a function several times and return the best wall clock time
+
+    :param func: The function to be called without arguments
+    :type func: function
+    :param repeat: Number of runs
+    :type repeat: int
+    :return: The shortest time in seconds
+    :rtype: float
+    """
+    best = None
+    for i in range(0, repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def five_pass_parse(text):
+    """
+    The tree file parser before iter_tree_file(), kept here to compare with
+    """
+    calist = analyze_tree_3(analyze_tree_2(analyze_tree_1(text)))
+    arglist = analyze_tree_5(analyze_tree_4(calist))
+    tagset = TAGTreeSet()
+    for element in arglist:
+        new_tree = parse_tree_list(element[2], element[4])
+        new_tree.set_comment(element[5]['COMMENTS'])
+        tagset[element[0]] = new_tree
+    return tagset
+
+def grammar_tree_files(language):
+    """
+    Get the paths of all tree files and family files of an installed grammar
+    """
+    cata_dir = 'xtag_grammar/' + language + '/' + language + '.gram'
+    cata = get_catalog(nltk.data.find(cata_dir).open().read())
+    paths = []
+    for files in ['tree-files', 'family-files']:
+        (file_names, directory) = get_file_list(cata, files)
+        for fn in file_names:
+            path = os.sep.join(['xtag_grammar', language, directory, fn])
+            paths.append(nltk.data.find(path).path)
+    return paths
+
+def benchmark_tree_files(paths, repeat=3):
+    """
+    Compare the five pass tree file parser with the single pass one
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    """
+    texts = [open(path).read() for path in paths]
+    size = sum([len(text) for text in texts])
+
+    def old():
+        for text in texts:
+            five_pass_parse(text)
+
+    def new():
+        for path in paths:
+            fp = open(path)
+            grammar_file_parse(fp)
+            fp.close()
+
+    old_time = timeit(old, repeat)
+    new_time = timeit(new, repeat)
+    print 'Tree files: %d files, %d bytes' % (len(paths), size)
+    print '    five passes: %.3fs' % (old_time)
+    print '    single pass: %.3fs (%.2fx)' % (new_time, old_time / new_time)
+
+def node_size(tree):
+    """
+    Get the number of bytes taken by the nodes of a tree, not counting
+    the feature structures and strings which are shared by both forms
+    """
+    size = sys.getsizeof(tree)
+    if isinstance(tree, TAGNode):
+        size += sys.getsizeof(tree.children)
+        if tree.extra:
+            size += sys.getsizeof(tree.extra)
+    elif isinstance(tree, TAGTree):
+        size += sys.getsizeof(tree.__dict__)
+    else:
+        return 0
+    for child in tree:
+        size += node_size(child)
+    return size
+
+def benchmark_compact(paths):
+    """
+    Compare the memory taken by TAG trees and by compact nodes
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    """
+    trees = []
+    for path in paths:
+        fp = open(path)
+        trees.extend(grammar_file_parse(fp).values())
+        fp.close()
+    tree_size = sum([node_size(tree) for tree in trees])
+    nodes = [tree.compact() for tree in trees]
+    compact_size = sum([node_size(node) for node in nodes])
+    print 'Tree nodes: %d trees' % (len(trees))
+    print '    TAGTree: %d bytes' % (tree_size)
+    print '    TAGNode: %d bytes (%.2fx)' % (compact_size,
+                                            float(tree_size) / compact_size)
+
+def forest_node_size(forest):
+    """
+    Get the number of bytes taken by the nodes of the trees of a forest,
+    as they are kept, see node_size()
+    """
+    size = 0
+    for section in forest:
+        for family in forest[section]:
+            fset = forest[section][family]
+            for name in fset:
+                size += node_size(dict.get(fset, name))
+    return size
+
+def benchmark_compact_forest(language, words, repeat=3):
+    """
+    Load a forest with TAG trees and with compact nodes, and compare the
+    memory taken by the nodes and the time of looking up some words, which
+    expands the compact nodes
+
+    :param language: The language of the grammar
+    :type language: str
+    :param words: The words looked up
+    :type words: list(str)
+    """
+    sizes = {}
+    times = {}
+    for compact in [False, True]:
+        forest = load(language, compact=compact)
+        sizes[compact] = forest_node_size(forest)
+        lex_lists = [word_to_features(word) for word in words]
+        def search():
+            for lex_list in lex_lists:
+                lex_search(lex_list, {}, forest)
+        times[compact] = timeit(search, repeat)
+    print 'Compact forest: %s' % (language)
+    print '    TAGTree: %d bytes, search %.3fs' % (sizes[False], times[False])
+    print '    TAGNode: %d bytes (%.2fx), search %.3fs (%.2fx)' % (
+        sizes[True], float(sizes[False]) / sizes[True], times[True],
+        times[False] / times[True])
+
+def set_test_contain(fs1, fs2):
+    """
+    test_contain() comparing the values as sets instead of bitmasks, kept
+    here to compare with
+    """
+    if test_leaf(fs1) == False or test_leaf(fs2) == False:
+        raise ValueError('Two arguments must be leaf nodes.')
+    value_1 = leaf_value(fs1)
+    value_2 = leaf_value(fs2)
+    if value_1 == None or value_2 == None:
+        if value_1 == None and value_2 == None:
+            return 0
+        return None
+    if value_1 == value_2:
+        return 0
+    elif value_1 < value_2:
+        return 1
+    elif value_2 < value_1:
+        return -1
+    common = frozenset.intersection(value_1, value_2)
+    if len(common) == 0:
+        return None
+    return make_leaf(make_disjunction(common))
+
+def benchmark_start_feature(paths, start_fs, repeat=3):
+    """
+    Unify the top feature structure of the root of every tree with the
+    start feature, comparing values as sets and as bitmasks
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    :param start_fs: The start feature of the catalog
+    :type start_fs: FeatStruct
+    """
+    trees = []
+    for path in paths:
+        fp = open(path)
+        trees.extend(grammar_file_parse(fp).values())
+        fp.close()
+
+    def unify_all():
+        for tree in trees:
+            special_unify(tree.top_fs, start_fs)
+
+    mask_test_contain = feature.test_contain
+    feature.test_contain = set_test_contain
+    try:
+        set_time = timeit(unify_all, repeat)
+    finally:
+        feature.test_contain = mask_test_contain
+    mask_time = timeit(unify_all, repeat)
+    print 'Start feature: %d trees' % (len(trees))
+    print '    sets:     %.3fs' % (set_time)
+    print '    bitmasks: %.3fs (%.2fx)' % (mask_time, set_time / mask_time)
+
+def path_special_unify(fs1, fs2):
+    """
+    feature.special_unify() without trees, listing all paths and looking
+    every path up from the root, kept here to compare with
+    """
+    new_fs = FeatStruct()
+    correction_list = []
+    for i in get_all_path(fs2):
+        item_1 = get_element_by_path(fs1, i)
+        item_2 = get_element_by_path(fs2, i)
+        if item_1 == None:
+            add_new_fs(new_fs, i, item_2, 1)
+            continue
+        tc = test_contain(item_1, item_2)
+        if tc == 1:
+            add_new_fs(new_fs, i, item_1, 1)
+        elif tc == -1:
+            add_new_fs(new_fs, i, item_2, 1)
+        elif tc == 0:
+            new_entry = feature.search_correction(correction_list, item_1)
+            if new_entry == None:
+                new_entry = copy.deepcopy(item_1)
+                correction_list.append((new_entry, item_1, item_2))
+            add_new_fs(new_fs, i, new_entry, 1)
+        elif tc == None:
+            return None
+        else:
+            add_new_fs(new_fs, i, tc, 1)
+    for i in get_all_path(fs1):
+        if get_element_by_path(fs2, i) == None:
+            add_new_fs(new_fs, i, get_element_by_path(fs1, i), 1)
+    return new_fs
+
+def benchmark_path_walk(paths, start_fs, repeat=3):
+    """
+    Unify the feature structures of every node with the start feature,
+    looking every path up from the root and walking the two feature
+    structures together
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    :param start_fs: The start feature of the catalog
+    :type start_fs: FeatStruct
+    """
+    all_fs = []
+    for path in paths:
+        fp = open(path)
+        for tree in grammar_file_parse(fp).values():
+            all_fs.extend(tree.get_all_fs().values())
+        fp.close()
+
+    def lookup():
+        for fs in all_fs:
+            path_special_unify(fs, start_fs)
+
+    def walk():
+        for fs in all_fs:
+            special_unify(fs, start_fs)
+
+    lookup_time = timeit(lookup, repeat)
+    walk_time = timeit(walk, repeat)
+    print 'Feature paths: %d feature structures' % (len(all_fs))
+    print '    lookup: %.3fs' % (lookup_time)
+    print '    walk:   %.3fs (%.2fx)' % (walk_time, lookup_time / walk_time)
+
+def deepcopy_check_substitution(tree_1, tree_2):
+    """
+    parse.check_substitution() with features, copying both trees before
+    unifying, kept here to compare with
+    """
+    result = []
+    for i in tree_1.get_substitution_node():
+        if parse.check_name_equality(i.get_node_name(),
+                                     tree_2.get_node_name()) == True:
+            new_tree_1 = copy.deepcopy(tree_1)
+            new_tree_2 = copy.deepcopy(tree_2)
+            new_sub_node = new_tree_1.search(i.get_node_name())
+            new_top_feature = new_sub_node.get_top_feature().unify(
+                                  new_tree_2.get_top_feature())
+            if new_top_feature == None:
+                continue
+            new_sub_node.set_top_feature(new_top_feature)
+            new_sub_node.set_bottom_feature(new_tree_2.get_bottom_feature())
+            for j in new_tree_2.get_child_node():
+                new_sub_node.append_new_child(j)
+            new_sub_node.cancel_substitution()
+            result.append(new_tree_1)
+    return result
+
+def benchmark_substitution(paths, start_fs, repeat=3):
+    """
+    Try substitution with features between every pair of trees, copying
+    the trees before unifying and undoing failed attempts on a trail. The
+    root of every tree is unified with the start feature first, so that
+    some attempts fail.
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    :param start_fs: The start feature of the catalog
+    :type start_fs: FeatStruct
+    """
+    trees = []
+    for path in paths:
+        fp = open(path)
+        trees.extend(grammar_file_parse(fp).values())
+        fp.close()
+    for tree in trees:
+        top_fs = tree.top_fs.unify(start_fs)
+        if top_fs != None:
+            tree.top_fs = top_fs
+
+    counts = {}
+    def old():
+        counts['old'] = 0
+        for tree_1 in trees:
+            for tree_2 in trees:
+                counts['old'] += len(deepcopy_check_substitution(tree_1, tree_2))
+
+    def new():
+        counts['new'] = 0
+        # Every tree is added into the engine once for all the pairs
+        engine = UnificationEngine()
+        for tree_1 in trees:
+            for tree_2 in trees:
+                counts['new'] += len(parse.check_substitution(tree_1, tree_2,
+                                                              False, True,
+                                                              engine))
+
+    old_time = timeit(old, repeat)
+    new_time = timeit(new, repeat)
+    print 'Substitution: %d trees, %d and %d combinations' % (len(trees),
+                                                            counts['old'],
+                                                            counts['new'])
+    print '    deepcopy: %.3fs' % (old_time)
+    print '    trail:    %.3fs (%.2fx)' % (new_time, old_time / new_time)
+
+def benchmark_compatible(paths, repeat=3):
+    """
+    Combine the pairs of trees which do not combine in any way with
+    tree_compatible(), which skips the checks whose categories do not
+    match, and with all the four checks. The pairs which combine are
+    left out, their time is taken by copying the results.
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    """
+    trees = []
+    for path in paths:
+        fp = open(path)
+        trees.extend(grammar_file_parse(fp).values())
+        fp.close()
+
+    def scan(tree_1, tree_2):
+        return (parse.check_substitution(tree_1, tree_2, False),
+                parse.check_substitution(tree_2, tree_1, True),
+                parse.check_adjunction(tree_1, tree_2),
+                parse.check_adjunction(tree_2, tree_1))
+
+    pairs = []
+    for tree_1 in trees:
+        for tree_2 in trees:
+            if parse.can_substitute(tree_1, tree_2) == False and \
+               parse.can_substitute(tree_2, tree_1) == False and \
+               parse.can_adjoin(tree_1, tree_2) == False and \
+               parse.can_adjoin(tree_2, tree_1) == False:
+                pairs.append((tree_1, tree_2))
+
+    def old():
+        for (tree_1, tree_2) in pairs:
+            scan(tree_1, tree_2)
+
+    def new():
+        for (tree_1, tree_2) in pairs:
+            parse.tree_compatible(tree_1, tree_2)
+
+    old_time = timeit(old, repeat)
+    new_time = timeit(new, repeat)
+    print 'Compatible trees: %d of %d pairs do not combine' % (
+        len(pairs), len(trees) * len(trees))
+    print '    all checks: %.4fs' % (old_time)
+    print '    prefilter:  %.4fs (%.2fx)' % (new_time, old_time / new_time)
+
+def benchmark_node_index(paths, repeat=3):
+    """
+    Look for the substitution nodes, the foot node and the nodes of every
+    label prefix of every tree, walking the tree and using the node index
+
+    :param paths: Tree files to be parsed
+    :type paths: list(str)
+    """
+    trees = []
+    for path in paths:
+        fp = open(path)
+        trees.extend(grammar_file_parse(fp).values())
+        fp.close()
+
+    def walk_prefix(tree, prefix, result):
+        if tree.get_node_name().split('_')[0] == prefix:
+            result.append(tree)
+        for child in tree:
+            walk_prefix(child, prefix, result)
+
+    def walk():
+        for tree in trees:
+            [leaf for leaf in tree.leaves() if leaf.attr == 'subst']
+            [leaf for leaf in tree.leaves() if leaf.attr == 'foot']
+            for node in tree.subtrees():
+                walk_prefix(tree, node.get_node_name().split('_')[0], [])
+
+    def index():
+        for tree in trees:
+            tree.get_substitution_node()
+            tree.get_foot_node()
+            for node in tree.subtrees():
+                tree.prefix_search(node.get_node_name().split('_')[0])
+
+    walk_time = timeit(walk, repeat)
+    index_time = timeit(index, repeat)
+    print 'Node index: %d trees' % (len(trees))
+    print '    walk:  %.3fs' % (walk_time)
+    print '    index: %.3fs (%.2fx)' % (index_time, walk_time / index_time)
+
+def benchmark_lexicon(language, repeat=3):
+    """
+    Initialize the lexicon of a grammar by parsing its text files and by
+    reading the compiled lexicon
+
+    :param language: The language of the grammar
+    :type language: str
+    """
+    cata_dir = 'xtag_grammar/' + language + '/' + language + '.gram'
+    cata = get_catalog(nltk.data.find(cata_dir).open().read())
+    paths = lexicon_files(language, cata)
+    # Make sure the compiled lexicon is up to date
+    init_lexicon(language, cata)
+
+    def parse_text():
+        init(*[open(path).read() for path in paths])
+
+    def read_cache():
+        init_lexicon(language, cata)
+
+    text_time = timeit(parse_text, repeat)
+    cache_time = timeit(read_cache, repeat)
+    size = sum([os.path.getsize(path) for path in paths])
+    print 'Lexicon: %d bytes of text files' % (size)
+    print '    parse:    %.3fs' % (text_time)
+    print '    compiled: %.3fs (%.2fx)' % (cache_time, text_time / cache_time)
+
+def get_next_pair(s, start):
+    """
+    Find the next pair of <<KEY>>value in a line of the syntax file from
+    ``start``, like load.analyze_syntax() did before lines were split at
+    their pairs, kept here to compare with
+
+    :return: The key, the value and the next position to read, which is
+    -1 if there is no more pair
+    :rtype: tuple(str,str,int)
+    """
+    index_start = s.find('<<', start)
+    if index_start == -1:
+        return (None, None, -1)
+    index_end = s.find('>>', index_start)
+    if index_end == -1:
+        raise TypeError('Invalid input line.')
+    entry = s[index_start + 2:index_end]
+    start = index_end + 2
+    index_start = s.find('<<', start)
+    if index_start == -1:
+        value = s[start:]
+        index_return = len(s) - 1
+    else:
+        value = s[start:index_start]
+        index_return = index_start
+    return (entry, value, index_return)
+
+def pair_analyze_syntax(s):
+    """
+    load.analyze_syntax() finding the pairs of every line one after the
+    other with get_next_pair(), kept here to compare with
+    """
+    tokens = {}
+    reverse_trees = ReverseTreeIndex()
+    for l in s.splitlines():
+        if l == '':
+            continue
+        next_start = 0
+        entry_list = []
+        tree_list = []
+        family_list = []
+        feature_list = []
+        line_name = 'noname'
+        while True:
+            (entry, value, next_start) = get_next_pair(l, next_start)
+            if next_start == -1:
+                break
+            elif entry == 'INDEX':
+                line_name = value
+            elif entry == 'ENTRY':
+                entry_name = value
+                (entry, value, next_start) = get_next_pair(l, next_start)
+                if next_start == -1:
+                    raise TypeError('Invalid input line.')
+                if entry != 'POS':
+                    raise TypeError('<<ENTRY>> must be followed by <<POS>>')
+                entry_list.append((entry_name, value))
+            elif entry == 'FAMILY':
+                family_list = value.split()
+            elif entry == 'TREES':
+                tree_list = value.split()
+            elif entry == 'FEATURES':
+                feature_list = value.split()
+        temp = (entry_list, tree_list, family_list, feature_list)
+        if tokens.has_key(line_name):
+            tokens[line_name].append(temp)
+        else:
+            tokens[line_name] = [temp]
+        make_reverse_tree_dict(reverse_trees, tree_list, family_list,
+                               entry_list)
+    reverse_trees.finish()
+    return (tokens, reverse_trees)
+
+def benchmark_syntax(paths, repeat=3):
+    """
+    Parse syntax files finding the pairs of every line one after the
+    other, and splitting the lines at their pairs, read as a whole and
+    line by line, and print the number of lines parsed in a second
+
+    :param paths: The syntax files
+    :type paths: list(str)
+    """
+    for path in paths:
+        fp = open(path)
+        text = fp.read()
+        fp.close()
+        lines = len(text.splitlines())
+
+        def parse_pairs():
+            pair_analyze_syntax(text)
+
+        def parse_text():
+            analyze_syntax(text)
+
+        def parse_stream():
+            fp = open(path)
+            analyze_syntax_lines(fp)
+            fp.close()
+
+        pair_time = timeit(parse_pairs, repeat)
+        text_time = timeit(parse_text, repeat)
+        stream_time = timeit(parse_stream, repeat)
+        print 'Syntax: %s, %d lines' % (path, lines)
+        print '    pairs:  %.3fs (%d lines/s)' % (pair_time, lines / pair_time)
+        print '    text:   %.3fs (%d lines/s, %.2fx)' % (text_time,
+                                                         lines / text_time,
+                                                         pair_time / text_time)
+        print '    stream: %.3fs (%d lines/s, %.2fx)' % (stream_time,
+                                                         lines / stream_time,
+                                                         pair_time /
+                                                         stream_time)
+
+def korean_syntax_file(source, directory):
+    """
+    Convert the syntax of the Korean grammar with KoreanSyntaxReader
+
+    :param source: The syntax file of the Korean grammar, e.g. lexicon.syntax
+    :type source: str
+    :param directory: The directory of the converted files
+    :type directory: str
+    :return: The path of the converted syntax file
+    :rtype: str
+    """
+    from test import KoreanSyntaxReader
+    fp = open(source)
+    reader = KoreanSyntaxReader(fp.read())
+    fp.close()
+    reader.parse()
+    path = os.path.join(directory, 'syntax_coded.flat')
+    reader.dump(path, os.path.join(directory, 'templates.lex'))
+    return path
+
+def benchmark_morph_store(language, words, repeat=3):
+    """
+    Look up a few words in the morphology, reading all of it into a
+    dictionary first and looking them up in the memory mapped store
+
+    :param language: The language of the grammar
+    :type language: str
+    :param words: The words looked up
+    :type words: list(str)
+    """
+    load(language, lazy=True)
+    path = morph_store_path(grammar_path(language))
+
+    def whole():
+        store = MappedStore(path)
+        morph = dict(store.iteritems())
+        for word in words:
+            morph.get(word)
+        store.close()
+
+    def lazy():
+        store = MappedStore(path, MORPH_CACHE_SIZE)
+        for word in words:
+            store.get(word)
+        store.close()
+
+    whole_time = timeit(whole, repeat)
+    lazy_time = timeit(lazy, repeat)
+    print 'Morphology: %d words looked up' % (len(words))
+    print '    whole:  %.3fs' % (whole_time)
+    print '    mapped: %.3fs (%.2fx)' % (lazy_time, whole_time / lazy_time)
+
+def benchmark_feature_cache(language, words, repeat=3):
+    """
+    Look up the features of the words of a text, computing them every time
+    and keeping them in the cache of word_to_features()
+
+    :param language: The language of the grammar
+    :type language: str
+    :param words: The words of the text, repeated like in a corpus
+    :type words: list(str)
+    """
+    load(language, lazy=True)
+
+    def lookup():
+        for word in words:
+            word_to_features(word)
+
+    set_feature_cache_size(0)
+    plain_time = timeit(lookup, repeat)
+    set_feature_cache_size(FEATURE_CACHE_SIZE)
+    cached_time = timeit(lookup, repeat)
+    info = feature_cache_info()
+    print 'Features: %d words, %d different' % (len(words), len(set(words)))
+    print '    computed: %.3fs' % (plain_time)
+    print '    cached:   %.3fs (%.2fx), hit rate %.1f%%' % \
+          (cached_time, plain_time / cached_time, info['hit_rate'] * 100)
+
+def private_memory():
+    """
+    Get the number of bytes of memory used by this process only, not
+    counting the pages shared with other processes. Only Linux is supported.
+
+    :return: The number of bytes, or None if it is not known
+    :rtype: int
+    """
+    try:
+        fp = open('/proc/self/smaps')
+    except IOError:
+        return None
+    total = 0
+    for line in fp:
+        if line.startswith('Private_'):
+            total += int(line.split()[1]) * 1024
+    fp.close()
+    return total
+
+def load_worker(args):
+    """
+    Load a grammar in a worker process, look up some words, and get the
+    memory taken by the process
+    """
+    (language, lexicon_dir, words) = args
+    before = private_memory()
+    t = load(language, lazy=True, mapped=lexicon_dir != None,
+             lexicon_dir=lexicon_dir)
+    for word in words:
+        lex_search(word_to_features(word), {}, t)
+    return private_memory() - before
+
+def benchmark_worker_memory(language, words, processes=4):
+    """
+    Load a grammar in every process of a pool, parsing the lexicon and
+    reading the pickle files in each of them, and mapping the lexicon and
+    forest stores, and compare the memory they take
+
+    :param language: The language of the grammar
+    :type language: str
+    :param words: The words looked up in every worker
+    :type words: list(str)
+    :param processes: The number of processes
+    :type processes: int
+    """
+    if private_memory() == None:
+        return
+    load(language, lazy=True)
+    lexicon_dir = tempfile.mkdtemp()
+    try:
+        dump_lexicon(lexicon_dir)
+        sizes = {}
+        for (mode, directory) in [('parsed', None), ('mapped', lexicon_dir)]:
+            pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+            start = time.time()
+            sizes[mode] = pool.map(load_worker,
+                                   [(language, directory, words)] * processes,
+                                   1)
+            sizes[mode + ' time'] = time.time() - start
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(lexicon_dir)
+    print 'Worker memory: %d workers' % (processes)
+    for mode in ['parsed', 'mapped']:
+        print '    %s: %d bytes in %.3fs' % (mode, sum(sizes[mode]),
+                                            sizes[mode + ' time'])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        paths = ['sample-data/Tnx0VAN1Pnx2.trees']
+        start_fs = debug_start_feature
+    else:
+        paths = grammar_tree_files(sys.argv[1])
+        cata_dir = 'xtag_grammar/' + sys.argv[1] + '/' + sys.argv[1] + '.gram'
+        cata = get_catalog(nltk.data.find(cata_dir).open().read())
+        start_fs = get_start_feature(cata)
+    benchmark_tree_files(paths)
+    benchmark_compact(paths)
+    benchmark_start_feature(paths, start_fs)
+    benchmark_path_walk(paths, start_fs)
+    benchmark_node_index(paths)
+    benchmark_compatible(paths)
+    benchmark_substitution(paths, start_fs)
+    if len(sys.argv) > 1:
+        benchmark_lexicon(sys.argv[1])
+        syntax_paths = [lexicon_files(sys.argv[1], cata)[1]]
+        korean_dir = tempfile.mkdtemp()
+        if os.path.exists('lexicon.syntax'):
+            syntax_paths.append(korean_syntax_file('lexicon.syntax',
+                                                   korean_dir))
+        benchmark_syntax(syntax_paths)
+        shutil.rmtree(korean_dir)
+        benchmark_morph_store(sys.argv[1], ['the', 'of', 'make', 'cat'])
+        benchmark_compact_forest(sys.argv[1], ['the', 'of', 'make', 'cat'])
+        benchmark_feature_cache(sys.argv[1],
+                                'the cat made short work of the dog'.split()
+                                * 200)
+        benchmark_worker_memory(sys.argv[1], ['the', 'of', 'make', 'cat'])
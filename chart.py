@@ -0,0 +1,712 @@
+# Natural Language Toolkit: Tree-Adjoining Grammar
+#
+# Copyright (C) 2001-2013 NLTK Project
+# Author: WANG Ziqi, Haotian Zhang <{zwa47,haotianz}@sfu.ca>
+#
+# URL: <http://www.nltk.org/>
+# For license information, see LICENSE.TXT
+#
+
+from util import *
+from parse import get_name_prefix
+from nltk.classify.naivebayes import NaiveBayesClassifier
+
+# The labels of the leaves spanning no word, e.g. NP_0 -> PRO
+EMPTY_LABELS = (u'\u03b5'.encode('utf-8'), 'PRO')
+
+####################################
+# Supertags ########################
+####################################
+
+class Supertag(object):
+    """
+    An elementary tree selected by a word of the sentence. The nodes of
+    the tree are numbered in pre-order, the root being 0, and the tables
+    below are indexed by that number. The tree itself is never changed or
+    copied, so the trees of the grammar can be used as they are.
+
+    The head nodes are anchored with the words of the morph of the tree
+    like lexicalize() does: a head takes the first word whose POS is the
+    category of the head. The head taking the first word of the morph is
+    pinned to the position of the word in the sentence, and the other
+    anchors and the words in the tree may match any position. A tree
+    whose heads cannot all be anchored is not ``valid``.
+    """
+    def __init__(self, name, tree, position, words, morph=None):
+        """
+        :param name: The name of the tree
+        :type name: str
+        :param tree: The tree
+        :type tree: TAGTree
+        :param position: The position of the word selecting the tree
+        :type position: int
+        :param words: The sentence
+        :type words: list(str)
+        :param morph: The words and POS of the anchors, e.g.
+        [('make','V'),('short','A')], the morph of init_lex() by default
+        :type morph: list(tuple(str,str))
+        """
+        self.name = name
+        self.tree = tree
+        self.position = position
+        # The entry of word_to_features() selecting the tree
+        self.entry = None
+        if morph == None:
+            morph = getattr(tree, '_morph', [])
+        self.morph = morph
+        self.labels = []
+        self.categories = []
+        self.kinds = []
+        self.children = []
+        self.parents = []
+        self.words = []
+        self.foot = None
+        self._number(tree, None)
+        self.category = self.categories[0]
+        if self.foot == None:
+            self.foot_category = None
+        else:
+            self.foot_category = self.categories[self.foot]
+        self.pinned = None
+        self.valid = self._anchor(words[position])
+
+    def _number(self, node, parent):
+        number = len(self.labels)
+        label = node.get_node_name()
+        self.labels.append(label)
+        self.categories.append(get_name_prefix(label))
+        self.parents.append(parent)
+        self.children.append(())
+        self.words.append(None)
+        children = [child for child in node if isinstance(child, TAGTree)]
+        if len(children) > 0:
+            kind = 'inner'
+        elif node.attr == 'subst':
+            kind = 'subst'
+        elif node.attr == 'foot':
+            kind = 'foot'
+            self.foot = number
+        elif node.attr == 'head':
+            kind = 'anchor'
+        elif get_name_prefix(label) in EMPTY_LABELS:
+            kind = 'empty'
+        else:
+            # A word in the tree, or the word of a lexicalized tree
+            kind = 'word'
+            self.words[number] = label
+        self.kinds.append(kind)
+        self.children[number] = tuple([self._number(child, number)
+                                       for child in children])
+        return number
+
+    def _anchor(self, word):
+        used = [False] * len(self.morph)
+        for number in range(0, len(self.labels)):
+            if self.kinds[number] != 'anchor':
+                continue
+            for i in range(0, len(self.morph)):
+                if used[i] == False and \
+                   self.categories[number] == self.morph[i][1]:
+                    used[i] = True
+                    self.kinds[number] = 'word'
+                    self.words[number] = self.morph[i][0]
+                    if i == 0:
+                        self.pinned = number
+                    break
+            else:
+                return False
+        if self.pinned == None:
+            # A tree lexicalized already, pinned at its word
+            for number in range(0, len(self.labels)):
+                if self.kinds[number] == 'word' and \
+                   self.words[number].lower() == word.lower():
+                    self.pinned = number
+                    return True
+            return False
+        # A multi-word entry is selected by each of its words, but only
+        # kept for the first one
+        return len(self.morph) == 1 or \
+               self.morph[0][0].lower() == word.lower()
+
+    def __repr__(self):
+        return '<Supertag %s at %d>' % (self.label(), self.position)
+
+    def label(self):
+        """
+        :return: The name of the tree and the word selecting it
+        :rtype: str
+        """
+        return '%s[%s]' % (self.name, self.words[self.pinned])
+
+def lex_candidates(lex_list, alltrees):
+    """
+    Find the trees selected by the entries of a word like lex_search(),
+    but without copying them
+
+    :param lex_list: The entries of a word, returned by word_to_features()
+    :type lex_list: list
+    :param alltrees: The TAG trees of the grammar
+    :type alltrees: TAGTreeSet
+    :return: The entries, the names and the trees of the grammar
+    :rtype: iter(tuple(tuple,str,TAGTree))
+    """
+    for morph in lex_list:
+        if len(morph[2]) > 0:
+            for tf in morph[2]:
+                tf = tf + '.trees'
+                index = alltrees.family_section(tf)
+                if not index:
+                    raise NameError('No tree fmaily')
+                family = alltrees[index][tf]
+                for name in family:
+                    yield (morph, name, family[name])
+        else:
+            for name in morph[1]:
+                tree = alltrees.find_tree(name)
+                if tree is not None:
+                    yield (morph, name, tree)
+
+####################################
+# Supertag Pruning #################
+####################################
+
+def tree_name(name):
+    """
+    Convert the name of a tree in a tagged file to the name in the grammar
+
+    e.g. alphaNXN --> \\x02NXN; betaDnx --> \\x03Dnx
+
+    :param name: The name of the tree in a tagged file
+    :type name: str
+    :rtype: str
+    """
+    if name.startswith('alpha'):
+        return '\x02' + name[5:]
+    elif name.startswith('beta'):
+        return '\x03' + name[4:]
+    return name
+
+def tagged_file_parse(fp):
+    """
+    Read a supertagged file, e.g. sample-data/input_tagged.txt. Every line
+    is a word, its POS tag, and one or more pairs of the POS of the word in
+    the grammar and the name of a tree:
+
+        cat NN N alphaNXN
+
+    A tag '_' means the word is not tagged. Sentences are separated by
+    empty lines.
+
+    :param fp: The file
+    :type fp: file
+    :return: The sentences, each a list of (word, tag, [(pos, name)])
+    :rtype: list(list(tuple(str,str,list)))
+    """
+    sents = []
+    sent = []
+    for line in fp:
+        fields = line.split()
+        if len(fields) == 0:
+            if len(sent) > 0:
+                sents.append(sent)
+                sent = []
+            continue
+        if len(fields) < 2 or len(fields) % 2 != 0:
+            raise TypeError('Invalid tagged line: %s' % (line))
+        (word, tag) = fields[:2]
+        if tag == '_':
+            tag = None
+        trees = [(fields[i], tree_name(fields[i + 1]))
+                 for i in range(2, len(fields), 2)]
+        sent.append((word, tag, trees))
+    if len(sent) > 0:
+        sents.append(sent)
+    return sents
+
+class SupertagPruner(object):
+    """
+    Keep the best k supertags of every word, before the trees are copied
+    and parsed. The POS tag of a word, when known, removes the supertags
+    whose POS was never seen with that tag in the training data, unless
+    that would remove all of them. The rest are ranked by score(), and
+    supertags of equal scores keep the order of the grammar.
+
+    This class gives every supertag the same score, subclasses give
+    better ones.
+    """
+    def __init__(self, k=None):
+        """
+        :param k: The number of supertags kept for every word, or None
+        to keep all of them
+        :type k: int
+        """
+        self.k = k
+        self.tag_pos = {}
+
+    def train(self, sents):
+        """
+        :param sents: Tagged sentences, e.g. returned by tagged_file_parse()
+        :type sents: list(list(tuple(str,str,list)))
+        """
+        for sent in sents:
+            for (word, tag, trees) in sent:
+                for (pos, name) in trees:
+                    if tag != None:
+                        if tag not in self.tag_pos:
+                            self.tag_pos[tag] = set()
+                        self.tag_pos[tag].add(pos)
+                    self.count(word.lower(), tag, pos, name)
+
+    def count(self, word, tag, pos, name):
+        """
+        Record a supertagged word of the training data
+
+        :param word: The word in lower case
+        :type word: str
+        :param tag: The POS tag, or None
+        :type tag: str
+        :param pos: The POS of the word in the grammar
+        :type pos: str
+        :param name: The name of the tree
+        :type name: str
+        """
+        pass
+
+    def score(self, word, tag, supertag):
+        """
+        :param word: The word
+        :type word: str
+        :param tag: The POS tag, or None
+        :type tag: str
+        :param supertag: A supertag of the word
+        :type supertag: Supertag
+        :return: The score of the supertag, higher is better
+        """
+        return 0
+
+    def prune(self, word, tag, supertags):
+        """
+        :param word: The word
+        :type word: str
+        :param tag: The POS tag, or None
+        :type tag: str
+        :param supertags: The supertags of the word
+        :type supertags: list(Supertag)
+        :return: The supertags kept
+        :rtype: list(Supertag)
+        """
+        if tag in self.tag_pos:
+            allowed = self.tag_pos[tag]
+            kept = [s for s in supertags if s.morph[0][1] in allowed]
+            if len(kept) > 0:
+                supertags = kept
+        if self.k == None or len(supertags) <= self.k:
+            return supertags
+        # sorted() is stable, ties keep the order of the grammar
+        return sorted(supertags, key=lambda s: self.score(word, tag, s),
+                      reverse=True)[:self.k]
+
+class FrequencyPruner(SupertagPruner):
+    """
+    Rank the supertags by how often the word selected the tree in the
+    training data, then how often the POS did, then how often the tree
+    was used at all.
+    """
+    def __init__(self, k=None):
+        SupertagPruner.__init__(self, k)
+        self.word_counts = defaultdict(int)
+        self.pos_counts = defaultdict(int)
+        self.tree_counts = defaultdict(int)
+
+    def count(self, word, tag, pos, name):
+        self.word_counts[(word, name)] += 1
+        self.pos_counts[(pos, name)] += 1
+        self.tree_counts[name] += 1
+
+    def score(self, word, tag, supertag):
+        pos = supertag.morph[0][1]
+        return (self.word_counts[(word.lower(), supertag.name)],
+                self.pos_counts[(pos, supertag.name)],
+                self.tree_counts[supertag.name])
+
+class NaiveBayesPruner(SupertagPruner):
+    """
+    Rank the supertags by the probability of the tree given the word, its
+    suffix, its POS tag and its POS in the grammar, with a naive Bayes
+    classifier trained on the training data.
+    """
+    def __init__(self, k=None):
+        SupertagPruner.__init__(self, k)
+        self.featuresets = []
+        self.classifier = None
+
+    def features(self, word, tag, pos):
+        """
+        :return: The features of a word for the classifier
+        :rtype: dict
+        """
+        return {'word': word, 'suffix': word[-3:], 'tag': tag, 'pos': pos}
+
+    def train(self, sents):
+        SupertagPruner.train(self, sents)
+        if len(self.featuresets) > 0:
+            self.classifier = NaiveBayesClassifier.train(self.featuresets)
+
+    def count(self, word, tag, pos, name):
+        self.featuresets.append((self.features(word, tag, pos), name))
+
+    def score(self, word, tag, supertag):
+        if self.classifier == None:
+            return 0
+        features = self.features(word.lower(), tag, supertag.morph[0][1])
+        return self.classifier.prob_classify(features).prob(supertag.name)
+
+####################################
+# Chart Parser #####################
+####################################
+
+class ParseForest(object):
+    """
+    The chart of a parse, which is also a packed derivation forest. Every
+    item is kept once, together with all the ways to derive it, so the
+    chart has a polynomial size even if the sentence has exponentially
+    many derivations. derivations() unpacks them one at a time.
+
+    The items are tuples:
+
+        ('T', s, node, i, j, f1, f2)      the top of a node after adjunction
+        ('B', s, node, i, j, f1, f2)      the bottom of a node
+        ('D', s, node, d, i, j, f1, f2)   the first d children of a node
+
+    where s is the index of the supertag, node is the number of the node
+    in the supertag, the node spans words i to j, and if the foot node is
+    under the node then it spans f1 to f2, or else both are None.
+
+    ``items`` maps every item to a list of ways to derive it, each being
+    a tuple of a rule name and the items it is made of.
+    """
+    def __init__(self, words, supertags):
+        self.words = words
+        self.supertags = supertags
+        self.items = {}
+        self.goals = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def count(self):
+        """
+        :return: The number of derivations of the sentence. Cyclic
+        derivations, e.g. adjoining on an empty span again and again, are
+        not counted.
+        :rtype: int
+        """
+        memo = {}
+        total = 0
+        for goal in self.goals:
+            total += self._count(goal, memo, set())
+        return total
+
+    def _count(self, item, memo, path):
+        if item in memo:
+            return memo[item]
+        if item in path:
+            return 0
+        path.add(item)
+        total = 0
+        for (rule, parts) in self.items[item]:
+            product = 1
+            for part in parts:
+                product *= self._count(part, memo, path)
+                if product == 0:
+                    break
+            total += product
+        path.remove(item)
+        memo[item] = total
+        return total
+
+    def derivations(self):
+        """
+        :return: The derivation trees of the sentence, one at a time. The
+        label of a node is the supertag, and the label of a child also
+        tells how it is attached, e.g. 'subst NP_0 <name>[word]'.
+        :rtype: iter(Tree)
+        """
+        for goal in self.goals:
+            for tree in self._elementary(goal, '', set()):
+                yield tree
+
+    def _elementary(self, root, prefix, path):
+        label = prefix + self.supertags[root[1]].label()
+        for attached in self._attached(root, path):
+            yield Tree(label, attached)
+
+    def _attached(self, item, path):
+        # The trees attached to the elementary tree under the item
+        if item in path:
+            return
+        path.add(item)
+        for (rule, parts) in self.items[item]:
+            if rule == 'subst':
+                node = self.supertags[item[1]].labels[item[2]]
+                for tree in self._elementary(parts[0], 'subst %s ' % (node),
+                                             path):
+                    yield [tree]
+            elif rule == 'adjoin':
+                node = self.supertags[item[1]].labels[item[2]]
+                for tree in self._elementary(parts[0], 'adjoin %s ' % (node),
+                                             path):
+                    for attached in self._attached(parts[1], path):
+                        yield attached + [tree]
+            else:
+                for attached in self._product(parts, path):
+                    yield attached
+        path.remove(item)
+
+    def _product(self, parts, path):
+        if len(parts) == 0:
+            yield []
+            return
+        for first in self._attached(parts[0], path):
+            for rest in self._product(parts[1:], path):
+                yield first + rest
+
+class ChartParser(object):
+    """
+    A bottom-up CKY style chart parser for TAG. The words of the sentence
+    select their elementary trees with word_to_features(), like
+    lex_search() does, and the trees are combined by substitution and
+    adjunction as chart operations over spans, so no tree is copied
+    during parsing. An optional SupertagPruner keeps the best trees of
+    every word before they are copied.
+
+    Only the categories of the nodes are checked in the chart, the
+    feature structures are not unified. A derivation can be checked
+    with tree_compatible() afterwards.
+    """
+    def __init__(self, alltrees, start=('S',), pruner=None):
+        """
+        :param alltrees: The TAG trees of the grammar
+        :type alltrees: TAGTreeSet
+        :param start: The categories of the root of a sentence, or None
+        for any category
+        :type start: tuple(str)
+        :param pruner: The pruning stage of the supertags, or None
+        :type pruner: SupertagPruner
+        """
+        self.alltrees = alltrees
+        self.start = start
+        self.pruner = pruner
+
+    def supertags(self, words, tags=None):
+        """
+        :param words: The sentence
+        :type words: list(str)
+        :param tags: The POS tags of the words, or None
+        :type tags: list(str)
+        :return: The supertags of all the words
+        :rtype: list(Supertag)
+        """
+        supertags = []
+        lex_lists = words_to_features(words)
+        for position in range(0, len(words)):
+            lex_list = lex_lists[position]
+            candidates = []
+            for (morph, name, tree) in lex_candidates(lex_list, self.alltrees):
+                supertag = Supertag(name, tree, position, words, morph[0])
+                if supertag.valid == True:
+                    supertag.entry = morph
+                    candidates.append(supertag)
+            if self.pruner != None:
+                if tags == None:
+                    tag = None
+                else:
+                    tag = tags[position]
+                candidates = self.pruner.prune(words[position], tag,
+                                               candidates)
+            for supertag in candidates:
+                # Only the trees kept are copied, see lex_search()
+                morph = supertag.entry
+                supertag.tree = supertag.tree.cow_copy()
+                supertag.tree.init_lex(morph[0], morph[3], morph[4])
+                if supertag.tree.can_lexicalize():
+                    supertags.append(supertag)
+        return supertags
+
+    def parse(self, words, tags=None):
+        """
+        :param words: The sentence, or a string to be tokenized
+        :type words: list(str) / str
+        :param tags: The POS tags of the words, or None
+        :type tags: list(str)
+        :return: The chart of the sentence
+        :rtype: ParseForest
+        """
+        if isinstance(words, basestring):
+            words = word_tokenize(words)
+        return self.parse_supertags(words, self.supertags(words, tags))
+
+    def parse_supertags(self, words, supertags):
+        """
+        :param words: The sentence
+        :type words: list(str)
+        :param supertags: The supertags of the words
+        :type supertags: list(Supertag)
+        :return: The chart of the sentence
+        :rtype: ParseForest
+        """
+        forest = ParseForest(words, supertags)
+        items = forest.items
+        agenda = []
+        n = len(words)
+        lower = [word.lower() for word in words]
+
+        def add(item, rule, parts):
+            if item in items:
+                items[item].append((rule, parts))
+            else:
+                items[item] = [(rule, parts)]
+                agenda.append(item)
+
+        # The substitution nodes of every category
+        sites = {}
+        for s in range(0, len(supertags)):
+            supertag = supertags[s]
+            for node in range(0, len(supertag.labels)):
+                kind = supertag.kinds[node]
+                if kind == 'subst':
+                    category = supertag.categories[node]
+                    if category not in sites:
+                        sites[category] = []
+                    sites[category].append((s, node))
+                elif kind == 'word':
+                    word = supertag.words[node].lower()
+                    if node == supertag.pinned:
+                        positions = [supertag.position]
+                    else:
+                        positions = [i for i in range(0, n) if lower[i] == word]
+                    for i in positions:
+                        add(('B', s, node, i, i + 1, None, None), 'word', ())
+                elif kind == 'empty':
+                    for i in range(0, n + 1):
+                        add(('B', s, node, i, i, None, None), 'empty', ())
+                elif kind == 'foot':
+                    for i in range(0, n + 1):
+                        for j in range(i, n + 1):
+                            add(('B', s, node, i, j, i, j), 'foot', ())
+
+        # (s, node, i) -> top items of the node starting at i
+        tops = {}
+        # (s, node, i) -> dotted items waiting for the node at i
+        waiting = {}
+        # (category, i, j) -> bottom items of inner nodes
+        bottoms = {}
+        # (category of foot, f1, f2) -> top items of auxiliary roots
+        aux_roots = {}
+
+        while len(agenda) > 0:
+            item = agenda.pop()
+            supertag = supertags[item[1]]
+            node = item[2]
+            if item[0] == 'T':
+                (s, node, i, j, f1, f2) = item[1:]
+                key = (s, node, i)
+                if key not in tops:
+                    tops[key] = []
+                tops[key].append(item)
+                for dotted in waiting.get(key, []):
+                    self._combine(dotted, item, add)
+                parent = supertag.parents[node]
+                if parent != None:
+                    if supertag.children[parent][0] == node:
+                        add(('D', s, parent, 1, i, j, f1, f2), 'first', (item,))
+                elif supertag.foot == None:
+                    # The root of an initial tree
+                    if i == 0 and j == n and \
+                       (self.start == None or supertag.category in self.start):
+                        forest.goals.append(item)
+                    for (s2, leaf) in sites.get(supertag.category, []):
+                        add(('T', s2, leaf, i, j, None, None), 'subst', (item,))
+                else:
+                    # The root of an auxiliary tree
+                    key = (supertag.foot_category, f1, f2)
+                    if key not in aux_roots:
+                        aux_roots[key] = []
+                    aux_roots[key].append(item)
+                    for bottom in bottoms.get(key, []):
+                        add(('T', bottom[1], bottom[2], i, j) + bottom[5:],
+                            'adjoin', (item, bottom))
+            elif item[0] == 'D':
+                (s, node, d, i, j, f1, f2) = item[1:]
+                children = supertag.children[node]
+                if d == len(children):
+                    add(('B', s, node, i, j, f1, f2), 'complete', (item,))
+                else:
+                    key = (s, children[d], j)
+                    if key not in waiting:
+                        waiting[key] = []
+                    waiting[key].append(item)
+                    for top in tops.get(key, []):
+                        self._combine(item, top, add)
+            else:
+                (s, node, i, j, f1, f2) = item[1:]
+                add(('T', s, node, i, j, f1, f2), 'noadjoin', (item,))
+                if supertag.kinds[node] in ['inner', 'word']:
+                    # Adjunction on inner nodes and anchors
+                    key = (supertag.categories[node], i, j)
+                    if key not in bottoms:
+                        bottoms[key] = []
+                    bottoms[key].append(item)
+                    for root in aux_roots.get(key, []):
+                        add(('T', s, node, root[3], root[4], f1, f2),
+                            'adjoin', (root, item))
+        return forest
+
+    def _combine(self, dotted, top, add):
+        # Move the dot of a dotted item over the top item of the next child
+        (s, node, d, i, j, f1, f2) = dotted[1:]
+        if f1 != None and top[5] != None:
+            # Only one foot in a tree
+            return
+        if f1 == None:
+            (f1, f2) = top[5:]
+        add(('D', s, node, d + 1, i, top[4], f1, f2), 'combine', (dotted, top))
+
+def chart_parse(words, alltrees, start=('S',)):
+    """
+    Parse a sentence with ChartParser
+
+    :param words: The sentence, or a string to be tokenized
+    :type words: list(str) / str
+    :param alltrees: The TAG trees of the grammar
+    :type alltrees: TAGTreeSet
+    :return: The chart of the sentence
+    :rtype: ParseForest
+    """
+    return ChartParser(alltrees, start).parse(words)
+
+####################################
+# Debugging information ############
+####################################
+
+def debug_chart_parse():
+    t = load('english')
+    forest = chart_parse('John made short work of the cake', t)
+    print len(forest.supertags), 'supertags', len(forest), 'items',
+    print forest.count(), 'derivations'
+    for tree in forest.derivations():
+        print tree
+
+def debug_supertag_pruning():
+    t = load('english')
+    pruner = NaiveBayesPruner(2)
+    pruner.train(tagged_file_parse(open('sample-data/input_tagged.txt')))
+    parser = ChartParser(t, pruner=pruner)
+    words = ['the', 'cat', 'cried']
+    tags = ['DT', 'NN', 'VBZ']
+    for supertag in parser.supertags(words, tags):
+        print supertag
+
+if __name__ == '__main__':
+    debug_chart_parse()
+    debug_supertag_pruning()
@@ -89,7 +89,8 @@ class LexView(object):
             else:
                 self._treeview._sfs_button['text'] = 'Add Start Features'
             if tree._lex:
-                tree.lexicalize()
+                if tree.lexicalize() == False:
+                    return
                 tree._lex = False
                 self._treeview._tw.redraw(self._treeview._show_fs, tree)
             else:
@@ -144,22 +145,11 @@ class LexView(object):
         self._tagset = TAGTreeSet()
         self._e.delete(0, END)
         self._treeview.clear()
-        for word in words:
+        for (word, lex_list) in zip(words, words_to_features(words)):
             self._tagset[word] = TAGTreeSet()
             fset = self._tagset[word]
-            lex_list = word_to_features(word)
             self.lexicalize_tagset(lex_list, fset)
-            for morph in lex_list:
-                if len(morph[0]) > 1:
-                    phrases = [v[0] for v in morph[0]]
-                    if phrases == words:
-                        index = ''
-                        for i in phrases:
-                            index = index + i + ' '
-                        if not index in self._tagset:
-                            self._tagset[index] = TAGTreeSet()
-                        fset = self._tagset[index]
-                        self.lexicalize_tagset([morph], fset)
+        self.lexicalize_phrases(words)
         self._tagset.set_start_fs(self._alltrees.start_fs)
         self._treeview.update(self._tagset)
         self._count = {}
@@ -202,26 +192,30 @@ class LexView(object):
         self.clean_anchor()
         self._tagset = TAGTreeSet()
         self._treeview.clear()
-        for word in words:
+        for (word, lex_list) in zip(words, words_to_features(words)):
             self._tagset[word] = TAGTreeSet()
             fset = self._tagset[word]
-            lex_list = word_to_features(word)
             self.lexicalize_tagset(lex_list, fset)
-            for morph in lex_list:
-                if len(morph[0]) > 1:
-                    phrases = [v[0] for v in morph[0]]
-                    if words == phrases:
-                        index = ''
-                        for i in phrases:
-                            index = index + i + ' '
-                        if not isinstance(self._tagset[index], TAGTreeSet):
-                            self._tagset[index] = TAGTreeSet()
-                        fset = self._tagset[index]
-                        self.lexicalize_tagset([morph], fset)
+        self.lexicalize_phrases(words)
         self._tagset.set_start_fs(self._alltrees.start_fs)
         self._treeview.update(self._tagset)
         self._count = {}
 
+    def lexicalize_phrases(self, words):
+        """
+        Lexicalize the trees of the multi-word entries found anywhere in
+        the words, e.g. "made short work of", under the phrase
+        :param words: the words in the viewer
+        :type: list(str)
+        """
+        for (start, end, lex_list) in find_phrases(words):
+            index = ''
+            for word in words[start:end]:
+                index = index + word + ' '
+            if not index in self._tagset:
+                self._tagset[index] = TAGTreeSet()
+            self.lexicalize_tagset(lex_list, self._tagset[index])
+
     def lexicalize_tagset(self, lex_list, fset):
         """
         Lexicalize all TAG tree set
@@ -250,13 +244,10 @@ class LexView(object):
                     else:
                         key = tf[:-5] + '_' + str(self._count[ckey]) + '.trees'
                     sset[key] = TAGTreeSet()
-                    index = None
-                    for sub in self._alltrees:
-                        if tf in self._alltrees[sub]:
-                            index = sub
+                    index = self._alltrees.family_section(tf)
                     if not index:
                         raise NameError('No tree fmaily')
-                    sset[key] += self._alltrees[index][tf].copy(True)
+                    sset[key] += self._alltrees[index][tf].cow_copy()
                     for t in sset[key]:
                         if sset[key][t]._lex:
                             sset[key][t]._lex_fs
@@ -270,10 +261,9 @@ class LexView(object):
                         self._count[ckey] = 0
                     else:
                         key = t + '_' + str(self._count[ckey])
-                    for sub in self._alltrees:
-                        for tr in self._alltrees[sub]:
-                            if t in self._alltrees[sub][tr]:
-                                sset[key] = self._alltrees[sub][tr][t].copy(True)
+                    tree = self._alltrees.find_tree(t)
+                    if tree is not None:
+                        sset[key] = tree.cow_copy()
                     self._count[ckey] += 1
                     if not isinstance(sset[key], TAGTree):
                         raise TypeError('Not TAGTree')
@@ -9,10 +9,220 @@
 
 
 from LL1 import jump_over_space
-from nltk.featstruct import FeatStruct
+from nltk.featstruct import FeatStruct, FeatDict, CustomFeatureValue, UnificationFailure
 import re
 import copy
 
+#################################
+# Disjunctive values ############
+#################################
+
+# A leaf node of a feature structure is a FeatStruct with a single entry
+# '__value__', whose value is a Disjunction. The leaf is a FeatStruct of its
+# own because the identity of a leaf is what makes a reference between two
+# paths, e.g. S_r.b:<agr> = VP.t:<agr>. A leaf with no entry is a value which
+# is not known yet.
+VALUE_KEY = '__value__'
+
+class ValueRegistry(object):
+    """
+    The values of every feature in the grammar, and a bit for every value,
+    so that a disjunction can be stored as an integer bitmask. Each feature
+    has a small closed value set, but the bits are allocated across all the
+    features, because one leaf may be shared by two features, e.g. by case
+    and assign-case. A value gets its bit when it is first seen.
+    """
+    def __init__(self):
+        self.bits = {}
+        self.features = {}
+
+    def bit(self, atom):
+        """
+        :param atom: An atomic value
+        :type atom: str
+        :return: The bit of the value
+        :rtype: int
+        """
+        bit = self.bits.get(atom)
+        if bit == None:
+            bit = 1 << len(self.bits)
+            self.bits[atom] = bit
+        return bit
+
+    def mask(self, values):
+        """
+        :param values: Some atomic values
+        :type values: iter(str)
+        :return: The bitmask of the values
+        :rtype: int
+        """
+        mask = 0
+        for atom in values:
+            mask |= self.bit(atom)
+        return mask
+
+    def register(self, name, values):
+        """
+        Record the values of a feature
+        :param name: The name of the feature, e.g. case
+        :type name: str
+        :param values: The values found for the feature
+        :type values: iter(str)
+        """
+        if name not in self.features:
+            self.features[name] = set()
+        self.features[name].update(values)
+        self.mask(values)
+
+    def feature_values(self, name):
+        """
+        :param name: The name of the feature, e.g. case
+        :type name: str
+        :return: All the values of the feature seen in the grammar
+        :rtype: frozenset
+        """
+        return frozenset(self.features.get(name, ()))
+
+# The registry of the whole grammar
+value_registry = ValueRegistry()
+
+class Disjunction(frozenset, CustomFeatureValue):
+    """
+    An immutable set of atomic values, one of which is the value of a
+    feature, e.g. nom/acc. Unifying two disjunctions gives their
+    intersection, and fails if the intersection is empty.
+
+    ``mask`` is the bitmask of the values in ``value_registry``, so
+    containment and intersection tests are integer ANDs.
+    """
+    def __getattr__(self, name):
+        # make_disjunction() sets the mask, this is for other disjunctions
+        if name == 'mask':
+            self.mask = value_registry.mask(self)
+            return self.mask
+        raise AttributeError(name)
+
+    def unify(self, other):
+        if not isinstance(other, Disjunction):
+            other = make_disjunction([other])
+        common = self.mask & other.mask
+        if common == 0:
+            return UnificationFailure
+        return mask_to_disjunction(common, self, other)
+
+    def __reduce__(self):
+        # The bitmask is not saved, since the bits are only valid in the
+        # registry of this process
+        return (make_disjunction, (list(self),))
+
+    def __cmp__(self, other):
+        if not isinstance(other, frozenset):
+            return 1
+        return cmp(sorted(self), sorted(other))
+
+    # The operators of frozenset are used instead of __cmp__
+    __eq__ = frozenset.__eq__
+    __ne__ = frozenset.__ne__
+    __hash__ = frozenset.__hash__
+
+    def __repr__(self):
+        return '/'.join(sorted(self))
+
+    __str__ = __repr__
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+#################################
+# Intern table ##################
+#################################
+
+# The same feature names and values appear in thousands of equations across
+# the grammar. They are all interned, so every copy is the same string
+# object in memory and is written only once into a pickle. Disjunctions are
+# immutable, so equal ones are also shared.
+
+# Parsed disjunctions, e.g. 'nom/acc' -> Disjunction(['nom','acc']), and
+# frozenset(['nom','acc']) -> Disjunction(['nom','acc'])
+disjunction_table = {}
+# Bitmasks of the disjunctions -> Disjunction
+mask_table = {}
+
+def intern_atom(s):
+    """
+    :param s: A feature name, a path or an atomic value
+    :type s: str
+    :return: The interned string, other objects are returned as they are
+    :rtype: str
+    """
+    if type(s) == str:
+        return intern(s)
+    return s
+
+def make_disjunction(values):
+    """
+    :param values: The atomic values in the 'or' relation
+    :type values: iter(str)
+    :return: The shared disjunction of these values
+    :rtype: Disjunction
+    """
+    values = frozenset([intern_atom(i) for i in values])
+    value = disjunction_table.get(values)
+    if value == None:
+        value = Disjunction(values)
+        value.mask = value_registry.mask(values)
+        disjunction_table[values] = value
+        mask_table[value.mask] = value
+    return value
+
+def mask_to_disjunction(mask, value_1, value_2):
+    """
+    :param mask: The bitmask of the intersection of two disjunctions
+    :type mask: int
+    :param value_1: One of the disjunctions
+    :type value_1: Disjunction
+    :param value_2: Another disjunction
+    :type value_2: Disjunction
+    :return: The shared disjunction of the intersection
+    :rtype: Disjunction
+    """
+    value = mask_table.get(mask)
+    if value == None:
+        value = make_disjunction(frozenset.intersection(value_1, value_2))
+    return value
+
+def make_leaf(value=None):
+    """
+    :param value: The value of the leaf, None for a value not known yet
+    :type value: Disjunction
+    :return: A new leaf node
+    :rtype: FeatStruct
+    """
+    leaf = FeatStruct()
+    if value != None:
+        leaf[VALUE_KEY] = value
+    return leaf
+
+def leaf_value(fs):
+    """
+    :param fs: A leaf node
+    :type fs: FeatStruct
+    :return: The value of the leaf, None if it is not known yet
+    :rtype: Disjunction
+    """
+    return dict.get(fs, VALUE_KEY)
+
+def clear_intern_table():
+    """
+    Clear the table of parsed disjunctions. The interned strings are
+    released by Python when they are not used any more.
+    """
+    disjunction_table.clear()
+    mask_table.clear()
+
 #################################
 # Node testing functions ########
 #################################
@@ -22,43 +232,26 @@ def test_leaf(fs):
     :param fs: The feature you want to test
     :type fs: FeatStruct
 
-    :return: True means this is a leaf node, including a multiple entry "__or_"
-    node or a single entry node.
+    :return: True means this is a leaf node, including a multiple entry
+    node, a single entry node or an empty node.
     :rtype: bool
 
     This function will test whether a feature structure is a leaf node in
-    the directed graph, by testing all of its keys to see if there is a
-    prefix '__or_' for every left hand side (lhs) string. If this is true
-    then we can make sure that we have reached the bottom of the feature structure
-    graph, and the function will return true, and for some recursivelly
-    implemented procedures this means the recursion will return.
-
-    Also please note that we cannot expect a mixture of '__or_' and non '__or_'
-    entry, this is an inconsistency. But this function will not throw exception
-    and will just return a False (because a non '__or_' is detected)
+    the directed graph, i.e. its only entry is '__value__' or it has no
+    entry at all. If this is true then we can make sure that we have reached
+    the bottom of the feature structure graph, and the function will return
+    true, and for some recursivelly implemented procedures this means the
+    recursion will return.
 
-    [__or_123 = 123]
-    [__or_456 = 456] --> return True
+    [__value__ = 123/456] --> return True
 
-    [apple = [__or_red = red]] --> return False
+    [apple = [__value__ = red]] --> return False
     """
-    is_leaf = False
-    keys = fs.keys()
-    
-    if len(keys) == 0: # For empty features we regard it as leaf
+    length = len(fs)
+    if length == 0: # For empty features we regard it as leaf
         return True
-    elif keys[0][0:9] == '__value__':  # Just a hack to make backward compatibility
-        return True                    # Used in match_feature
-
-    for i in keys:
-        if i[0:5] != '__or_':
-            break
-    # This will be executed if we've not met a break
-    # in the for loop, which means all lhs are satisfied
-    else: 
-        is_leaf = True
-        
-    return is_leaf
+    # FeatStruct.__contains__ also accepts paths, dict's own one is faster
+    return length == 1 and dict.__contains__(fs, VALUE_KEY)
 
 def test_single_entry(fs):
     """
@@ -74,18 +267,17 @@ def test_single_entry(fs):
     If the feature structure given is not a leaf node then an excaption will be
     raised. For example:
 
-    fs = [__or_123 = '123'] -> True
+    fs = [__value__ = 123] -> True
                  
-    fs = [__or_123 = '123']
-         [__or_456 = '456'] -> False
+    fs = [__value__ = 123/456] -> False
 
-    fs = [apple = [__or_123 = '123']] -> exception
+    fs = [apple = [__value__ = 123]] -> exception
     """
     if test_leaf(fs) == False:
         raise ValueError('The feature structure is not a leaf node')
     else:
-        keys = fs.keys()
-        if len(keys) == 1:
+        value = leaf_value(fs)
+        if value != None and len(value) == 1:
             return True
         else:
             return False
@@ -99,10 +291,10 @@ def test_empty_entry(fs):
     :rtype: bool
 
     This function will test whether a given feature structuer is an empty entry fs.
-    which has the form [__or_ = ''], and this is the only form that will cause
-    a True to be returned. In other situations a False will be returned.
+    which is a leaf whose value is not known yet, made by make_leaf(). In other
+    situations a False will be returned.
     """
-    if fs.has_key('__or_') and len(fs.keys()) == 1:
+    if len(fs) == 0:
         return True
     else:
         return False
@@ -126,44 +318,29 @@ def test_contain(fs1,fs2):
     :rtype: integer/FeatStruct/None
 
     This function requires that fs1 and fs2 are leaf nodes, if they are not then an
-    an exception will be raised. Besides, since in a leaf node the left hand side
-    is actually derivable from the right hang side, so if we know one we can know
-    another. Based on this observation we just make comparisions to the left hand
-    side, i.e. keys().
+    an exception will be raised. The values of the leaves are compared as sets.
+    An empty entry has no intersection with a known value.
     """
     if test_leaf(fs1) == False or test_leaf(fs2) == False:
         raise ValueError('Two arguments must be leaf nodes.')
-    key_1 = fs1.keys()
-    key_2 = fs2.keys()
-    new_key_1 = []
-    new_key_2 = []
-    for i in key_1:
-        if i in key_2:
-            new_key_1.append(i)
-    for i in key_2:
-        if i in key_1:
-            new_key_2.append(i)
-    len_1 = len(key_1)
-    len_2 = len(key_2)
-    new_len_1 = len(new_key_1)
-    new_len_2 = len(new_key_2)
-    # Now new_len_1 and new_len_2 are the same keys in both fs, or both []
-    # means no same keys
-    #print new_key_1
-    #print new_key_2
-    if new_len_1 == 0 and new_len_2 == 0:
+    value_1 = leaf_value(fs1)
+    value_2 = leaf_value(fs2)
+    if value_1 == None or value_2 == None:
+        if value_1 == None and value_2 == None:
+            return 0
         return None
-    elif len_1 != new_len_1 and len_2 != new_len_2:
-        ret = FeatStruct()
-        for i in new_key_1:
-            ret[i] = fs1[i]
-        return ret
-    elif len_1 == new_len_1 and len_2 != new_len_2:
-        return 1 # len_1 not changed, it is contained in len_2
-    elif len_1 != new_len_1 and len_2 == new_len_2:
-        return -1 # len_2 contained in len_1
-    else:
+    mask_1 = value_1.mask
+    mask_2 = value_2.mask
+    if mask_1 == mask_2:
         return 0 # Neigher has changed, so they are equal
+    common = mask_1 & mask_2
+    if common == 0:
+        return None
+    elif common == mask_1:
+        return 1 # value_1 is contained in value_2
+    elif common == mask_2:
+        return -1 # value_2 contained in value_1
+    return make_leaf(mask_to_disjunction(common, value_1, value_2))
 
 ##############################
 # Node Constructing ##########
@@ -171,20 +348,18 @@ def test_contain(fs1,fs2):
 
 def remove_or_tag(feature):
     """
-    :param feature: The feature structure that you want to remove the '__or_' tag
+    :param feature: The feature structure that you want to remove the leaf nodes
     :type feature: FeatStruct
 
-    :return: A new feature structure with "__or_" removed and combined
+    :return: A new feature structure with leaf nodes replaced by strings
     :rtype: FeatStruct
 
     Given a feature structure in the internal repersentation of our xtag system
-    (i.e. each leaf is wrapped with an '__or_' + lhs feature struct), this function
-    will get rid of the __or_ tag, and produce a feature structure where no __or_
-    is there, and the multiple or relation is represented as [__or_1]/[__or_2]/ ...
+    (i.e. each leaf is wrapped with a '__value__' feature struct), this function
+    will get rid of the leaf nodes, and produce a feature structure where the
+    multiple or relation is represented as a string a/b/c
 
-    e.g. for fs = [apple = [__or_a = 'a']]
-                  [        [__or_b = 'b']]
-                  [        [__or_c = 'c']]
+    e.g. for fs = [apple = [__value__ = a/b/c]]
                   
     remove_or_tag(fs) will return:
 
@@ -193,66 +368,47 @@ def remove_or_tag(feature):
     new_feature = FeatStruct()
     for key in feature.keys():
         entry = feature[key]
-        entry_keys = entry.keys()
         if test_leaf(entry) == True:
-            str_or_removed = entry[entry_keys[0]]
-            if len(entry_keys) > 1:
-                for i in entry_keys[1:]:
-                    str_or_removed += '/' + entry[i]
-                    
-            new_feature[key] = str_or_removed
+            value = leaf_value(entry)
+            if value == None:
+                new_feature[key] = ''
+            else:
+                new_feature[key] = str(value)
         else:
             new_feature[key] = remove_or_tag(feature[key])
     return new_feature
 
-def make_leaf_str(rhs):
-    """
-    :param rhs: A string in the right hand side
-    :type rhs: str
-
-    :return: The string with a '__or_' attached as prefix
-    :rtype: str
-
-    This simple function is mainly used to construct the LHS string using
-    an RHS string. For the current stage we just append a '__or_' to it.
-
-    For example:
-
-    rhs = 'wzq'
-    -> '__or_wzq'
-    """
-    return '__or_' + rhs
-
 def make_rhs_using_or(rhs):
     """
     :param rhs: The right hand string which may contain the 'or' relationship
     :type rhs: str
 
-    :return: A feature structure using '__or_' structure
+    :return: A leaf node whose value is a disjunction
     :rtype: FeatStruct
 
     This function will return a feature structure which satisfies the
     requirement for implementing the 'or' relationship in the xtag grammar.
-    rhs must be a string, whose value will be used to construct the lhs
-    inside the new feature structure.
+    rhs must be a string, whose value will be split into the atoms of the
+    disjunction.
 
     For example,
 
-    rhs = a/b/c ->  [ __or_a = a ]
-                    [ __or_b = b ]
-                    [ __or_c = c ]
+    rhs = a/b/c ->  [ __value__ = a/b/c ]
     """
-    new_fs = FeatStruct()
-    slash = rhs.find('/')
-    if slash == -1:
-        rhs = [rhs]
-    else:
-        rhs = rhs.split('/')
-    # After this rhs is a list containing the entities in the 'or' relation
-    for i in rhs:
-        lhs = make_leaf_str(i)
-        new_fs[lhs] = i
-    return new_fs
+    value = disjunction_table.get(rhs)
+    if value == None:
+        slash = rhs.find('/')
+        if slash == -1:
+            values = [rhs]
+        else:
+            values = rhs.split('/')
+        # After this values is a list containing the entities in the 'or'
+        # relation
+        value = make_disjunction(values)
+        disjunction_table[intern_atom(rhs)] = value
+    # The leaf itself must be a new object, because its identity is what
+    # makes references between feature structures
+    return make_leaf(value)
 
 def make_fs(lhs,rhs,ref=0):
     # This function makes a feature structure using a list of lhs which are nested
@@ -276,7 +432,7 @@ def make_fs(lhs,rhs,ref=0):
     
     lhs = ['a','b','c','d']
     rhs = 'wzq'
-    ->FeatStruct = [a = [b = [c = [d = [__or_wzq = 'wzq']]]]]
+    ->FeatStruct = [a = [b = [c = [d = [__value__ = wzq]]]]]
     """
     new_fs = FeatStruct()
     
@@ -288,14 +444,15 @@ def make_fs(lhs,rhs,ref=0):
         # rhs, and it must be a string
         if ref == 0:
             rhs = make_rhs_using_or(rhs)
+            value_registry.register(lhs[0], leaf_value(rhs))
         elif ref == 1:
             pass # Do nothing
         else:
             raise ValueError('Undefined ref value %d' % (ref))
         
-        new_fs[lhs[0]] = rhs
+        new_fs[intern_atom(lhs[0])] = rhs
     else:
-        new_fs[lhs[0]] = make_fs(lhs[1:],rhs,ref) # Recursively call
+        new_fs[intern_atom(lhs[0])] = make_fs(lhs[1:],rhs,ref) # Recursively call
         
     return new_fs
 
@@ -311,8 +468,8 @@ def add_new_fs(fs,lhs,rhs,ref=0):
     :type ref: 0 / 1
 
     This function will add the feature structure defined by lhs and rhs
-    into an existing feature fs. The lhs of the lowest level is defined
-    to be '__or_' + rhs to facilitate other procedures.
+    into an existing feature fs. The lowest level is a leaf node made by
+    make_rhs_using_or() to facilitate other procedures.
 
     If any of the paths defined by lhs has already existed in fs, then
     it will be merged into that existing path, instead of erasing the existing
@@ -326,7 +483,7 @@ def add_new_fs(fs,lhs,rhs,ref=0):
     rhs = 'wzq'
     ->
     [a = [['www']                                ]
-    [    [b = [c = [d = [e = [__or_wzq = 'wzq']]]]
+    [    [b = [c = [d = [e = [__value__ = wzq]]]]
     """
     if len(lhs) == 1:
         #inner = FeatStruct()
@@ -337,16 +494,18 @@ def add_new_fs(fs,lhs,rhs,ref=0):
         # But if ref == 1 then we are just making references, so we will not
         # process rhs, but only attach it to the existing feature structure
         if ref == 0:
-            fs[lhs[0]] = make_rhs_using_or(rhs)
+            leaf = make_rhs_using_or(rhs)
+            value_registry.register(lhs[0], leaf_value(leaf))
+            fs[intern_atom(lhs[0])] = leaf
         elif ref == 1:
-            fs[lhs[0]] = rhs
+            fs[intern_atom(lhs[0])] = rhs
         else:
             raise ValueError('Undefined ref value %d' % (ref))
     else:
         if fs.has_key(lhs[0]):
             add_new_fs(fs[lhs[0]],lhs[1:],rhs,ref)
         else:
-            fs[lhs[0]] = FeatStruct()
+            fs[intern_atom(lhs[0])] = FeatStruct()
             add_new_fs(fs[lhs[0]],lhs[1:],rhs,ref)
     return
 
@@ -647,12 +806,11 @@ def modify_feature_reference(feature,path,ref):
 
     This function will change the feature structure in-place.
     
-    e.g. fs = [apple = [orange = [__or_wzq = 'wzq']]]
-                       [         [__or_123 = '123']]]
+    e.g. fs = [apple = [orange = [__value__ = 123/wzq]]]
          path = ['apple','orange']
-         ref = [__or_qwer = 'qwer']
+         ref = [__value__ = qwer]
          modify_feature_reference(fs,path,ref) ->
-                       [apple = [orange = [__or_qwer = 'qwer']]         
+                       [apple = [orange = [__value__ = qwer]]]
     """
     current_fs = feature
     # Only go (n-1) steps, where n is the length of the path
@@ -687,31 +845,25 @@ def modify_feature_entry(feature,path,rhs,lhs=None):
     the value of lhs will be ignored, but you can always add one in order
     to achieve some consistency.
 
-    For example, fs = [apple = [orange = [__or_wzq = 'wzq']]]
+    For example, fs = [apple = [orange = [__value__ = wzq]]]
                  path = [apple,orange], rhs = 'www'
                  modify_feature_entry(fs,path,rhs) ->
-                      [apple = [orange = [__or_www = 'www']]]
+                      [apple = [orange = [__value__ = www]]]
 
-    Because the internal repersentation of the feature structure is different
-    from what it looks like, i.e. we adapted the (__or_ + lhs) lhs to deal with
-    the situation where we must handle "or" relation in one feature structure
-    which is not supported by FeatStruct (or we cannot find a more simpler one).
-    So the function provides another parameter called lhs, which is by default
+    Because the value of a leaf may be a disjunction of several values, the
+    function provides another parameter called lhs, which is by default
     a None object, but you can assign value to it under some condition. If the
-    target feature struct is a __or_ structure, which has multiple __or_ entries
-    you must specify which one you would like to modify, or if it is detected that
-    there are multiple entries but no lhs was specified, the function will throw
-    out an error.
+    target leaf has a disjunction of multiple values you must specify which
+    one you would like to modify, or if it is detected that there are multiple
+    values but no lhs was specified, the function will throw out an error.
 
-    Also notice that lhs is the string where __or_ is removed, or to say, lhs
-    is actually the old rhs of the entry which we want to remove.
+    Also notice that lhs is actually the old rhs of the entry which we want
+    to remove.
 
-    For example, fs = [apple = [orange = [__or_wzq = 'wzq']]]
-                      [                  [__or_123 = '123']]]
+    For example, fs = [apple = [orange = [__value__ = 123/wzq]]]
                  path = [apple,orange], rhs = 'www', lhs = 'wzq'
                  modify_feature_entry(fs,path,rhs,lhs) ->
-                      [apple = [orange = [__or_www = 'www']]]
-                      [                  [__or_123 = '123']]]
+                      [apple = [orange = [__value__ = 123/www]]]
     """
     # We must make a copy of the feature and modify on that copy
     # or the original feature structure will be affected and other
@@ -727,11 +879,15 @@ def modify_feature_entry(feature,path,rhs,lhs=None):
             raise KeyError('No such node %s in the feature structure' % (node))
 
     if test_single_entry(current_fs) == True:
-        # Remove the only entry, since we have been assurred there is only 1
-        current_fs.pop(current_fs.keys()[0])
+        # Replace the only entry, since we have been assurred there is only 1
+        values = [rhs]
     else:
-        current_fs.pop(make_leaf_str(lhs))
-    current_fs[make_leaf_str(rhs)] = rhs
+        values = list(leaf_value(current_fs))
+        if lhs not in values:
+            raise KeyError('No such value %s in the feature structure' % (lhs))
+        values.remove(lhs)
+        values.append(rhs)
+    current_fs[VALUE_KEY] = make_disjunction(values)
     
     return returned_fs
 
@@ -743,7 +899,7 @@ def get_all_path(fs):
     :rtype: list(list(str))
 
     This function will retuen all possible paths in a feature structure. The
-    term path means one way from the root to a leaf (not including __or_ level)
+    term path means one way from the root to a leaf (not including __value__ level)
     and each path is repersented by a list, the element of which is the node name
     (i.r. LHS in the feature structure).
 
@@ -754,18 +910,15 @@ def get_all_path(fs):
 
     fs = 
 
-    [ comp  = [ __or_nil = 'nil' ]                  ]
-    [                                               ]
-    [ mode  = [ __or_imp = 'imp' ]                  ]
-    [         [ __or_ind = 'ind' ]                  ]
-    [                                               ]
-    [         [ struct = [ __or_nil = 'nil' ]     ] ]
-    [         [                                   ] ]
-    [ punct = [          [ __or_excl  = 'excl'  ] ] ]
-    [         [ term   = [ __or_per   = 'per'   ] ] ]
-    [         [          [ __or_qmark = 'qmark' ] ] ]
-    [                                               ]
-    [ wh    = [ __or_<invlink> = '<invlink>' ]      ]
+    [ comp  = [ __value__ = nil ]                           ]
+    [                                                       ]
+    [ mode  = [ __value__ = imp/ind ]                       ]
+    [                                                       ]
+    [         [ struct = [ __value__ = nil ]              ] ]
+    [ punct = [                                           ] ]
+    [         [ term   = [ __value__ = excl/per/qmark ]   ] ]
+    [                                                       ]
+    [ wh    = [ __value__ = <invlink> ]                     ]
 
     result = 
     
@@ -803,15 +956,11 @@ def get_element_by_path(fs,path):
 
     For example:
 
-    fs =    [          [ __or_a   = 'a'   ]              ]
-            [ apple  = [ __or_qwe = 'qwe' ]              ]
-            [          [ __or_wzq = 'wzq' ]              ]
-            [                                            ]
-            [ orange = [ more = [ __or_4567 = '4567' ] ] ]
-            [          [        [ __or_zxcv = 'zxcv' ] ] ]
+    fs =    [ apple  = [ __value__ = a/qwe/wzq ]                ]
+            [                                               ]
+            [ orange = [ more = [ __value__ = 4567/zxcv ] ] ]
     path = ['orange','more']
-    return =    [ __or_4567 = '4567' ]
-                [ __or_zxcv = 'zxcv' ]
+    return =    [ __value__ = 4567/zxcv ]
 
     path = ['orange','less']
     return = None
@@ -828,6 +977,26 @@ def get_element_by_path(fs,path):
 # Fix Unify Result ###########
 ##############################
 
+# The functions below walk two or three feature structures together, one
+# level at a time, instead of listing all paths with get_all_path() and
+# then looking every path up from the root with get_element_by_path(). The
+# nodes are visited in the same order, and a node that does not exist in a
+# feature structure is None, like get_element_by_path() returns.
+
+def child_node(fs,key):
+    """
+    :param fs: A node, or None
+    :type fs: FeatStruct / None
+    :param key: The feature
+    :type key: str
+    :return: The node of the feature, or None if fs is None or does not
+    have the feature
+    :rtype: FeatStruct / None
+    """
+    if fs == None:
+        return None
+    return fs.get(key)
+
 def restore_reference(new_feat,old_feat_1,old_feat_2):
     """
     Restore the reference relationship after doing unification to a feature structure.
@@ -845,7 +1014,7 @@ def restore_reference(new_feat,old_feat_1,old_feat_2):
     This function is used to solve the problem that in the feature structure set
     of a tree, which consists of many feature structures of different nodes, where
     many of the structures share the same RHS value, and these value is repersented
-    by independent feature structures, i.e. the '__or_' entity. But the unification
+    by independent feature structures, i.e. the leaf nodes. But the unification
     routine provided by the NLTK library will not consider these references, and
     it only re-creates everything and will not do a in-place change. So we need
     to restore these references.
@@ -853,31 +1022,30 @@ def restore_reference(new_feat,old_feat_1,old_feat_2):
     To do this we only need to compare between the new and old feature structures
     and copy the reference if they share common paths, or create new enteies.
     """
-    path_1 = get_all_path(old_feat_1)
-    path_2 = get_all_path(old_feat_2)
-    for i in path_1:
-        new_entry = get_element_by_path(new_feat,i)
-        if new_entry != None:  # That path exists
-            old_entry = get_element_by_path(old_feat_1,i) # Must return a result
-            # If there is __or_ then these two can be different so we must check
-            # But __or_ may also produce a brand-new feature struct, in this case
-            # no work should be done.
-            # e.g. [__or_123 = '123']
-            #      [__or_456 = '456'] unified with [__or_456 = '456']
-            # will return exactly the first one, and the reference goes to
-            # the first one. But if [__or_123 = '123'] and [__or_456 = '456']
-            # are unified, then the result is independent of both.
-            if old_entry == new_entry:  
-                modify_feature_reference(new_feat,i,old_entry)
-
-    for i in path_2:
-        new_entry = get_element_by_path(new_feat,i)
-        if new_entry != None:
-            old_entry = get_element_by_path(old_feat_2,i)
-            if old_entry == new_entry:
-                modify_feature_reference(new_feat,i,old_entry)
+    restore_reference_walk(new_feat,old_feat_1)
+    restore_reference_walk(new_feat,old_feat_2)
     return
 
+def restore_reference_walk(new_feat,old_feat):
+    # restore_reference() for one of the old feature structures
+    for key in old_feat.keys():
+        old_entry = old_feat[key]
+        new_entry = child_node(new_feat,key)
+        if test_leaf(old_entry) == True:
+            if new_entry != None:  # That path exists
+                # If there is a disjunction then these two can be different so we
+                # must check. But a disjunction may also produce a brand-new feature
+                # struct, in this case no work should be done.
+                # e.g. [__value__ = 123/456] unified with [__value__ = 456]
+                # will return exactly the second one, and the reference goes to
+                # the second one. But if [__value__ = 123/456] and
+                # [__value__ = 456/789] are unified, then the result is
+                # independent of both.
+                if old_entry == new_entry:
+                    new_feat[key] = old_entry
+        elif new_entry != None:
+            restore_reference_walk(new_entry,old_entry)
+
 def fill_in_empty_entry(fs1,fs2):
     """
     :param fs1: One of the feature structure acting as the target
@@ -910,16 +1078,17 @@ def fill_in_empty_entry(fs1,fs2):
     not expecting this kind of behaviour, then just make a deepcopy of the fs
     before calling this function.
     """
-    all_path = get_all_path(fs1)
-    for p in all_path:
-        old_value = get_element_by_path(fs2,p)
-        if old_value != None: # Such path exist in fs2
-            overwrite_value = get_element_by_path(fs1,p)
-            # Need to test respectively whether the entry is empty
-            if test_empty_entry(old_value) == True and test_empty_entry(overwrite_value) == False:
-                for i in overwrite_value.keys():
-                    old_value[i] = overwrite_value[i]
-                old_value.pop('__or_') # Remove the '__or_' entry
+    for key in fs1.keys():
+        overwrite_value = fs1[key]
+        old_value = child_node(fs2,key)
+        if test_leaf(overwrite_value) == True:
+            if old_value != None: # Such path exist in fs2
+                # Need to test respectively whether the entry is empty
+                if test_empty_entry(old_value) == True and test_empty_entry(overwrite_value) == False:
+                    # Fill in the value in-place to keep the references
+                    old_value[VALUE_KEY] = leaf_value(overwrite_value)
+        else:
+            fill_in_empty_entry(overwrite_value,old_value)
     return
 
 def search_correction(corr_list,item):
@@ -937,11 +1106,11 @@ def search_correction(corr_list,item):
     which are the two values before unification. And if there is a match, just
     return tuple[2], which is the new value after unification.
     """
+    item_id = id(item)
     for i in corr_list:
-        item_id = id(item)
         if item_id == id(i[1]) or item_id == id(i[2]):
             return i[0]
-        return None
+    return None
 
 def correct_other_nodes(corr_list,tree):
     """
@@ -961,18 +1130,31 @@ def correct_other_nodes(corr_list,tree):
     the nodes on the feature structures of other nodes. This record is exactly
     corr_list.
     """
+    # Map the id of both old values to the new value once, instead of
+    # searching the whole list for every leaf of every node
+    corrections = {}
+    for (new_entry,old_entry_1,old_entry_2) in corr_list:
+        corrections.setdefault(id(old_entry_1),new_entry)
+        corrections.setdefault(id(old_entry_2),new_entry)
     fs = tree.get_all_fs()
     fs_list = fs.values()
     for i in fs_list: # Enumerate all feature structures
-        path = get_all_path(i)
-        for j in path: # j is all paths in the feature
-            corr_check = search_correction(corr_list,j)
+        correct_references(i,corrections)
+    return
+
+def correct_references(fs,corrections):
+    # correct_other_nodes() for one feature structure
+    for key in fs.keys():
+        entry = fs[key]
+        if test_leaf(entry) == True:
+            corr_check = corrections.get(id(entry))
             if corr_check != None:
                 # If we find some entry whose value exists in the correction list
                 # then just change the value of that entry to the new entry
                 # we've just created in the new feature structure.
-                modify_feature_reference(i,j,corr_check)
-    return
+                fs[key] = corr_check
+        else:
+            correct_references(entry,corrections)
 
 def special_unify(fs1,fs2,tree1=None,tree2=None):
     """
@@ -998,14 +1180,35 @@ def special_unify(fs1,fs2,tree1=None,tree2=None):
     """
     new_fs = FeatStruct()
     correction_list = []
-    path_2 = get_all_path(fs2) # To save time, no path_1
-    for i in path_2:
-        item_1 = get_element_by_path(fs1,i)
-        if item_1 == None:
-            item_2 = get_element_by_path(fs2,i)
+    if special_unify_walk(fs1,fs2,new_fs,[],correction_list) == False:
+        return None # Conflict
+
+    # We do not need to check when item_2 != None, because we have already
+    # done it in the first walk. In other words, we have processed the overlapping
+    # paths, and what is left is to add those in fs1 but not in fs2 into the
+    # new feature structure
+    special_unify_rest(fs1,fs2,new_fs,[])
+
+    if tree1 != None:
+        correct_other_nodes(correction_list,tree1)
+    if tree2 != None:
+        correct_other_nodes(correction_list,tree2)
+    
+    return new_fs
+
+def special_unify_walk(fs1,fs2,new_fs,path,correction_list):
+    # Add the leaves of fs2 into new_fs, unified with those of fs1 at the
+    # same paths. fs1 may be None. Return False if there is a conflict.
+    for key in fs2.keys():
+        item_2 = fs2[key]
+        item_1 = child_node(fs1,key)
+        i = path + [key]
+        if test_leaf(item_2) == False:
+            if special_unify_walk(item_1,item_2,new_fs,i,correction_list) == False:
+                return False
+        elif item_1 == None:
             add_new_fs(new_fs,i,item_2,1) # ref == 1, we only do reference!!
         else:
-            item_2 = get_element_by_path(fs2,i)
             tc = test_contain(item_1,item_2) # Single entry is the same as multiple entry
             if tc == 1: # t1 is a subset of t2, we always use the smaller one
                 add_new_fs(new_fs,i,item_1,1)
@@ -1027,47 +1230,350 @@ def special_unify(fs1,fs2,tree1=None,tree2=None):
                 # Add new reference (new entry or existing entry)
                 add_new_fs(new_fs,i,new_entry,1)
             elif tc == None:
-                return None # Conflict
+                return False # Conflict
             # Partial intersection, return value is a new FeatStruct only contains
             # the intersection. But we do not need to correct this, since it
             # is brand-new
             else: 
                 add_new_fs(new_fs,i,tc,1)
             #if i[0] == 'comp': print tc
-
-    # We do not need to check when item_2 != None, because we have already
-    # done it in the first loop. In other words, we have processed the overlapping
-    # paths, and what is left is to add those in fs1 but not in fs2 into the
-    # new feature structure
-    path_1 = get_all_path(fs1)
-    for i in path_1:
-        item_2 = get_element_by_path(fs2,i)
-        if item_2 == None:
-            item_1 = get_element_by_path(fs1,i)
+    return True
+
+def special_unify_rest(fs1,fs2,new_fs,path):
+    # Add the leaves of fs1 which are not in fs2 into new_fs. fs2 may be
+    # None.
+    for key in fs1.keys():
+        item_1 = fs1[key]
+        item_2 = child_node(fs2,key)
+        i = path + [key]
+        if test_leaf(item_1) == False:
+            special_unify_rest(item_1,item_2,new_fs,i)
+        elif item_2 == None:
             add_new_fs(new_fs,i,item_1,1)
 
-    if tree1 != None:
-        correct_other_nodes(correction_list,tree1)
-    if tree2 != None:
-        correct_other_nodes(correction_list,tree2)
-    
-    return new_fs
+##############################
+# Unification Engine #########
+##############################
+
+class UnificationEngine(object):
+    """
+    A destructive unifier over the feature nodes of one or more trees, with
+    an undo trail for cheap backtracking.
+
+    Every FeatStruct node (a leaf or a node with features) is an element of
+    a union-find. Unifying two nodes links their classes, so after
+    S_r.b:<agr> = VP.t:<agr> has been unified the two paths really share one
+    node, instead of being re-linked afterwards with id() comparisons as in
+    correct_other_nodes(). The FeatStructs given to the engine are never
+    changed; the value of a leaf class and the features of a complex class
+    are kept by the engine, and resolve() builds new FeatStructs from them.
+
+    Every change is recorded on a trail, so that
+
+        mark = engine.mark()
+        if engine.unify(fs1, fs2) == False:
+            ...         # the engine is already back at mark
+        engine.undo(mark)
+
+    undoes an attempt without copying anything. Since undo must restore
+    the links exactly, the union-find uses union by rank but no path
+    compression.
+    """
+    def __init__(self):
+        # id(node) -> id of its parent in the union-find
+        self._parent = {}
+        # id(root) -> rank of the class
+        self._rank = {}
+        # id(leaf root) -> Disjunction or None
+        self._value = {}
+        # id(complex root) -> dict of feature -> node
+        self._arcs = {}
+        # id(node) -> node, which also keeps the nodes alive
+        self._nodes = {}
+        # id(node) -> id of the tree that added it by add_tree()
+        self._owner = {}
+        # id(tree) -> tree, for the trees added by add_tree()
+        self._trees = {}
+        # The pairs of ids of trees which share nodes
+        self._sharing = set()
+        # The changes made so far
+        self.trail = []
+
+    def add(self, fs):
+        """
+        Add a feature structure and all nodes under it into the engine.
+        Adding a node twice does nothing.
+
+        :param fs: The feature structure
+        :type fs: FeatStruct
+        """
+        stack = [fs]
+        while len(stack) > 0:
+            node = stack.pop()
+            node_id = id(node)
+            if node_id in self._parent:
+                continue
+            self._nodes[node_id] = node
+            self._parent[node_id] = node_id
+            self._rank[node_id] = 0
+            if test_leaf(node) == True:
+                self._value[node_id] = leaf_value(node)
+            else:
+                arcs = dict(node)
+                self._arcs[node_id] = arcs
+                stack.extend(arcs.values())
+
+    def add_tree(self, tree):
+        """
+        Add the top and bottom feature structures of all nodes of a tree.
+        Adding a tree again only adds the feature structures it did not
+        have before, so an engine can be kept for many pairs of trees.
+
+        :param tree: The tree
+        :type tree: TAGTree
+        """
+        tree_id = id(tree)
+        self._trees[tree_id] = tree
+        stack = []
+        nodes = [tree]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            stack.append(node.top_fs)
+            stack.append(node.bot_fs)
+            for child in node:
+                if hasattr(child, 'top_fs'):
+                    nodes.append(child)
+        while len(stack) > 0:
+            node = stack.pop()
+            node_id = id(node)
+            if node_id in self._parent:
+                owner = self._owner.get(node_id)
+                if owner != tree_id:
+                    self._sharing.add((owner, tree_id))
+                    self._sharing.add((tree_id, owner))
+                continue
+            self._nodes[node_id] = node
+            self._parent[node_id] = node_id
+            self._rank[node_id] = 0
+            self._owner[node_id] = tree_id
+            if test_leaf(node) == True:
+                self._value[node_id] = leaf_value(node)
+            else:
+                arcs = dict(node)
+                self._arcs[node_id] = arcs
+                stack.extend(arcs.values())
+
+    def independent(self, tree_1, tree_2):
+        """
+        :param tree_1: A tree added by add_tree()
+        :type tree_1: TAGTree
+        :param tree_2: Another tree added by add_tree()
+        :type tree_2: TAGTree
+        :return: True if the trees are different and share no nodes, so
+        that unifying a node of one of them does not change the other
+        :rtype: bool
+        """
+        return tree_1 is not tree_2 and \
+               (id(tree_1), id(tree_2)) not in self._sharing
+
+    def _find(self, node_id):
+        parent = self._parent[node_id]
+        while parent != node_id:
+            node_id = parent
+            parent = self._parent[node_id]
+        return node_id
+
+    def find(self, fs):
+        """
+        :param fs: A node added into the engine
+        :type fs: FeatStruct
+        :return: The node representing the class of the node
+        :rtype: FeatStruct
+        """
+        self.add(fs)
+        return self._nodes[self._find(id(fs))]
+
+    def value(self, fs):
+        """
+        :param fs: A leaf node
+        :type fs: FeatStruct
+        :return: The current value of the leaf, None if it is not known
+        :rtype: Disjunction
+        """
+        return self._value.get(self._find(id(fs)))
+
+    def mark(self):
+        """
+        :return: A mark on the trail that can be given to undo()
+        :rtype: int
+        """
+        return len(self.trail)
+
+    def undo(self, mark):
+        """
+        Undo all unifications done after the mark
+
+        :param mark: The return value of mark()
+        :type mark: int
+        """
+        trail = self.trail
+        while len(trail) > mark:
+            entry = trail.pop()
+            if entry[0] == 'link':
+                # ('link', child root, parent root, old rank of parent root)
+                self._parent[entry[1]] = entry[1]
+                self._rank[entry[2]] = entry[3]
+            elif entry[0] == 'value':
+                # ('value', root, old value)
+                self._value[entry[1]] = entry[2]
+            else:
+                # ('arc', root, feature)
+                del self._arcs[entry[1]][entry[2]]
+
+    def _link(self, child_id, parent_id):
+        rank = self._rank[parent_id]
+        self.trail.append(('link', child_id, parent_id, rank))
+        self._parent[child_id] = parent_id
+        if self._rank[child_id] == rank:
+            self._rank[parent_id] = rank + 1
+
+    def unify(self, fs1, fs2):
+        """
+        Unify two nodes. If the unification fails, everything done by this
+        call is undone.
+
+        :param fs1: One of the nodes
+        :type fs1: FeatStruct
+        :param fs2: Another node
+        :type fs2: FeatStruct
+        :return: True if the unification succeeds, or else False
+        :rtype: bool
+        """
+        self.add(fs1)
+        self.add(fs2)
+        mark = self.mark()
+        pending = [(id(fs1), id(fs2))]
+        while len(pending) > 0:
+            (id_1, id_2) = pending.pop()
+            if self._unify(self._find(id_1), self._find(id_2), pending) == False:
+                self.undo(mark)
+                return False
+        return True
+
+    def _unify(self, id_1, id_2, pending):
+        if id_1 == id_2:
+            return True
+        # Let id_1 be the root with the higher rank
+        if self._rank[id_1] < self._rank[id_2]:
+            (id_1, id_2) = (id_2, id_1)
+        leaf_1 = id_1 in self._value
+        leaf_2 = id_2 in self._value
+        if leaf_1 == True and leaf_2 == True:
+            value_1 = self._value[id_1]
+            value_2 = self._value[id_2]
+            if value_1 == None:
+                value = value_2
+            elif value_2 == None or value_1 is value_2:
+                value = value_1
+            else:
+                common = value_1.mask & value_2.mask
+                if common == 0:
+                    return False
+                value = mask_to_disjunction(common, value_1, value_2)
+            if value is not value_1:
+                self.trail.append(('value', id_1, value_1))
+                self._value[id_1] = value
+            self._link(id_2, id_1)
+        elif leaf_1 == True or leaf_2 == True:
+            # Only an empty leaf can be unified with a complex node, and the
+            # complex node must be the root
+            if leaf_1 == True:
+                (id_1, id_2) = (id_2, id_1)
+            if self._value[id_2] != None:
+                return False
+            self._link(id_2, id_1)
+        else:
+            self._link(id_2, id_1)
+            arcs_1 = self._arcs[id_1]
+            for (key, node) in self._arcs[id_2].items():
+                if key in arcs_1:
+                    pending.append((id(arcs_1[key]), id(node)))
+                else:
+                    self.trail.append(('arc', id_1, key))
+                    arcs_1[key] = node
+        return True
+
+    def resolve(self, fs, memo=None):
+        """
+        Build a new feature structure for the current state of a node
+
+        :param fs: A node added into the engine
+        :type fs: FeatStruct
+        :param memo: The nodes already built, from id of the root to the new
+        node. Give the same dict when resolving several nodes, so that the
+        nodes they share are also shared in the result.
+        :type memo: dict
+        :return: The new feature structure
+        :rtype: FeatStruct
+        """
+        if memo == None:
+            memo = {}
+        root_id = self._find(id(fs))
+        if root_id in memo:
+            return memo[root_id]
+        # The nodes are new, so they are filled in without the checks of
+        # FeatStruct, which take most of the time here
+        new_fs = FeatDict()
+        memo[root_id] = new_fs
+        if root_id in self._value:
+            value = self._value[root_id]
+            if value != None:
+                dict.__setitem__(new_fs, VALUE_KEY, value)
+            return new_fs
+        for (key, node) in self._arcs[root_id].items():
+            dict.__setitem__(new_fs, key, self.resolve(node, memo))
+        return new_fs
+
+    def resolve_tree(self, tree, memo=None):
+        """
+        Make a deep copy of a tree added into the engine, whose feature
+        structures are built by resolve(). The copy is independent of the
+        engine, so the engine can be undone after that.
+
+        :param tree: The tree
+        :type tree: TAGTree
+        :param memo: Just like the memo of resolve(), give the same dict
+        when resolving several trees unified together
+        :type memo: dict
+        :return: The new tree
+        :rtype: TAGTree
+        """
+        if memo == None:
+            memo = {}
+        # The nodes are copied one by one instead of by deepcopy(), which
+        # would copy the node index and every other attribute of the
+        # nodes the generic way
+        new_tree = tree.copy(False)
+        new_tree.top_fs = self.resolve(tree.top_fs, memo)
+        new_tree.bot_fs = self.resolve(tree.bot_fs, memo)
+        children = []
+        for child in tree:
+            if hasattr(child, 'top_fs'):
+                children.append(self.resolve_tree(child, memo))
+            else:
+                children.append(child)
+        new_tree.replace_children(children)
+        return new_tree
 
 fs1 = FeatStruct()
-fs2 = FeatStruct()
-fs3 = FeatStruct()
+fs2 = make_rhs_using_or('a/wzq/qwe')
+fs3 = make_rhs_using_or('zxcv/4567')
 fs4 = FeatStruct()
 fs4['more'] = fs3
-fs2['__or_a'] = 'a'
-fs2['__or_wzq'] = 'wzq'
-fs2['__or_qwe'] = 'qwe'
 fs1['apple'] = fs2
 fs1['orange'] = fs4
-fs3['__or_zxcv'] = 'zxcv'
-fs3['__or_4567'] = '4567'
 debug_start_feature = parse_feature_in_catalog('<mode> = ind/imp <comp> = nil <wh> = <invlink>  <punct term> = per/qmark/excl <punct struct> = nil')
-empty_feature = FeatStruct()
-empty_feature['__or_'] = ''
+empty_feature = make_leaf()
 
 def debug_special_unify():
     print debug_start_feature
@@ -1075,18 +1581,13 @@ def debug_special_unify():
     fs100.pop('wh')
     fs100.pop('mode')
     fs100['wzq'] = fs2
-    #fs100['comp'].pop('__or_nil')
-    fs100['comp']['__or_sdsdsd'] = 'sdsdsd'
+    fs100['comp'] = make_rhs_using_or('nil/sdsdsd')
     print '=========================='
     print special_unify(fs100,debug_start_feature)
 
 def debug_test_contain():
-    fs100 = FeatStruct()
-    fs100['__or_wzq'] = 'wzq'
-    #fs100['__or_qwe'] = 'qwe'
-    fs101 = FeatStruct()
-    fs101['__or_123'] = '123'
-    fs101['__or_wzq'] = 'wzq'
+    fs100 = make_rhs_using_or('wzq')
+    fs101 = make_rhs_using_or('123/wzq')
     print test_contain(fs100,fs101)
 
 def debug_parse_feature():
@@ -9,8 +9,15 @@
 #
 
 from feature import *
+from mapped import *
 from nltk.featstruct import *
 import LL1
+import os
+import re
+import itertools
+
+from array import array
+from collections import OrderedDict
 
 ###########################################
 # LL Parser for catalog file ##############
@@ -607,38 +614,127 @@ def analyze_morph(morph_file_string):
 # Analyze Syntax File ########################
 ##############################################
 
-def check_index(index):
-    if index == -1:
-        raise TypeError('Invalid input line.')
-
-def get_next_pair(s,start):
-    # This function will extract next pair of <<XXXX>>OOOOO from the input string
-    # s with a starting index = start. The return value is a tuple (entry,value,index)
-    # The 3rd value is the next un-read position, could be -1 if there is no more
-    # input
-    index_start = s.find('<<',start)
-    if index_start == -1:
-        return (None,None,-1)
-    index_end = s.find('>>',index_start) 
-    check_index(index_end)
-    entry = s[index_start + 2:index_end]
-    start = index_end + 2
-    index_start = s.find('<<',start)
-    if index_start == -1:
-        value = s[start:]
-        index_return = len(s) - 1
-    else:
-        value = s[start:index_start]
-        index_return = index_start
-
-    return (entry,value,index_return)
+class TreeWords(object):
+    """
+    The entries of a tree name in a ReverseTreeIndex, a read-only sequence
+    which looks up an entry by its number when it is asked for
+    """
+    def __init__(self,entries,postings):
+        self._entries = entries
+        self._postings = postings
+
+    def __len__(self):
+        return len(self._postings)
+
+    def __getitem__(self,i):
+        return self._entries[self._postings[i]]
+
+    def __iter__(self):
+        for number in self._postings:
+            yield self._entries[number]
+
+    def __eq__(self,other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return False
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+class ReverseTreeIndex(object):
+    """
+    The reverse index of the syntax, from a tree name or a family name to
+    the entries (words or phrases) selecting it, made by analyze_syntax().
+    Every different entry is kept once in a table, and a name keeps the
+    numbers of its entries in an array, without repetition and in the
+    order the entries first appear in the syntax.
+
+    It is read like a dictionary of lists, but a lookup returns a
+    TreeWords, which makes the entries when they are read.
+    """
+    def __init__(self):
+        self.entries = []     # The entries, tuple(tuple(str,str))
+        self.postings = {}    # The numbers of the entries of every name
+        self._numbers = {}    # The number of every entry, while it is built
+
+    def add(self,names,entry_list):
+        """
+        Add an entry to the postings of some names
+
+        :param names: The tree names and family names
+        :type names: list(str)
+        :param entry_list: The words of the entry and their POS
+        :type entry_list: list(tuple(str,str))
+        """
+        entry = tuple(entry_list)
+        number = self._numbers.get(entry)
+        if number == None:
+            number = len(self.entries)
+            self._numbers[entry] = number
+            self.entries.append(entry)
+        all_postings = self.postings
+        for name in names:
+            postings = all_postings.get(name)
+            if postings == None:
+                all_postings[name] = [number]
+            elif postings[-1] != number:
+                postings.append(number)
+
+    def finish(self):
+        """
+        Sort the postings, drop the repetitions, and store them in arrays.
+        Entries cannot be added any more.
+        """
+        for name in self.postings:
+            self.postings[name] = array('i',sorted(set(self.postings[name])))
+        self._numbers = {}
+
+    def __getstate__(self):
+        return {'entries': self.entries, 'postings': self.postings}
+
+    def __setstate__(self,state):
+        self.entries = state['entries']
+        self.postings = state['postings']
+        self._numbers = {}
+
+    def __len__(self):
+        return len(self.postings)
+
+    def __contains__(self,name):
+        return self.postings.has_key(name)
+
+    def has_key(self,name):
+        return self.postings.has_key(name)
+
+    def __getitem__(self,name):
+        return TreeWords(self.entries,self.postings[name])
+
+    def get(self,name,default=None):
+        if not self.postings.has_key(name):
+            return default
+        return self[name]
+
+    def __iter__(self):
+        return iter(self.postings)
+
+    def keys(self):
+        return self.postings.keys()
+
+    def iteritems(self):
+        # Like a dictionary of lists, e.g. for write_mapped_store()
+        for name in self.postings:
+            yield (name,list(self[name]))
 
 def make_reverse_tree_dict(reverse_trees,tree_list,family_list,entry_list):
     """
     Make a dictionary to enable searching words using tree name and family name
     
-    :param reverse_trees: The dictionary that you want to implement the reverse search
-    :type reverse_trees: dict
+    :param reverse_trees: The index that you want to implement the reverse search
+    :type reverse_trees: ReverseTreeIndex
     :param tree_list: The list of available trees for a word
     :type tree_list: list(str)
     :param family_list: The list of tree families available for the word
@@ -646,22 +742,86 @@ def make_reverse_tree_dict(reverse_trees,tree_list,family_list,entry_list):
     :param entry_list: The list of words to be searched as an index
     :type entry_list: list(tuple(str,str))
     """
-    for tree in tree_list:
-        if not reverse_trees.has_key(tree):
-            reverse_trees[tree] = []
-        #reverse_tree_list = reverse_trees[tree] # Just an optimization
-        #if not entry_list in reverse_tree_list: # Don't do this
-        # We may have some repetitions here but we just keep that, because
-        # it costs lots of time to do this. Same for below.
-        reverse_trees[tree].append(entry_list[:]) 
-    for tree in family_list:
-        if not reverse_trees.has_key(tree):
-            reverse_trees[tree] = []
-        #reverse_tree_list = reverse_trees[tree] # The same as above
-        #if not entry_list in reverse_tree_list: # Don't do this
-        reverse_trees[tree].append(entry_list[:])
+    reverse_trees.add(tree_list + family_list,entry_list)
     return
 
+def parse_syntax_line(l):
+    """
+    Parse a line of the syntax file, made of pairs of <<KEY>>value, e.g.
+
+    <<INDEX>>make<<ENTRY>>make<<POS>>V<<FAMILY>>TQnx0<<FEATURES>>#V_pres
+
+    Every <<ENTRY>> must be followed by its <<POS>>, other keys are ignored.
+    The line is split at every "<<" once, instead of searching the pairs one
+    after the other.
+
+    :param l: A line of the syntax file
+    :type l: str
+    :return: The <<INDEX>> of the line, 'noname' if there is none, and the
+    entry_list, tree_list, family_list and feature_list of the line (see
+    analyze_syntax())
+    :rtype: tuple(str,tuple(list,list,list,list))
+    """
+    entry_list = []
+    tree_list = []
+    family_list = []
+    feature_list = []
+    line_name = 'noname'
+    entry_name = None  # The <<ENTRY>> waiting for its <<POS>>
+    # The text before the first pair is ignored
+    for (entry,sep,value) in [pair.partition('>>')
+                              for pair in l.split('<<')[1:]]:
+        if sep == '':
+            raise TypeError('Invalid input line.')
+        if entry_name != None:
+            if entry != 'POS':
+                raise TypeError('<<ENTRY>> must be followed by <<POS>>')
+            entry_list.append((entry_name,value))
+            entry_name = None
+        elif entry == 'ENTRY':
+            entry_name = value
+        elif entry == 'INDEX':
+            line_name = value
+        elif entry == 'FAMILY':
+            family_list = value.split()
+        elif entry == 'TREES':
+            tree_list = value.split()
+        elif entry == 'FEATURES':
+            feature_list = value.split()
+    if entry_name != None:
+        raise TypeError('Invalid input line.')
+    return (line_name,(entry_list,tree_list,family_list,feature_list))
+
+def analyze_syntax_lines(lines):
+    """
+    A parser for the syntax file like analyze_syntax(), reading the lines
+    one by one, e.g. from an open file, so the file is never held in memory
+    as a whole. The dictionary and the reverse index are made in the same
+    pass.
+
+    :param lines: The lines of the syntax file, with or without the line
+    breaks
+    :type lines: iter(str)
+    :return: Two dictionaries enabling both word-to-trees and tree-to-words search
+    :rtype: tuple(dict,ReverseTreeIndex)
+    """
+    tokens = {}
+    reverse_trees = ReverseTreeIndex()
+    for l in lines:
+        l = l.rstrip('\r\n')
+        if l == '':
+            continue
+        (line_name,temp) = parse_syntax_line(l)
+        lines_of_name = tokens.get(line_name)
+        if lines_of_name == None:
+            tokens[line_name] = [temp]
+        else:
+            lines_of_name.append(temp)
+        reverse_trees.add(temp[1] + temp[2],temp[0])
+
+    reverse_trees.finish()
+    return (tokens,reverse_trees)
+
 def analyze_syntax(s):
     """
     A parser for the syntax file. A syntax file is indexed using the <<INDEX>>
@@ -678,7 +838,7 @@ def analyze_syntax(s):
     :type s: str
 
     :return: Two dictionaries enabling both word-to-trees and tree-to-words search
-    :rtype: tuple(dict,dict)
+    :rtype: tuple(dict,ReverseTreeIndex)
     """
     # This function returns a dictionary, the index is exactly the <<INDEX>>
     # entry in the syntax file. Each keyword will fetch a list, the element of
@@ -688,61 +848,7 @@ def analyze_syntax(s):
     # the element of which is tree name. The 3rd list is called family_list
     # the element of which is family name. The fourth list is called feature_list
     # the element of which is feature name.
-    lines = s.splitlines()
-    tokens = {}
-    # This dictionary is used to use the tree names to do reverse query to get the
-    # word or words
-    reverse_trees = {}
-    for l in lines:
-        if l == '':
-            continue
-        next_start = 0
-        entry_list = []
-        tree_list = []
-        family_list = []
-        feature_list = []
-        line_name = 'noname'
-        while True:
-            next_pair = get_next_pair(l,next_start)
-            next_start = next_pair[2]
-            entry = next_pair[0]
-            value = next_pair[1]
-            if next_start == -1:
-                break
-            elif entry == 'INDEX':
-                line_name = value
-            elif entry == 'ENTRY':
-                entry_name = value
-                next_pair = get_next_pair(l,next_start)
-                next_start = next_pair[2]
-                check_index(next_start)
-                entry = next_pair[0]
-                value = next_pair[1]
-                if entry != 'POS':
-                    raise TypeError('<<ENTRY>> must be followed by <<POS>>')
-                else:
-                    pos = value
-                entry_list.append((entry_name,pos))
-            elif entry == 'FAMILY':
-                family_list = value.split()
-            elif entry == 'TREES':
-                tree_list = value.split()
-            elif entry == 'FEATURES':
-                feature_list = value.split()
-            else:
-                pass
-                #raise TypeError('Unknown type: %s' % (entry))
-
-        temp = (entry_list,tree_list,family_list,feature_list)
-        if tokens.has_key(line_name):
-            tokens[line_name].append(temp)
-        else:
-            tokens[line_name] = [temp]
-            
-        # Next we will construct the reverse trees
-        make_reverse_tree_dict(reverse_trees,tree_list,family_list,entry_list)
-            
-    return (tokens,reverse_trees)
+    return analyze_syntax_lines(s.splitlines())
 
 def analyze_template(s):
     """
@@ -1032,10 +1138,67 @@ def get_path_list(s):
     # there is a '.b' by default
     if left.find('.') == -1:
         left += '.b'
-    right = [left] + right.split(' ')
+    right = [intern_atom(i) for i in [left] + right.split(' ')]
     return right
     
 
+def add_value_equations(features,equations):
+    """
+    Add all equations whose right hand side is a value (not a reference) into
+    a feature structure dictionary. This is the first half of building the
+    features of a tree, and must be done before add_reference_equations().
+
+    :param features: The dictionary using node names (e.g. S_r.b) as keys
+    :type features: dict(str,FeatStruct)
+    :param equations: A list of [lhs,rhs] pairs
+    :type equations: list(list(str))
+    """
+    for feature_entry in equations:
+        lhs = feature_entry[0]
+        rhs = feature_entry[1]
+        r_separator = rhs.find(':')
+
+        # We do not process reference until the second pass
+        # and reference is identified by a ':' on RHS
+        if r_separator == -1:
+            lhs_list = get_path_list(lhs)
+            add_new_fs(features,lhs_list,rhs)
+    return
+
+def add_reference_equations(features,equations):
+    """
+    Add all equations whose right hand side is a reference into a feature
+    structure dictionary which has already been processed by
+    add_value_equations(). We must add all values even if they are not
+    defined by the tree grammar.
+
+    :param features: The dictionary using node names (e.g. S_r.b) as keys
+    :type features: dict(str,FeatStruct)
+    :param equations: A list of [lhs,rhs] pairs
+    :type equations: list(list(str))
+    """
+    for feature_entry in equations:
+        lhs = feature_entry[0]
+        rhs = feature_entry[1]
+        r_separator = rhs.find(':')
+
+        if r_separator != -1:
+            # get_path_list will return a list, the first item of which
+            # is the node name, and the remaining part is the path,
+            # e.g. a:<b c d> will get the result as [a,b,c,d]
+            lhs_list = get_path_list(lhs)
+            rhs_list = get_path_list(rhs)
+            rhs_value = features
+            # If we cannot find the key on some level then the path is made,
+            # and it ends with an empty leaf whose value is not known yet
+            for i in rhs_list:
+                if not rhs_value.has_key(i):
+                    rhs_value[i] = make_leaf()
+                rhs_value = rhs_value[i]
+
+            add_new_fs(features,lhs_list,rhs_value,1)
+    return
+
 def analyze_tree_4(xtag_trees):
     """
     Given the result of analyze_tree_3(), this function will make
@@ -1048,36 +1211,7 @@ def analyze_tree_4(xtag_trees):
     """
     for xtag_entry in xtag_trees:
         features =  {}
-        for feature_entry in xtag_entry[1]:
-            lhs = feature_entry[0]
-            rhs = feature_entry[1]
-            #l_separator = lhs.find(':')
-            r_separator = rhs.find(':')
-            
-            # We do not process reference until the fifth pass
-            # and reference is identified by a ':' on RHS
-            if r_separator == -1:
-                lhs_list = get_path_list(lhs)
-                add_new_fs(features,lhs_list,rhs)
-                
-                ###
-                # The code below is obsolete since we do not use add_two_features()
-                # any more. So please do not validate them. We use add_new_fs()
-                # instead!
-                #l_id = lhs[:l_separator]
-                #l_space = lhs.find(' ')
-
-                #feat_rhs = FeatStruct()
-                #feat_rhs["__value__"] = rhs                
-                
-                #if(l_space == -1):
-                #    l_feature = lhs[l_separator + 2:-1]
-                #    add_two_feature(features,l_id,feat_rhs,l_feature)
-                #else:
-                #    l_feature1 = lhs[l_separator + 2:l_space]
-                #    l_feature2 = lhs[l_space + 1:-1]
-                #    add_two_feature(features,l_id,feat_rhs,l_feature1,l_feature2)
-
+        add_value_equations(features,xtag_entry[1])
         xtag_entry[4] = features
     
     return xtag_trees
@@ -1092,75 +1226,177 @@ def analyze_tree_5(xtag_trees):
     :type list:
     """
     for xtag_entry in xtag_trees:
-        features = xtag_entry[4]
-        for feature_entry in xtag_entry[1]:
-            lhs = feature_entry[0]
-            rhs = feature_entry[1]
-            l_separator = lhs.find(':')
-            r_separator = rhs.find(':')   
-
-            if r_separator != -1:
-                # get_path_list will return a list, the first item of which
-                # is the node name, and the remaining part is the path,
-                # e.g. a:<b c d> will get the result as [a,b,c,d]
-                lhs_list = get_path_list(lhs)
-                rhs_list = get_path_list(rhs)
-                rhs_value = features
-                # If the path exists till the end, then this will keep True
-                # but if we cannot find the key on some level then
-                # this will be False
-                found_key = True
-                for i in rhs_list:
-                    if not rhs_value.has_key(i):
-                        rhs_value[i] = FeatStruct()
-                        rhs_value = rhs_value[i]
-                        found_key = False
-                    else:
-                        rhs_value = rhs_value[i]
-
-                if found_key == False:
-                    rhs_value['__or_'] = ''
-
-                add_new_fs(features,lhs_list,rhs_value,1)
-                    
-                #for i in rhs_list:
-                #    if not rhs_value.has_key(i):
-                        #raise ValueError('No path %s found in the feature structure' % (rhs_list))
-                        #print rhs_list
-                #        rhs_value = make_rhs_using_or(i)
-                #        print rhs_value
-                #        print i
-                        
-                        #print rhs_value
-                #        break
-                #    else:
-                #        rhs_value = rhs_value[i]
-                #        add_new_fs(features,lhs_list,rhs_value)
-                        #print rhs_value,'\n'
-                #print rhs_value
-                
-                
-                #l_id = lhs[:l_separator]
-                #r_id = rhs[:r_separator]
-                #r_feature = rhs[r_separator + 2:-1]
-                #l_space = lhs.find(' ')
-
-                #if not features.has_key(r_id): # Make sure features[r_id] exists
-                #    features[r_id] = FeatStruct()
-                #    features[r_id][r_feature] = FeatStruct(__value__ = '')
-                #elif not features[r_id].has_key(r_feature): # Make sure features[r_id][r_feature] exists
-                #    features[r_id][r_feature] = FeatStruct(__value__ = '')
-
-                #if(l_space == -1):
-                #    l_feature = lhs[l_separator + 2:-1]
-                #    add_two_feature(features,l_id,features[r_id][r_feature],l_feature)
-                #else:
-                #    l_feature1 = lhs[l_separator + 2:l_space]
-                #    l_feature2 = lhs[l_space + 1:-1]
-                #    add_two_feature(features,l_id,features[r_id][r_feature],l_feature1,l_feature2)
+        add_reference_equations(xtag_entry[4],xtag_entry[1])
 
     return xtag_trees
-            
+
+##########################################
+# Single Pass Tree File Reader ###########
+##########################################
+
+# A token in the tree file is a bracket, a quoted string (with '\"' escaped)
+# or an atom, which is a run of characters other than space, brackets and
+# quotes. Leading spaces are skipped as part of the match.
+tree_token = re.compile(r'\s*(?:([()])|("[^"\\]*(?:\\.[^"\\]*)*")|([^\s()"]+))')
+
+def tokenize_tree_file(chunks):
+    """
+    Split the content of a tree file into tokens. The content is given as an
+    iterable of strings, and a token may span the boundary of two chunks, so
+    we only keep the unfinished tail of the current chunk in the buffer.
+
+    :param chunks: An iterable of strings, e.g. a list or blocks read from a file
+    :type chunks: iterable(str)
+    :return: A generator of tokens
+    :rtype: generator(str)
+    """
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        next_index = 0
+        length = len(buf)
+        while True:
+            m = tree_token.match(buf,next_index)
+            # No match means an unterminated string or only spaces left, and a
+            # match reaching the end of the buffer may be cut by the chunk
+            # boundary, so in both cases we wait for the next chunk
+            if m == None or m.end() == length:
+                break
+            next_index = m.end()
+            yield m.group(m.lastindex)
+        buf = buf[next_index:]
+
+    next_index = 0
+    while True:
+        m = tree_token.match(buf,next_index)
+        if m == None:
+            break
+        next_index = m.end()
+        yield m.group(m.lastindex)
+    if buf[next_index:].strip() != '':
+        raise ValueError('Unterminated string in the tree file')
+
+def read_tree_forms(tokens):
+    """
+    Group the tokens into nested lists using the brackets, and yield each
+    top level form as soon as its closing bracket is seen. The lists have the
+    same layout as the result of parse_brackets() in util.
+
+    :param tokens: Tokens returned by tokenize_tree_file()
+    :type tokens: iterable(str)
+    :return: A generator of top level forms
+    :rtype: generator(list)
+    """
+    stack = []
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) == 0:
+                raise ValueError('Unbalanced ")" in the tree file')
+            form = stack.pop()
+            if len(stack) == 0:
+                yield form
+            else:
+                stack[-1].append(form)
+        elif len(stack) == 0:
+            raise ValueError('Token %s is outside any tree' % (token))
+        else:
+            stack[-1].append(token)
+    if len(stack) != 0:
+        raise ValueError('Unbalanced "(" in the tree file')
+
+def get_tree_options(form):
+    """
+    Convert the option form of a tree, e.g. ("name" :COMMENTS "..." ...),
+    into the tree name and a dictionary of options. The value of an option is
+    a string with the quotes removed, or a list of strings if it is a list.
+
+    :param form: The option form returned by read_tree_forms()
+    :type form: list
+    :return: The tree name and the options
+    :rtype: tuple(str,dict)
+    """
+    if len(form) == 0 or isinstance(form[0],list) or form[0][0] != '"':
+        raise ValueError('A tree name must start with a "')
+    tree_name = form[0][1:-1]
+    options = {}
+    i = 1
+    length = len(form)
+    while i < length:
+        option_name = form[i]
+        if isinstance(option_name,list) or option_name[0] != ':':
+            raise ValueError('Expect an option in tree %s' % (tree_name))
+        option_name = option_name[1:]
+        if i + 1 < length:
+            value = form[i + 1]
+        else:
+            value = ''
+        if isinstance(value,list):
+            value = [v.lstrip(':') for v in value]
+        elif value[0] == '"':
+            value = value[1:-1]
+        elif value[0] == ':':
+            value = value[1:]
+        if options.has_key(option_name):
+            raise KeyError("The option %s already exists" % (option_name))
+        options[option_name] = value
+        i += 2
+    return (tree_name,options)
+
+def get_tree_equations(s):
+    """
+    Split the unification equations of a tree into [lhs,rhs] pairs, which is
+    the same as what analyze_tree_3() does.
+
+    :param s: The value of the UNIFICATION-EQUATIONS option
+    :type s: str
+    :return: A list of [lhs,rhs] pairs
+    :rtype: list(list(str))
+    """
+    equations = []
+    for i in s.splitlines():
+        i = i.strip()
+        if i != '':
+            exp = i.split('=')
+            exp[0] = exp[0].strip()
+            exp[1] = exp[1].strip()
+            equations.append(exp)
+    return equations
+
+def iter_tree_file(source,chunk_size=65536):
+    """
+    Read a tree file in one linear scan, and yield each tree as soon as it
+    has been read. This replaces the five passes of analyze_tree_1() to
+    analyze_tree_5() as well as the second parse done by LL1, and only keeps
+    one tree in memory at a time if source is a file.
+
+    :param source: The content of a tree file, or a file object
+    :type source: str / file
+    :param chunk_size: The number of bytes read from the file each time
+    :type chunk_size: integer
+    :return: A generator of (tree_name,tree_list,features,comments) tuples,
+    in which tree_list is the nested list describing the tree structure, and
+    features is the feature structure dictionary of the tree
+    :rtype: generator(tuple(str,list,dict,str))
+    """
+    if isinstance(source,basestring):
+        chunks = [source]
+    else:
+        chunks = iter(lambda: source.read(chunk_size),'')
+    forms = read_tree_forms(tokenize_tree_file(chunks))
+    for option_form in forms:
+        (tree_name,options) = get_tree_options(option_form)
+        structure = next(forms,None)
+        if structure == None:
+            raise ValueError('No structure found for tree %s' % (tree_name))
+        if not options.has_key('UNIFICATION-EQUATIONS'):
+            raise NameError("Cannot find unification specification.")
+        equations = get_tree_equations(options['UNIFICATION-EQUATIONS'])
+        features = {}
+        add_value_equations(features,equations)
+        add_reference_equations(features,equations)
+        yield (tree_name,structure,features,options.get('COMMENTS',''))
 
 ######################################
 # Word and feature conversion ########
@@ -1169,6 +1405,95 @@ def analyze_tree_5(xtag_trees):
 dicts = None    # Morph, Syntax, and Template
 inited = False  # Once initialized this will be True until next start
 
+class LRUCache(object):
+    """
+    A dictionary keeping only the ``size`` most recently used keys, and
+    counting the hits, the misses and the keys dropped
+    """
+    def __init__(self, size):
+        """
+        :param size: The number of keys kept, 0 to keep nothing
+        :type size: int
+        """
+        self.size = size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        :return: The value of the key, which becomes the most recently
+        used one, or ``default`` if it is not kept
+        """
+        if key in self._items:
+            value = self._items.pop(key)
+            self._items[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        if key in self._items:
+            del self._items[key]
+        elif len(self._items) >= self.size:
+            # Drop the least recently used key
+            self._items.popitem(False)
+            self.evictions += 1
+        self._items[key] = value
+
+    def clear(self):
+        """
+        Drop all the keys and reset the counters
+        """
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def info(self):
+        """
+        :return: The counters, and the hit rate of all the lookups
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            rate = 0.0
+        else:
+            rate = float(self.hits) / lookups
+        return {'size': self.size, 'length': len(self._items),
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': rate}
+
+# The results of word_to_features(), emptied whenever the lexicon changes
+FEATURE_CACHE_SIZE = 8192
+feature_cache = LRUCache(FEATURE_CACHE_SIZE)
+
+def set_feature_cache_size(size):
+    """
+    Change the number of words whose features are kept by
+    word_to_features(), 0 to compute them every time
+
+    :param size: The number of words
+    :type size: int
+    """
+    global feature_cache
+    feature_cache = LRUCache(size)
+
+def feature_cache_info():
+    """
+    :return: The hits, misses and evictions of the cache of
+    word_to_features(), see LRUCache.info()
+    :rtype: dict
+    """
+    return feature_cache.info()
+
 def check_pos_equality(morph_pos,syntax_pos):
     """
     Check whether two POS tags from morph and syntax respectively are equal.
@@ -1230,8 +1555,9 @@ def word_to_morph(word):
     global dicts
     check_init()
 
-    if dicts[0].has_key(word):
-        morph = dicts[0][word]
+    # The morph may be a MappedStore, so it is looked up only once
+    morph = dicts[0].get(word)
+    if morph != None:
         ret = (True,morph)
     elif dicts[1].has_key(word):
         morph = get_morph_from_syntax(dicts[1][word],word)
@@ -1327,6 +1653,33 @@ def morph_to_feature(morph_entry,word_exist,word,check_pos=True):
             
     return result
 
+def freeze_features(result):
+    """
+    Make the result of word_to_features() immutable, so that it can be kept
+    in the cache and shared by all the callers. The lists become tuples,
+    and the feature structures frozen copies of the templates, which are
+    left as they are.
+
+    :param result: The features of a word
+    :type result: list(tuple)
+    :rtype: tuple(tuple)
+    """
+    frozen = []
+    for (entry_pos_list,tree_list,family_list,syn_feature,morph_feature,
+         morph_entry) in result:
+        features = []
+        for fs_list in (syn_feature,morph_feature):
+            fs_tuple = []
+            for fs in fs_list:
+                fs = fs.copy(deep=True)
+                fs.freeze()
+                fs_tuple.append(fs)
+            features.append(tuple(fs_tuple))
+        frozen.append((tuple(entry_pos_list),tuple(tree_list),
+                       tuple(family_list),features[0],features[1],
+                       (morph_entry[0],tuple(morph_entry[1]))))
+    return tuple(frozen)
+
 def word_to_features(word):
     # This function will convert the word into the feature structures associated
     # with this word. The return value of this function is a list, each element
@@ -1340,11 +1693,20 @@ def word_to_features(word):
     To run this function, the initialization procedure init() must be called, or
     an exception will be thrown.
 
+    The results are kept in an LRU cache, see feature_cache_info(), and
+    are immutable: the lists are tuples and the feature structures are
+    frozen, so they must be copied before they are changed.
+
     :param word: A word that you want to search for
     :type word: str
     :return: A list of features as well as trees for that word
-    :rtype list:
+    :rtype tuple:
     """
+    check_init()
+    result = feature_cache.get(word)
+    if result != None:
+        return result
+
     result = []
     morph_ret = word_to_morph(word)
     morph = morph_ret[1]      # List of morph
@@ -1381,19 +1743,216 @@ def word_to_features(word):
         for morph_entry in morph:
             feature_list = morph_to_feature(morph_entry,word_exist,word,False)
             result += feature_list
-            
+
+    result = freeze_features(result)
+    feature_cache.put(word,result)
+    return result
+
+def words_to_features(words):
+    """
+    Look up the features of many words at once, e.g. all the words of a
+    sentence or of a file. Every different word is looked up once by
+    word_to_features(), so a word repeated in the input costs one lookup
+    even if it has fallen out of the cache in the meantime.
+
+    :param words: The words, which may be an iterator
+    :type words: iter(str)
+    :return: The features of every word, in the order of ``words``
+    :rtype: list(tuple)
+    """
+    check_init()
+    features = {}
+    result = []
+    for word in words:
+        if not features.has_key(word):
+            features[word] = word_to_features(word)
+        result.append(features[word])
+    return result
+
+def iter_words_to_features(words,chunk_size=4096):
+    """
+    Look up the features of a stream of words, e.g. the words of a corpus
+    read line by line, without holding all of them in memory. The words
+    are read ``chunk_size`` at a time and given to words_to_features().
+
+    For example, the words of a file with one word in the first column of
+    every line:
+
+        words = (line.split()[0] for line in fp if line.strip() != '')
+        for (word,features) in iter_words_to_features(words):
+            ...
+
+    :param words: The words
+    :type words: iter(str)
+    :param chunk_size: The number of words looked up at a time
+    :type chunk_size: int
+    :return: Every word and its features, in the order of ``words``
+    :rtype: iter(tuple(str,tuple))
+    """
+    chunk = []
+    for word in words:
+        chunk.append(word)
+        if len(chunk) >= chunk_size:
+            for pair in zip(chunk,words_to_features(chunk)):
+                yield pair
+            chunk = []
+    if len(chunk) > 0:
+        for pair in zip(chunk,words_to_features(chunk)):
+            yield pair
+
+######################################
+# Multi-word entries #################
+######################################
+
+class PhraseIndex(object):
+    """
+    A trie of phrases, i.e. sequences of tokens, finding all the phrases
+    in a sentence in one pass from left to right. Every position of the
+    sentence may be matched by several tokens, e.g. a word and its stems,
+    so the trie is walked on from every node reached at the position
+    before, and a position costs at most as many steps as the longest
+    phrase.
+    """
+    def __init__(self):
+        # A node is a pair of its children by token and its values
+        self._root = ({},[])
+
+    def add(self,tokens,value):
+        """
+        :param tokens: The phrase
+        :type tokens: tuple(str)
+        :param value: Anything kept with the phrase
+        """
+        node = self._root
+        for token in tokens:
+            if not node[0].has_key(token):
+                node[0][token] = ({},[])
+            node = node[0][token]
+        if value not in node[1]:
+            node[1].append(value)
+
+    def find(self,sentence):
+        """
+        :param sentence: The tokens matching every position of the sentence
+        :type sentence: list(iter(str))
+        :return: The start and the end of every phrase found, and the
+        values of the phrase, ordered by the end and then by the start
+        :rtype: list(tuple(int,int,list))
+        """
+        found = []
+        # The nodes reached at the position before, with their starts
+        active = []
+        for end in range(0,len(sentence)):
+            reached = []
+            seen = set()
+            for (node,start) in active + [(self._root,end)]:
+                for token in sentence[end]:
+                    child = node[0].get(token)
+                    if child != None and (id(child),start) not in seen:
+                        seen.add((id(child),start))
+                        reached.append((child,start))
+            reached.sort(key=lambda pair: pair[1])
+            for (node,start) in reached:
+                if len(node[1]) > 0:
+                    found.append((start,end + 1,node[1]))
+            active = reached
+        return found
+
+    def __len__(self):
+        count = 0
+        stack = [self._root]
+        while len(stack) > 0:
+            node = stack.pop()
+            count += len(node[1])
+            stack += node[0].values()
+        return count
+
+phrase_index = None  # The PhraseIndex of the lexicon, made when first used
+
+def get_phrase_index():
+    """
+    The index of the entries of the syntax made of more than one word, e.g.
+    <<ENTRY>>make<<POS>>V<<ENTRY>>short<<POS>>A<<ENTRY>>work<<POS>>N..., from
+    their words in lower case to the <<INDEX>> of their lines. It is made
+    from the lexicon the first time it is asked for.
+
+    :rtype: PhraseIndex
+    """
+    global phrase_index
+    check_init()
+    if phrase_index == None:
+        index = PhraseIndex()
+        for key in dicts[1]:
+            for line in dicts[1][key]:
+                if len(line[0]) > 1:
+                    index.add(tuple([e[0].lower() for e in line[0]]),key)
+        phrase_index = index
+    return phrase_index
+
+def word_tokens(word):
+    """
+    :return: The tokens of the phrases a word may be part of, i.e. the
+    word and its stems in the morphology, in lower case
+    :rtype: set(str)
+    """
+    tokens = set([word.lower()])
+    morph = dicts[0].get(word)
+    if morph != None:
+        for morph_entry in morph:
+            tokens.add(morph_entry[0].lower())
+    return tokens
+
+def find_phrases(words):
+    """
+    Find the multi-word entries anywhere in a sentence, e.g. "made short
+    work of" in "john made short work of the cat", matching the words and
+    their stems, in one pass over the sentence.
+
+    :param words: The sentence
+    :type words: list(str)
+    :return: The start and the end of every phrase, and the features of
+    the phrase, i.e. the items of word_to_features() of its words whose
+    entries are the phrase
+    :rtype: list(tuple(int,int,list(tuple)))
+    """
+    result = []
+    tokens = [word_tokens(word) for word in words]
+    for (start,end,keys) in get_phrase_index().find(tokens):
+        features = []
+        for lex_list in words_to_features(words[start:end]):
+            for morph in lex_list:
+                if len(morph[0]) != end - start or morph in features:
+                    continue
+                for i in range(0,end - start):
+                    if morph[0][i][0].lower() not in tokens[start + i]:
+                        break
+                else:
+                    features.append(morph)
+        if len(features) > 0:
+            result.append((start,end,features))
     return result
 
+def clear_lexicon_caches():
+    """
+    Forget everything computed from the lexicon, which has been replaced
+    """
+    global phrase_index
+    feature_cache.clear()
+    phrase_index = None
+
 def tree_to_words(name):
     """
     Search for words applicable to a given tree name or family name. This is
     basically a reverse search in the index file, using tree name or famile name
     as index.
 
+    Every entry is returned once, in the order of the syntax file, and is
+    only made when it is read.
+
     :param tree_name: Tree name or family name
     :type tree_name: str
     :return: A list of words (or phrases) together with the POS
-    :rtype: list(list(tuple(str,str)))
+    :rtype: TreeWords / list(tuple(tuple(str,str)))
     """
     global dicts
     if not dicts[3].has_key(name):
@@ -1457,11 +2016,10 @@ def init(morph,syntax,temp,default,mapping):
 
     default_syntax = default
 
-    s = syntax
-    s += "\n" + default_syntax
     # syntax_dict[0] is the dict for forward query, i.e. from word to trees and to feature structures
     # and syntax_dict[1] is the dict for reverse query, i.e. from tree name to entries (word or words)
-    syntax_dict = analyze_syntax(s)
+    syntax_dict = analyze_syntax_lines(itertools.chain(syntax.splitlines(),
+                                                       default_syntax.splitlines()))
 
     s = temp
     template_dict = analyze_template(s)
@@ -1471,6 +2029,7 @@ def init(morph,syntax,temp,default,mapping):
     ####
 
     dicts = (morph_dict,syntax_dict[0],template_dict,syntax_dict[1],mapping_dict)
+    clear_lexicon_caches()
 
     #### Patch for using default grammar: add '%s' into dicts[0] ####
     dicts[0]['%s'] = []
@@ -1486,6 +2045,95 @@ def init(morph,syntax,temp,default,mapping):
     
     return
 
+# The files of the mapped lexicon, in the order of dicts
+LEXICON_STORES = ['morph', 'syntax', ('templates-morph', 'templates-syntax'),
+                  'reverse', 'mapping']
+
+# The number of syntax entries and templates a mapped lexicon keeps in
+# memory after lookup, see map_lexicon()
+SYNTAX_CACHE_SIZE = 4096
+
+def dump_lexicon(directory):
+    """
+    Write the lexicon made by init() into memory mapped stores, one file
+    for every dictionary in ``dicts``, to be read by map_lexicon()
+
+    :param directory: The directory of the files, which must exist
+    :type directory: str
+    """
+    check_init()
+    for i in range(0, len(LEXICON_STORES)):
+        names = LEXICON_STORES[i]
+        if isinstance(names, tuple):
+            for j in range(0, len(names)):
+                write_mapped_store(os.path.join(directory, names[j] + '.map'),
+                                   dicts[i][j])
+        else:
+            write_mapped_store(os.path.join(directory, names + '.map'),
+                               dicts[i])
+
+def lexicon_dicts():
+    """
+    :return: The lexicon made by init(), to be given to restore_lexicon()
+    :rtype: tuple
+    """
+    check_init()
+    return dicts
+
+def restore_lexicon(lexicon):
+    """
+    Initialize the environments for XTAG like init(), with a lexicon
+    returned by lexicon_dicts() before, e.g. read from a cache
+
+    :param lexicon: The lexicon
+    :type lexicon: tuple
+    """
+    global inited
+    global dicts
+
+    dicts = lexicon
+    clear_lexicon_caches()
+    inited = True
+
+def map_lexicon(directory, morph_cache=0, syntax_cache=SYNTAX_CACHE_SIZE):
+    """
+    Initialize the environments for XTAG like init(), with the lexicon
+    written by dump_lexicon(). Nothing is parsed, the stores are mapped and
+    an entry is unpickled when it is looked up, so a process only holds
+    the entries it has used, not the whole lexicon.
+
+    The syntax and the templates are looked up for every word, and the
+    same entries over and over, so they are kept in the front caches of
+    their stores instead of being unpickled every time.
+
+    :param directory: The directory of the files
+    :type directory: str
+    :param morph_cache: The number of words whose morphology is kept in
+    memory after lookup
+    :type morph_cache: int
+    :param syntax_cache: The number of syntax entries, and of templates of
+    each kind, kept in memory after lookup
+    :type syntax_cache: int
+    """
+    global inited
+    global dicts
+
+    stores = []
+    for names in LEXICON_STORES:
+        if isinstance(names, tuple):
+            stores.append(tuple([MappedStore(os.path.join(directory,
+                                                          name + '.map'))
+                                 for name in names]))
+        else:
+            stores.append(MappedStore(os.path.join(directory, names + '.map')))
+    stores[0].cache_size = morph_cache
+    stores[1].cache_size = syntax_cache
+    for store in stores[2]:
+        store.cache_size = syntax_cache
+    dicts = tuple(stores)
+    clear_lexicon_caches()
+    inited = True
+
 def debug():
     morph = "../xtag-english-grammar/morphology/trunc_morph.flat"
     syntax = "../xtag-english-grammar/syntax/syntax-coded.flat"
@@ -1558,8 +2206,7 @@ def debug_modify_feature_referece():
 
 def debug_restore_reference():
     fs100 = FeatStruct()
-    fs101 = FeatStruct()
-    fs101['__or_1233454'] = '1233454'
+    fs101 = make_rhs_using_or('1233454')
     fs100['wzqqqqq'] = fs101
     fs102 = FeatStruct()
     fs102['sdsd'] = fs101
@@ -1573,13 +2220,8 @@ def debug_restore_reference():
     print result
 
 def debug_test_contain():
-    fs100 = FeatStruct()
-    fs101 = FeatStruct()
-    fs100['__or_123'] = 123
-    fs101['__or_123'] = 123
-    fs101['__or_456'] = 456
-    fs100['__or_456'] = 456
-    fs100['__or_789'] = 789
+    fs100 = make_rhs_using_or('123/456/789')
+    fs101 = make_rhs_using_or('123/456')
     print test_contain(fs100,fs101)
 
 def debug_make_pos_mapping():
@@ -0,0 +1,268 @@
+# Natural Language Toolkit: Tree-Adjoining Grammar
+#
+# Copyright (C) 2001-2013 NLTK Project
+# Author: WANG Ziqi, Haotian Zhang <{zwa47,haotianz}@sfu.ca>
+#
+# URL: <http://www.nltk.org/>
+# For license information, see LICENSE.TXT
+#
+
+import os
+import mmap
+import struct
+import pickle
+
+from collections import OrderedDict
+
+####################################
+# Memory Mapped Store ##############
+####################################
+
+# The layout of a store file:
+#
+#   magic                           8 bytes
+#   number of keys                  uint32
+#   index, sorted by key            (key offset, key length,
+#                                    value offset, value length) per key
+#   keys and pickled values
+#
+# All integers are little endian.
+MAPPED_MAGIC = 'XTAGMAP\x01'
+_HEADER = struct.Struct('<8sI')
+_ENTRY = struct.Struct('<QIQI')
+
+def temp_path(path):
+    """
+    :return: The path of a temporary file written before it replaces
+    ``path``, different in every process so that processes writing the
+    same file at the same time do not rename each other's file
+    :rtype: str
+    """
+    return '%s.%d.tmp' % (path, os.getpid())
+
+def write_mapped_store(path, items, raw=False):
+    """
+    Write a MappedStore file. The file is replaced at once so that a half
+    written store is never seen by another process.
+
+    :param path: The path of the file
+    :type path: str
+    :param items: The keys and the values
+    :type items: dict / MappedStore / iter(tuple(str,object))
+    :param raw: If true, the values are pickled already, e.g. read from a
+    pickle file, and are written as they are
+    :type raw: bool
+    :return: The number of keys
+    :rtype: int
+    """
+    if isinstance(items, MappedStore) and raw == False:
+        # Copy the pickled values without unpickling them
+        items = [(key, items.raw(key)) for key in items]
+        raw = True
+    elif hasattr(items, 'iteritems'):
+        items = items.iteritems()
+    pairs = []
+    for (key, value) in items:
+        if not isinstance(key, str):
+            raise TypeError('The keys of a mapped store must be str, not %s'
+                            % (type(key).__name__))
+        if raw == False:
+            value = pickle.dumps(value, -1)
+        pairs.append((key, value))
+    pairs.sort(key=lambda pair: pair[0])
+
+    offset = _HEADER.size + _ENTRY.size * len(pairs)
+    index = []
+    for (key, value) in pairs:
+        index.append(_ENTRY.pack(offset, len(key),
+                                 offset + len(key), len(value)))
+        offset += len(key) + len(value)
+
+    temp = temp_path(path)
+    fp = open(temp, 'wb')
+    fp.write(_HEADER.pack(MAPPED_MAGIC, len(pairs)))
+    fp.write(''.join(index))
+    for (key, value) in pairs:
+        fp.write(key)
+        fp.write(value)
+    fp.close()
+    os.rename(temp, path)
+    return len(pairs)
+
+class MappedStore(object):
+    """
+    A read-only mapping from strings to objects, kept in a file written by
+    write_mapped_store() and read through mmap. A key is found by binary
+    search in the sorted index of the file, and only its value is
+    unpickled, a new copy every time unless it is in the front cache.
+
+    The front cache keeps the values of the ``cache_size`` most recently
+    used keys, so that the values of common keys are unpickled once.
+    Those values are shared by all the callers, and must not be changed.
+
+    The pages of the file are shared by all the processes mapping it, but
+    only the pickled bytes are: every process unpickles the values it looks
+    up into its own memory, again on every lookup if there is no front
+    cache. Mapping saves loading the whole store in every process, not the
+    memory of the values in use. A store is pickled as its path, so it can
+    be sent to a spawned process, which maps the same file.
+    """
+    def __init__(self, path, cache_size=0):
+        """
+        :param path: The path of the file
+        :type path: str
+        :param cache_size: The number of values kept in the front cache,
+        0 for no cache
+        :type cache_size: int
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._open()
+
+    def _open(self):
+        fp = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        (magic, self._count) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAPPED_MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a mapped store' % (self.path))
+
+    def __getstate__(self):
+        return {'path': self.path, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.cache_size = state.get('cache_size', 0)
+        self._cache = OrderedDict()
+        self._open()
+
+    def close(self):
+        """
+        Unmap the file
+        """
+        self._cache.clear()
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._map, _HEADER.size + _ENTRY.size * i)
+
+    def _key(self, i):
+        (key_offset, key_length, value_offset, value_length) = self._entry(i)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, key):
+        # The position of the key in the index, or -1
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._key(low) == key:
+            return low
+        return -1
+
+    def raw(self, key):
+        """
+        :param key: The key
+        :type key: str
+        :return: The pickled value of the key
+        :rtype: str
+        """
+        if not isinstance(key, str):
+            raise KeyError(key)
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        (key_offset, key_length, value_offset, value_length) = self._entry(i)
+        return self._map[value_offset:value_offset + value_length]
+
+    def size(self, key):
+        """
+        :return: The number of bytes of the pickled value of the key
+        :rtype: int
+        """
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self._entry(i)[3]
+
+    def __getitem__(self, key):
+        if self.cache_size <= 0:
+            return pickle.loads(self.raw(key))
+        if key in self._cache:
+            value = self._cache.pop(key)
+        else:
+            value = pickle.loads(self.raw(key))
+            if len(self._cache) >= self.cache_size:
+                # Drop the least recently used value
+                self._cache.popitem(False)
+        self._cache[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if not isinstance(key, str):
+            return False
+        return key in self._cache or self._find(key) != -1
+
+    def has_key(self, key):
+        return key in self
+
+    def __iter__(self):
+        for i in range(0, self._count):
+            yield self._key(i)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def __repr__(self):
+        return '<MappedStore %s with %d keys>' % (self.path, self._count)
+
+####################################
+# Debugging information ############
+####################################
+
+def debug_mapped_store():
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'debug.map')
+    write_mapped_store(path, {'make': [('make', 'V', [])],
+                              'cat': [('cat', 'N', ['3sg'])]})
+    store = MappedStore(path, 1)
+    print store, store.keys()
+    print store['cat'], store.get('dog'), store.has_key('make')
+    print store['cat'] is store['cat'], store['make'] is store['make']
+    print pickle.loads(pickle.dumps(store))['make']
+    store.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+if __name__ == '__main__':
+    debug_mapped_store()
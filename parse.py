@@ -53,8 +53,81 @@ def check_name_equality(name_1,name_2):
     else:
         return False
 
+def can_substitute(tree_1,tree_2):
+    """
+    Check whether the root of tree_2 has the category of a substitution node
+    of tree_1, which check_substitution() needs to give anything. Only the
+    node indexes are read, so copy-on-write trees are not copied.
+
+    :type tree_1: TagTree
+    :param tree_1: The tree having the substitution node
+
+    :type tree_2: TagTree
+    :param tree_2: The tree substituted
+
+    :rtype: bool
+    """
+    root = get_name_prefix(tree_2.get_node_name())
+    for node in tree_1.node_index().subst:
+        if get_name_prefix(node.get_node_name()) == root:
+            return True
+    return False
+
+def can_adjoin(tree_1,tree_2):
+    """
+    Check whether tree_2 is an auxiliary tree whose foot has the category
+    of a node of tree_1, which check_adjunction() needs to give anything.
+    Only the node indexes are read, like can_substitute().
+
+    :type tree_1: TagTree
+    :param tree_1: The tree adjoined into
+
+    :type tree_2: TagTree
+    :param tree_2: The auxiliary tree
+
+    :rtype: bool
+    """
+    foot = tree_2.node_index().foot
+    if foot == None:
+        return False
+    return tree_1.node_index().prefixes.has_key(
+        get_name_prefix(foot.get_node_name()))
 
-def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False):
+def combination_engine(tree_1,tree_2,engine=None):
+    """
+    Make a unification engine to try all combinations of two trees.
+
+    :type tree_1: TagTree
+    :param tree_1: The first tree
+
+    :type tree_2: TagTree
+    :param tree_2: The second tree
+
+    :type engine: UnificationEngine
+    :param engine: An engine kept by the caller for many pairs of trees, to
+     which the trees are added only once, or None to make one for this pair
+
+    :return: The engine and the second tree
+    :rtype: tuple(UnificationEngine,TagTree)
+
+    The two trees must be independent in the engine, or else unifying a node
+    of tree_1 with tree_2 would also change tree_2 itself. So if they share
+    feature structures, e.g. a tree is combined with itself, tree_2 is copied
+    once here, instead of copying both trees for every attempt. The copy is
+    only used for this pair, so it is put into an engine of its own.
+    """
+    if engine == None:
+        engine = UnificationEngine()
+    engine.add_tree(tree_1)
+    engine.add_tree(tree_2)
+    if engine.independent(tree_1,tree_2) == False:
+        tree_2 = deepcopy(tree_2)
+        engine = UnificationEngine()
+        engine.add_tree(tree_1)
+        engine.add_tree(tree_2)
+    return (engine,tree_2)
+
+def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False,engine=None):
     """
     Check whether one tree can be combined with another tree using substitution.
     And tree_2 must be under tree_1 in the substitution.
@@ -72,6 +145,10 @@ def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False):
      the anchor of tree_2, and True if the anchor of tree_1 is at the right of
      the anchor of tree_2.
 
+    :type engine: UnificationEngine
+    :param engine: An engine kept by the caller for many pairs of trees, see
+     combination_engine()
+
     :return: All possible combinations, also TagTree
     :rtype: list
     
@@ -85,6 +162,11 @@ def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False):
     left side of the anchor of tree_2.
     """
     result = []
+    # All attempts are made in one engine, which is made for the first
+    # attempt. A failed unification is rolled back by the engine, and a
+    # successful one is undone after the trees have been copied, so only
+    # successful combinations are copied
+    ready = False
 
     sn = tree_1.get_substitution_node()
     for i in sn:
@@ -95,23 +177,32 @@ def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False):
         #if tree_1.at_anchor_left(i) == anchor_pos:
         if True:
             if check_name_equality(i.get_node_name(),root_tree_2) == True:
-                new_tree_1 = deepcopy(tree_1)
-                new_tree_2 = deepcopy(tree_2)
+                if feature_enabled == True:
+                    if ready == False:
+                        (engine,tree_2) = combination_engine(tree_1,tree_2,engine)
+                        ready = True
+                    mark = engine.mark()
+                    # When doing substitution we need to unify the top features
+                    if engine.unify(i.get_top_feature(),tree_2.get_top_feature()) == False:
+                        engine.undo(mark)
+                        continue
+                    # The top feature of the new substitution node is the
+                    # unified one, and it is shared with the root of tree_2
+                    memo = {}
+                    new_tree_1 = engine.resolve_tree(tree_1,memo)
+                    new_tree_2 = engine.resolve_tree(tree_2,memo)
+                    engine.undo(mark)
+                else:
+                    new_tree_1 = deepcopy(tree_1)
+                    new_tree_2 = deepcopy(tree_2)
                 new_sub_node = new_tree_1.search(i.get_node_name())
 
                 if feature_enabled == True:
-                    # When doing substitution we need to unify the top features, and check whether it is null
-                    new_top_feature = new_sub_node.get_top_feature().unify(new_tree_2.get_top_feature())
-                    # Cannot unify
-                    if new_top_feature == None:
-                        print "unify_failed" # For debugging
-                        continue
-                    new_sub_node.set_top_feature(new_top_feature)
                     # Bottom feature is just a copy
                     new_sub_node.set_bottom_feature(new_tree_2.get_bottom_feature())
 
                 # Append all child nodes of tree_2 to the substitution node
-                for j in tree_2.get_child_node():
+                for j in new_tree_2.get_child_node():
                     new_sub_node.append_new_child(j)
                 # This node cannot be designeted as a substitution node, so we need to cancel that
                 new_sub_node.cancel_substitution()
@@ -119,7 +210,7 @@ def check_substitution(tree_1,tree_2,anchor_pos,feature_enabled=False):
                 
     return result
 
-def check_adjunction(tree_1,tree_2,feature_enabled=False):
+def check_adjunction(tree_1,tree_2,feature_enabled=False,engine=None):
     """
     To check adjunction using tree_2 to tree_1, i.e. tree_2 is the auxiliary tree
     
@@ -129,6 +220,10 @@ def check_adjunction(tree_1,tree_2,feature_enabled=False):
     :type tree_2: TagTree
     :param tree_2: The second tree
 
+    :type engine: UnificationEngine
+    :param engine: An engine kept by the caller for many pairs of trees, see
+     combination_engine()
+
     :return: A list containing all possible combinations using adjunction
     :rtype: list
     """
@@ -146,11 +241,31 @@ def check_adjunction(tree_1,tree_2,feature_enabled=False):
     foot_name_prefix = get_name_prefix(foot_2.get_node_name())
     # Using prefix to search for a list of nodes
     names = tree_1.prefix_search(foot_name_prefix)
+    if feature_enabled == True and len(names) > 0:
+        # The same as in check_substitution(), only successful combinations
+        # are copied
+        (engine,tree_2) = combination_engine(tree_1,tree_2,engine)
+        foot_2 = tree_2.get_foot_node()
     # Check each possible node that is 
     for i in names:
-        # Make copies, including feature structures in each tree
-        new_tree_1 = deepcopy(tree_1)
-        new_tree_2 = deepcopy(tree_2)
+        if feature_enabled == True:
+            # Next we will change the feature structure
+            # The detail is recorded in the technical report: the top of the
+            # node is unified with the top of the root of tree_2, and the
+            # bottom of the node is unified with the bottom of the foot
+            mark = engine.mark()
+            if engine.unify(i.get_top_feature(),tree_2.get_top_feature()) == False or \
+               engine.unify(i.get_bottom_feature(),foot_2.get_bottom_feature()) == False:
+                engine.undo(mark)
+                continue
+            memo = {}
+            new_tree_1 = engine.resolve_tree(tree_1,memo)
+            new_tree_2 = engine.resolve_tree(tree_2,memo)
+            engine.undo(mark)
+        else:
+            # Make copies, including feature structures in each tree
+            new_tree_1 = deepcopy(tree_1)
+            new_tree_2 = deepcopy(tree_2)
         # Locate the foot node, since it is a different instance
         new_foot = new_tree_2.search(foot_name)
         # Locate the node being adjoint, the reason is the same
@@ -167,17 +282,9 @@ def check_adjunction(tree_1,tree_2,feature_enabled=False):
             adj_node.append_new_child(j)
             
         if feature_enabled == True:
-            # Next we will change the feature structure
-            # The detail is recorded in the technical report
-            t = adj_node.get_top_feature()
-            b = adj_node.get_bottom_feature()
-            tr = new_tree_2.get_top_feature()
-            br = new_tree_2.get_bottom_feature()
-            tf = new_foot.get_top_feature()
-            bf = new_foot.get_bottom_feature()
-            adj_node.set_top_feature(t.unify(tr))
-            adj_node.set_bottom_feature(br)
-            new_foot.set_bottom_feature(b.unify(bf))
+            # The top of adj_node and the bottom of the foot are already
+            # unified, the bottom of adj_node is that of the root of tree_2
+            adj_node.set_bottom_feature(new_tree_2.get_bottom_feature())
 
         # Don't forget to let the foot node become a normal node
         new_foot.cancel_adjunction()
@@ -249,7 +356,7 @@ def enforce_word_order(tree_list,word_list):
     return ret
         
         
-def tree_compatible(tree_1,tree_2,word_list=None,feature_enabled=False,operation='AS'):
+def tree_compatible(tree_1,tree_2,word_list=None,feature_enabled=False,operation='AS',engine=None):
     """
     To combine two trees together using substitution or adjunction.
 
@@ -264,6 +371,10 @@ def tree_compatible(tree_1,tree_2,word_list=None,feature_enabled=False,operation
 
     :param feature_enabled: Whether to include feature structure during the combination of trees
     :type feature_enabled: bool
+
+    :param engine: An engine kept by the caller to combine many pairs of trees
+    with features, see combination_engine()
+    :type engine: UnificationEngine
     
     :return: The result of substitution and adjunction
     :rtype: tuple(list,list,list,list)
@@ -301,23 +412,30 @@ def tree_compatible(tree_1,tree_2,word_list=None,feature_enabled=False,operation
     """
     # Convert to upper case
     operation = operation.upper()
+    # The four checks add the same two trees into one engine
+    if feature_enabled == True and engine == None:
+        engine = UnificationEngine()
+    # The checks whose categories do not match are skipped, before the
+    # trees are copied or added into the engine
+    sub_1 = []
+    sub_2 = []
+    adj_1 = []
+    adj_2 = []
     # These two is to make sure the word in tree_1 must be at the left
     # of tree_2, whild trying all possible combinations
     # To control if we need to do substitution
     if 'A' in operation:
-        sub_1 = check_substitution(tree_1,tree_2,False,feature_enabled)
-        sub_2 = check_substitution(tree_2,tree_1,True,feature_enabled)
-    else:
-        sub_1 = []
-        sub_2 = []
+        if can_substitute(tree_1,tree_2):
+            sub_1 = check_substitution(tree_1,tree_2,False,feature_enabled,engine)
+        if can_substitute(tree_2,tree_1):
+            sub_2 = check_substitution(tree_2,tree_1,True,feature_enabled,engine)
     # Adjunction does not guarantee the order so we have an additional step
     # To control if we need to do adjunction
     if 'S' in operation:
-        adj_1 = check_adjunction(tree_1,tree_2,feature_enabled)
-        adj_2 = check_adjunction(tree_2,tree_1,feature_enabled)
-    else:
-        adj_1 = []
-        adj_2 = []
+        if can_adjoin(tree_1,tree_2):
+            adj_1 = check_adjunction(tree_1,tree_2,feature_enabled,engine)
+        if can_adjoin(tree_2,tree_1):
+            adj_2 = check_adjunction(tree_2,tree_1,feature_enabled,engine)
 
     # To control if we need an order enforcement
     if word_list != None:
@@ -350,6 +468,18 @@ def debug_check_name_equality():
 ######################################
 # Parse Viewer #######################
 ######################################
+
+def format_parse_line(columns):
+    """
+    Format a line of a parse file, the word, its POS tag, its head, its
+    relation and its tree, as written by DependencyGraphView
+
+    :param columns: The five columns
+    :type columns: list(str)
+    :rtype: str
+    """
+    return "\t".join(columns + ['\n'])
+
 class DependencyGraphView(TAGTreeSetView):
     def __init__(self, tagset):
 
@@ -413,7 +543,8 @@ class DependencyGraphView(TAGTreeSetView):
 
             if not isinstance(tree, type(self._trees)):
                 if tree._lex:
-                    tree.lexicalize()
+                    if tree.lexicalize() == False:
+                        return
                     tree._lex = False
                     self._tw.redraw(self._show_fs, tree)
                 else:
@@ -491,6 +622,10 @@ class DependencyGraphView(TAGTreeSetView):
         self.initree = {}
         filtdata = ""
         self.ininame = {}
+        # The features of all the words with a tree, looked up at once
+        words = [line.split()[0] for line in data.split('\n')
+                 if len(line.split()) == 5]
+        lex_lists = dict(zip(words, words_to_features(words)))
         for entry in data.split('\n\n'):
             if not entry:
                 continue
@@ -499,12 +634,13 @@ class DependencyGraphView(TAGTreeSetView):
                 if len(elements) < 4:
                     continue
                 if len(elements) == 5:
-                    lex_list = word_to_features(elements[0])
+                    lex_list = lex_lists[elements[0]]
                     fset = lex_search(lex_list, {}, self.alltrees)
                     for cata in fset:
                         if elements[4] in fset[cata]:
                             tree = fset[cata][elements[4]]
-                            tree.lexicalize()
+                            if tree.lexicalize() == False:
+                                continue
                             tree._lex = False
                             self.initree[elements[0]] = tree
                             self.ininame[elements[0]] = elements[4]
@@ -606,11 +742,11 @@ class DependencyGraphView(TAGTreeSetView):
                 except NotImplementedError:
                     label = e._label
                 if label in self.relmap and label in self.tagmap:
-                    fp.write("\t".join([label, self.relmap[label], str(n), 
-                                    self.tagmap[label], tagtree, '\n']))
+                    fp.write(format_parse_line([label, self.relmap[label],
+                                    str(n), self.tagmap[label], tagtree]))
                 else:
-                    fp.write("\t".join([label, "None", str(n), 
-                                    "None", tagtree, '\n']))
+                    fp.write(format_parse_line([label, "None", str(n),
+                                    "None", tagtree]))
             fp.write("\n")
 
     def parse(self):
@@ -1126,7 +1262,8 @@ class TAGTreeSelector(TAGTreeSetView):
         if not isinstance(tree, type(self._trees)):
             self._sfs_button['text'] = 'Select'
             if tree._lex:
-                tree.lexicalize()
+                if tree.lexicalize() == False:
+                    return
                 tree._lex = False
                 self._tw.redraw(self._show_fs, tree, hide_comment=True)
             else:
@@ -1016,11 +1016,12 @@ class KoreanSyntaxReader:
         sf.close()
         return
 
-fp = open('lexicon.syntax')
-s = fp.read()
-a = KoreanSyntaxReader(s)
-a.parse()
-a.dump('syntax_coded.flat','templates.lex')
+if __name__ == '__main__':
+    fp = open('lexicon.syntax')
+    s = fp.read()
+    a = KoreanSyntaxReader(s)
+    a.parse()
+    a.dump('syntax_coded.flat','templates.lex')
 
 
 """
@@ -11,7 +11,10 @@ import os
 import re
 import copy
 import nltk.data
+import gc
 import pickle
+import cPickle
+import hashlib
 
 from nltk.tree import *
 from nltk.featstruct import FeatStruct
@@ -24,7 +27,7 @@ from nltk.draw.tree import (TreeView, TreeWidget, TreeSegmentWidget)
 from nltk.sem.logic import (Variable, Expression)
 from nltk.draw.util import *
 from nltk.tokenize import word_tokenize
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from nltk.parse.dependencygraph import *
 
 def dump_to_disk(filename,obj):
@@ -55,85 +58,393 @@ def restore_from_disk(fp, language):
         obj = init_trees(language)
     return obj
 
+# Version of the cache layout and of the objects stored in it. Increase
+# this when the parser or TAGTree changes, so that old caches are rebuilt.
+CACHE_VERSION = 6
+
+# The sections in the catalog that contain TAG trees
+TREE_SECTIONS = ['tree-files', 'family-files']
+
+def grammar_path(language):
+    """
+    Get the directory of an installed grammar in ``nltk.data.path``
+    :param language: The name of the grammar, e.g. english
+    :type language: str
+    :return: The absolute path of xtag_grammar/language
+    :rtype: str
+    """
+    for path_item in nltk.data.path:
+        p = os.path.join(path_item, 'xtag_grammar', language)
+        if os.path.exists(p):
+            return p
+    raise LookupError('Cannot find xtag_grammar/%s in nltk_data' % language)
+
+def file_signature(path, old=None):
+    """
+    Get the signature of a file, which is a tuple of the modify time, the
+    size and the SHA1 hash of the content. If the modify time and the size
+    are the same as the old signature, then the file is not read again.
+    :param path: The path of the file
+    :type path: str
+    :param old: The signature recorded last time
+    :type old: tuple
+    :return: The signature
+    :rtype: tuple(float,int,str)
+    """
+    st = os.stat(path)
+    if old and old[0] == st.st_mtime and old[1] == st.st_size:
+        return old
+    sha1 = hashlib.sha1()
+    fp = open(path, 'rb')
+    while True:
+        block = fp.read(65536)
+        if not block:
+            break
+        sha1.update(block)
+    fp.close()
+    return (st.st_mtime, st.st_size, sha1.hexdigest())
+
+def shard_path(root, section, file_name):
+    """
+    Get the path of the pickle file caching the trees of one tree file
+    """
+    return os.path.join(root, 'pickles', section, file_name + '.pickle')
+
+def forest_map_path(root):
+    """
+    Get the path of the memory mapped store of all the tree files, keyed by
+    shard_key()
+    """
+    return os.path.join(root, 'pickles', 'forest.map')
+
+def shard_key(section, file_name):
+    """
+    Get the key of the trees of one tree file in the forest store
+    """
+    return section + '/' + file_name
+
+def read_manifest(root):
+    """
+    Read the cache manifest of a grammar. The manifest records the
+    signature of the catalog and every tree file when their trees
+    were cached.
+    :param root: The grammar directory returned by grammar_path()
+    :type root: str
+    :return: The manifest, or None if there is no valid manifest
+    :rtype: dict
+    """
+    path = os.path.join(root, 'pickles', 'manifest.pickle')
+    try:
+        fp = open(path, 'rb')
+        try:
+            manifest = pickle.load(fp)
+        finally:
+            fp.close()
+    except Exception:
+        return None
+    if not isinstance(manifest, dict) or \
+       manifest.get('version') != CACHE_VERSION:
+        return None
+    return manifest
+
+def write_manifest(root, manifest):
+    """
+    Write the cache manifest of a grammar. The file is replaced at once
+    so that a broken manifest is never seen by another process.
+    """
+    path = os.path.join(root, 'pickles', 'manifest.pickle')
+    temp = temp_path(path)
+    dump_to_disk(temp, manifest)
+    os.rename(temp, path)
+
 def install(language):
     """
-    Install pickle file of the TAG forest to speed up.
+    Install pickle files of the TAG forest to speed up.
     """
     #language = 'english'
-    try:
-        nltk.data.find('xtag_grammar/'+language+'/pickles/tagtreeset.pickle')
-    except LookupError:
+    if read_manifest(grammar_path(language)) == None:
         update(language)
-    #update(language)
 
 def update(language):
     """
-    Update the TAG trees pickle file to speed up.
+    Update the pickle files of the TAG trees to speed up. Only the tree
+    files whose content has changed since the last update are parsed
+    and dumped again.
+    :return: The manifest of the cache
+    :rtype: dict
     """
-    for path_item in nltk.data.path:
-        d = 'xtag_grammar/'+language
-        p = os.path.join(path_item, *d.split('/'))
-        if os.path.exists(p):
-            t = init_trees(language)
-            pic_dir = os.path.join(p, 'pickles')
-            if not os.path.exists(pic_dir):
-                os.makedirs(pic_dir)
-            tree_dir = os.path.join(pic_dir, 'tagtreeset.pickle')
-            dump_to_disk(tree_dir, t)
-            return
+    root = grammar_path(language)
+    manifest = read_manifest(root)
+    if manifest == None:
+        manifest = {'version': CACHE_VERSION, 'catalog': None,
+                    'files': {}, 'trees': {}}
+    previous = dict(manifest)
+    old_files = manifest['files']
+    old_trees = manifest['trees']
+
+    cata_path = os.path.join(root, language + '.gram')
+    manifest['catalog'] = file_signature(cata_path, manifest['catalog'])
+    cata = get_catalog(open(cata_path).read())
+    manifest['start_fs'] = get_start_feature(cata)
+
+    files = {}
+    trees = {}
+    sections = {}
+    changed = not os.path.exists(forest_map_path(root))
+    for section in TREE_SECTIONS:
+        (file_names, directory) = get_file_list(cata, section)
+        sections[section] = file_names
+        section_dir = os.path.join(root, 'pickles', section)
+        if not os.path.exists(section_dir):
+            os.makedirs(section_dir)
+        for fn in file_names:
+            path = os.path.join(root, directory, fn)
+            old = old_files.get((section, fn))
+            sig = file_signature(path, old)
+            shard = shard_path(root, section, fn)
+            if not old or old[2] != sig[2] or not os.path.exists(shard):
+                fp = open(path)
+                tagset = grammar_file_parse(fp)
+                fp.close()
+                temp = temp_path(shard)
+                dump_to_disk(temp, tagset)
+                os.rename(temp, shard)
+                trees[(section, fn)] = sorted(tagset.keys())
+                changed = True
+            else:
+                trees[(section, fn)] = old_trees[(section, fn)]
+            files[(section, fn)] = sig
+
+    # Remove the shards of the files which are not in the catalog any more
+    for (section, fn) in old_files:
+        if (section, fn) not in files:
+            shard = shard_path(root, section, fn)
+            if os.path.exists(shard):
+                os.remove(shard)
+            changed = True
+    # The forest used to be dumped as a whole, which is not used any more
+    old_pickle = os.path.join(root, 'pickles', 'tagtreeset.pickle')
+    if os.path.exists(old_pickle):
+        os.remove(old_pickle)
+
+    # The shards are copied into the forest store as they are
+    if changed:
+        shards = []
+        for (section, fn) in files:
+            fp = open(shard_path(root, section, fn), 'rb')
+            shards.append((shard_key(section, fn), fp.read()))
+            fp.close()
+        write_mapped_store(forest_map_path(root), shards, True)
+
+    manifest['files'] = files
+    manifest['trees'] = trees
+    manifest['sections'] = sections
+    # Nothing is written when no file has changed, e.g. when every worker
+    # of a pool loads the grammar
+    if manifest != previous:
+        write_manifest(root, manifest)
+    return manifest
+
+def lexicon_files(language, cata):
+    """
+    Get the paths of the files of the lexicon, in the order of the
+    arguments of init()
+    :param cata: The catalog of the grammar
+    :type cata: dict
+    :return: The morphology, syntax, template, default syntax and mapping
+        files
+    :rtype: list(str)
+    """
+    xtag_dir = 'xtag_grammar'
+    paths = []
+    for files in ['morphology-files', 'lexicon-files', 'templates-files',
+                  'syntax-default']:
+        (file_names, directory) = get_file_list(cata, files)
+        paths.append(os.sep.join([xtag_dir, language, directory,
+                                  file_names[0]]))
+    paths.append(os.sep.join([xtag_dir, language, 'syntax_morph.mapping']))
+    return [nltk.data.find(path).path for path in paths]
+
+def lexicon_cache_path(root):
+    """
+    Get the path of the compiled lexicon of a grammar
+    """
+    return os.path.join(root, 'pickles', 'lexicon.pickle')
+
+def morph_store_path(root):
+    """
+    Get the path of the memory mapped morphology of a grammar, which is
+    kept out of the compiled lexicon
+    """
+    return os.path.join(root, 'pickles', 'morph.map')
 
-def init_trees(language):
+# The number of words whose morphology is kept in memory after lookup
+MORPH_CACHE_SIZE = 4096
+
+def init_lexicon(language, cata, morph_cache=MORPH_CACHE_SIZE):
+    """
+    Initialize the lexicon of a grammar with init(). The lexicon made from
+    the text files is compiled into a cache, which starts with a header
+    recording the version of the cache and the signature of every file,
+    followed by the dictionaries. Next time the lexicon is read from the
+    cache without parsing anything, unless a file has changed.
+
+    The morphology, by far the largest dictionary, is compiled into a
+    memory mapped store instead, and word_to_morph() looks up a word in
+    the file when it is asked for, so only the words used are read.
+    :param cata: The catalog of the grammar
+    :type cata: dict
+    :param morph_cache: The number of words whose morphology is kept in
+        memory after lookup, 0 to read them from the file every time
+    :type morph_cache: int
+    """
+    paths = lexicon_files(language, cata)
+    root = grammar_path(language)
+    cache = lexicon_cache_path(root)
+    fp = None
+    header = None
+    try:
+        fp = open(cache, 'rb')
+        header = cPickle.load(fp)
+    except Exception:
+        pass
+    if not isinstance(header, dict) or \
+       header.get('version') != CACHE_VERSION:
+        header = {'version': CACHE_VERSION, 'files': {}}
+    old = header['files']
+    files = {}
+    for path in paths:
+        files[path] = file_signature(path, old.get(path))
+    if fp != None:
+        # The lexicon is millions of small objects, and the garbage
+        # collector would walk them again and again while they are made
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if len(old) == len(files) and \
+               all([old.get(p) and old[p][2] == files[p][2] for p in files]):
+                lexicon = cPickle.load(fp)
+                morph = MappedStore(morph_store_path(root), morph_cache)
+                restore_lexicon((morph,) + lexicon[1:])
+                return
+        except Exception:
+            pass
+        finally:
+            if collecting:
+                gc.enable()
+            fp.close()
+
+    init(*[open(path).read() for path in paths])
+    header['files'] = files
+    lexicon = lexicon_dicts()
+    try:
+        # The store is written first, the cache is only valid with it
+        write_mapped_store(morph_store_path(root), lexicon[0])
+        temp = temp_path(cache)
+        fp = open(temp, 'wb')
+        cPickle.dump(header, fp, -1)
+        cPickle.dump((None,) + lexicon[1:], fp, -1)
+        fp.close()
+        os.rename(temp, cache)
+    except (IOError, OSError):
+        # The lexicon is parsed again next time
+        pass
+
+def init_trees(language, lazy=False, memory_budget=None, mapped=False,
+               compact=False):
     """
     Initialize the TAG tree Forests from tree files in xtag_grammar/grammar/
+    The pickle files are updated first, so that the trees are always the
+    same as those in the tree files.
+    :param lazy: If true, a tree family is read from its pickle file
+        when it is first used instead of here
+    :type lazy: bool
+    :param memory_budget: In lazy mode, the number of bytes of pickle
+        files each section keeps in memory, None for no limit
+    :type memory_budget: int
+    :param mapped: If true, the tree families are read from the memory
+        mapped forest store instead of their pickle files, so a process
+        only unpickles the families it uses
+    :type mapped: bool
+    :param compact: If true, the trees are kept as compact nodes and
+        expanded when they are looked up, see TAGTreeSet.compact()
+    :type compact: bool
     :return: The forest of all TAG trees
     :rype: TAGTreeSet
     """
     #language = 'english'
-    cata_dir = 'xtag_grammar/'+language+'/'+language+'.gram'
-    cata_str = nltk.data.find(cata_dir).open().read()
-    cata = get_catalog(cata_str)
-    sfs = get_start_feature(cata)
-    t = parse_from_files(cata, 'tree-files', language)
-    t += parse_from_files(cata, 'family-files', language)
-    t.set_start_fs(sfs)
+    root = grammar_path(language)
+    manifest = update(language)
+    store = None
+    if mapped:
+        store = MappedStore(forest_map_path(root))
+    t = TAGTreeSet()
+    tree_index = {}
+    family_index = {}
+    for section in TREE_SECTIONS:
+        t[section] = TAGTreeSet()
+        for fn in manifest['sections'][section]:
+            names = manifest['trees'][(section, fn)]
+            for name in names:
+                tree_index[name] = (section, fn)
+            family_index[fn] = section
+            path = shard_path(root, section, fn)
+            if store != None and lazy:
+                t[section].add_shard(fn, shard_key(section, fn), len(names),
+                                     store)
+            elif store != None:
+                t[section][fn] = store[shard_key(section, fn)]
+            elif lazy:
+                t[section].add_shard(fn, path, len(names))
+            else:
+                fp = open(path, 'rb')
+                t[section][fn] = pickle.load(fp)
+                fp.close()
+        t[section].set_memory_budget(memory_budget)
+        if compact:
+            t[section].compact()
+    t.set_start_fs(manifest['start_fs'])
+    t.set_index(tree_index, family_index)
     return t
 
-def load(language):
+def load(language, lazy=False, memory_budget=None, mapped=False,
+         lexicon_dir=None, morph_cache=MORPH_CACHE_SIZE, compact=False):
     """
-    Load the forest pickle to initilize the TAG forest, load the morphology
-    files, lexicon files, template files, syntax files and mapping file
+    Load the forest pickles to initilize the TAG forest, load the morphology
+    files, lexicon files, template files, syntax files and mapping file,
+    from the compiled lexicon if they have not changed, see init_lexicon()
+    :param lazy: If true, tree families are read when they are first used,
+        otherwise all of them are read here
+    :type lazy: bool
+    :param memory_budget: In lazy mode, the number of bytes of pickle
+        files each section keeps in memory, None for no limit
+    :type memory_budget: int
+    :param mapped: If true, the tree families are read from the memory
+        mapped forest store, see init_trees()
+    :type mapped: bool
+    :param lexicon_dir: A directory written by dump_lexicon(), which is
+        mapped instead of parsing the lexicon files
+    :type lexicon_dir: str
+    :param morph_cache: The number of words whose morphology is kept in
+        memory after lookup, see init_lexicon()
+    :type morph_cache: int
+    :param compact: If true, the trees are kept as compact nodes, which
+        take much less memory, and expanded when they are looked up
+    :type compact: bool
     :return: The forest of all TAG trees
     :rype: TAGTreeSet
     """
-    xtag_dir = 'xtag_grammar'
     #language = 'english'
     cata_dir = 'xtag_grammar/' + language + '/' + language + '.gram'
-    pickle_dir = 'xtag_grammar/'+language+'/pickles/tagtreeset.pickle'
     cata_str = nltk.data.find(cata_dir).open().read()
 
     cata = get_catalog(cata_str)
 
-    treefile = nltk.data.find(pickle_dir).open()
-    treeset = restore_from_disk(treefile, language)
-    morph = get_file_list(cata, 'morphology-files')
-    syn = get_file_list(cata, 'lexicon-files')
-    temp = get_file_list(cata, 'templates-files')
-    default = get_file_list(cata, 'syntax-default')
-
-
-    morph_path = os.sep.join([xtag_dir, language, morph[1], morph[0][0]])
-    syn_path = os.sep.join([xtag_dir, language, syn[1], syn[0][0]])
-    temp_path = os.sep.join([xtag_dir, language, temp[1], temp[0][0]])
-    default_path = os.sep.join([xtag_dir, language,default[1], default[0][0]])
-    mapping_path = os.sep.join([xtag_dir, language, 'syntax_morph.mapping'])
-
-    morph_str = nltk.data.find(morph_path).open().read()
-    syn_str = nltk.data.find(syn_path).open().read()
-    temp_str = nltk.data.find(temp_path).open().read()
-    default_str = nltk.data.find(default_path).open().read()
-    mapping_str = nltk.data.find(mapping_path).open().read()
-
-    init(morph_str, syn_str, temp_str, default_str, mapping_str)
+    treeset = init_trees(language, lazy, memory_budget, mapped, compact)
+    if lexicon_dir != None:
+        map_lexicon(lexicon_dir, morph_cache)
+        return treeset
+    init_lexicon(language, cata, morph_cache)
 
     return treeset   
 
@@ -287,7 +598,26 @@ class TAGTreeSet(dict):
 
     TAG Tree Sets are typically used to store the Tree information
     about TAG Tree Set. It can be merged with other TAG Tree Set.
+
+    A TAG Tree Set can also be lazy. Tree families added with
+    ``add_shard()`` stay in their pickle files until they are first
+    used, and the least recently used families are dropped again
+    when they take more than ``memory_budget`` bytes.
+
+    The trees can be kept in memory as compact nodes, see ``compact()``.
+    A compact node is expanded into a new TAG tree every time it is
+    looked up, so changes to the tree are not kept in the set.
     """
+    # Lazy mode: family name -> (pickle path, pickle size, tree count,
+    #                            mapped store or None)
+    _shards = None
+    memory_budget = None
+    # Whether the families read by load_shard() are made compact
+    compact_shards = False
+    # Forest indexes: tree name -> (section, family), family -> section
+    _tree_index = None
+    _family_index = None
+
     def __init__(self, trees=None):
         dict.__init__(self)
         self.depth = 0
@@ -296,11 +626,189 @@ class TAGTreeSet(dict):
             self.update(trees)
 
     def __setitem__(self, tree_name, tree):
+        if self._shards and tree_name in self._shards:
+            self.drop_shard(tree_name)
+            del self._shards[tree_name]
         dict.__setitem__(self, tree_name, tree)
 
     def __getitem__(self, tree_name):
         return self.get(tree_name, 0)
 
+    def get(self, tree_name, default=None):
+        if self._shards and tree_name in self._shards:
+            return self.load_shard(tree_name)
+        item = dict.get(self, tree_name, default)
+        if isinstance(item, TAGNode):
+            return item.to_tree()
+        return item
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def itervalues(self):
+        for name in self:
+            yield self[name]
+
+    def iteritems(self):
+        for name in self:
+            yield (name, self[name])
+
+    def set_index(self, tree_index, family_index):
+        """
+        Set the indexes of a forest, which is a TAG Tree Set of
+        sections containing tree families.
+        :param tree_index: Mapping from tree names to (section, family)
+        :type tree_index: dict
+        :param family_index: Mapping from family names to sections
+        :type family_index: dict
+        """
+        self._tree_index = tree_index
+        self._family_index = family_index
+
+    def build_index(self):
+        """
+        Build the indexes of a forest by visiting all its families.
+        It should be called again after the forest is changed.
+        """
+        tree_index = {}
+        family_index = {}
+        for section in sorted(self.keys()):
+            sset = self[section]
+            if not isinstance(sset, TAGTreeSet):
+                continue
+            for family in sorted(sset.keys()):
+                fset = sset[family]
+                if not isinstance(fset, TAGTreeSet):
+                    continue
+                family_index[family] = section
+                for name in fset:
+                    tree_index[name] = (section, family)
+        self.set_index(tree_index, family_index)
+
+    def family_section(self, family):
+        """
+        Get the section of a tree family in a forest
+        :param family: The name of the family, e.g. Tnx0VAN1Pnx2.trees
+        :type family: str
+        :return: The name of the section, or None if not found
+        :rtype: str
+        """
+        if self._family_index == None:
+            self.build_index()
+        return self._family_index.get(family)
+
+    def find_tree(self, tree_name):
+        """
+        Get a TAG tree in a forest by its name
+        :param tree_name: The name of the tree
+        :type tree_name: str
+        :return: The TAG tree, or None if not found
+        :rtype: TAGTree
+        """
+        if self._tree_index == None:
+            self.build_index()
+        if tree_name not in self._tree_index:
+            return None
+        (section, family) = self._tree_index[tree_name]
+        return self[section][family][tree_name]
+
+    def __getstate__(self):
+        # Copies and pickles hold all the families in memory
+        state = self.__dict__.copy()
+        for attr in ['_shards', '_loaded', '_loaded_size']:
+            state.pop(attr, None)
+        return state
+
+    def add_shard(self, name, path, count, store=None):
+        """
+        Add a tree family kept in a pickle file without reading it.
+        :param name: The name of the tree family, e.g. Tnx0VAN1Pnx2.trees
+        :type name: str
+        :param path: The pickle file of the tree family, or its key in
+            ``store``
+        :type path: str
+        :param count: The number of trees in the family
+        :type count: int
+        :param store: The memory mapped store of the tree family, or None
+        :type store: MappedStore
+        """
+        if self._shards == None:
+            self._shards = {}
+            # Loaded families and their sizes, least recently used first
+            self._loaded = OrderedDict()
+            self._loaded_size = 0
+        if store == None:
+            size = os.path.getsize(path)
+        else:
+            size = store.size(path)
+        self._shards[name] = (path, size, count, store)
+        dict.__setitem__(self, name, None)
+
+    def load_shard(self, name):
+        """
+        Get a lazy tree family, reading it from the disk if it is
+        not in memory. The family becomes the most recently used.
+        """
+        if name in self._loaded:
+            size = self._loaded.pop(name)
+            self._loaded[name] = size
+            return dict.__getitem__(self, name)
+        (path, size, count, store) = self._shards[name]
+        if store == None:
+            fp = open(path, 'rb')
+            family = pickle.load(fp)
+            fp.close()
+        else:
+            family = store[path]
+        if self.compact_shards:
+            family.compact()
+        dict.__setitem__(self, name, family)
+        self._loaded[name] = size
+        self._loaded_size += size
+        self.evict()
+        return family
+
+    def drop_shard(self, name):
+        """
+        Remove a lazy tree family from memory, it will be read
+        from the disk again when it is used.
+        """
+        if name in self._loaded:
+            self._loaded_size -= self._loaded.pop(name)
+            dict.__setitem__(self, name, None)
+
+    def evict(self):
+        """
+        Drop the least recently used tree families until the loaded
+        families fit in the memory budget. The most recently used
+        family is always kept.
+        """
+        if self._shards == None or self.memory_budget == None:
+            return
+        while self._loaded_size > self.memory_budget and len(self._loaded) > 1:
+            self.drop_shard(next(iter(self._loaded)))
+
+    def set_memory_budget(self, budget):
+        """
+        Set the number of bytes of pickle files the lazy tree families
+        may take in memory.
+        :param budget: The budget in bytes, None for no limit
+        :type budget: int
+        """
+        self.memory_budget = budget
+        self.evict()
+
+    def loaded_shards(self):
+        """
+        Get the names of the lazy tree families currently in memory
+        """
+        if self._shards == None:
+            return []
+        return list(self._loaded)
+
     def __str__(self):
         items = ['%r: %r' % (s, self[s]) for s in self.keys()[:10]]
         if len(self) > 10:
@@ -357,7 +865,9 @@ class TAGTreeSet(dict):
         """
         total = 0 
         for tree in self:
-            if isinstance(self[tree], TAGTreeSet):
+            if self._shards and tree in self._shards:
+                total += self._shards[tree][2]
+            elif isinstance(self[tree], TAGTreeSet):
                 total += self[tree].tree_count()
             else:
                 total += 1
@@ -369,7 +879,9 @@ class TAGTreeSet(dict):
         """
         total = 0 
         for tree in self:
-            if isinstance(self[tree], TAGTreeSet) and tree[-6:] == '.trees':
+            if self._shards and tree in self._shards:
+                total += 1
+            elif isinstance(self[tree], TAGTreeSet) and tree[-6:] == '.trees':
                 total += 1
             elif isinstance(self[tree], TAGTreeSet):
                 total += self[tree].tree_family_count()
@@ -393,6 +905,46 @@ class TAGTreeSet(dict):
                     clone += copy.copy(tree)
             return clone    
 
+    def compact(self):
+        """
+        Keep all the TAG trees in ``self`` in their compact form, which
+        is expanded when a tree is looked up. Lazy tree families are
+        made compact when they are read. Use ``expand()`` to keep TAG
+        trees again.
+        """
+        if self._shards != None:
+            self.compact_shards = True
+        for name in self.keys():
+            # Lazy families which are not read yet are None
+            item = dict.get(self, name)
+            if isinstance(item, TAGTree):
+                dict.__setitem__(self, name, item.compact())
+            elif isinstance(item, TAGTreeSet):
+                item.compact()
+
+    def expand(self):
+        """
+        Replace all the compact nodes in ``self`` with TAG trees.
+        """
+        self.compact_shards = False
+        for name in self.keys():
+            item = dict.get(self, name)
+            if isinstance(item, TAGNode):
+                dict.__setitem__(self, name, item.to_tree())
+            elif isinstance(item, TAGTreeSet):
+                item.expand()
+
+    def cow_copy(self):
+        """
+        Return a copy of ``self`` whose TAG trees are copy-on-write
+        copies of the trees in ``self``.
+        """
+        clone = type(self)()
+        for name in self:
+            clone[name] = self[name].cow_copy()
+        clone.start_fs = self.start_fs
+        return clone
+
     def set_start_fs(self, fs):
         """
         Set start feature of all TAG trees.
@@ -596,7 +1148,8 @@ class TAGTreeSetView(object):
 
         if not isinstance(tree, type(self._trees)):
             if tree._lex:
-                tree.lexicalize()
+                if tree.lexicalize() == False:
+                    return (None, None)
                 tree._lex = False
             return (tree, subpath)
 
@@ -625,7 +1178,8 @@ class TAGTreeSetView(object):
             else:
                 self._sfs_button['text'] = 'Add Start Features'
             if tree._lex:
-                tree.lexicalize()
+                if tree.lexicalize() == False:
+                    return
                 tree._lex = False
                 self._tw.redraw(self._show_fs, tree)
             else:
@@ -971,17 +1525,17 @@ def lex_search(lex_list, count, alltrees):
                 else:
                     key = tf[:-5] + '_' + str(count[ckey]) + '.trees'
                 sset[key] = TAGTreeSet()
-                index = None
-                for sub in alltrees:
-                    if tf in alltrees[sub]:
-                        index = sub
+                index = alltrees.family_section(tf)
                 if not index:
                     raise NameError('No tree fmaily')
-                sset[key] += alltrees[index][tf].copy(True)
-                for t in sset[key]:
+                sset[key] += alltrees[index][tf].cow_copy()
+                for t in sset[key].keys():
                     if sset[key][t]._lex:
                         sset[key][t]._lex_fs
                     sset[key][t].init_lex(morph[0], morph[3], morph[4])
+                    # The features of the word do not fit the tree
+                    if not sset[key][t].can_lexicalize():
+                        del sset[key][t]
                 count[ckey] += 1
         else:
             for t in morph[1]:
@@ -992,14 +1546,15 @@ def lex_search(lex_list, count, alltrees):
                 else:
                     key = t + '_' + str(count[ckey])
 
-                for sub in alltrees:
-                    for tr in alltrees[sub]:
-                        if t in alltrees[sub][tr]:
-                            sset[key] = alltrees[sub][tr][t].copy(True)
+                tree = alltrees.find_tree(t)
+                if tree is not None:
+                    sset[key] = tree.cow_copy()
                 count[ckey] += 1
                 if not isinstance(sset[key], TAGTree):
                     raise TypeError('Not TAGTree')
                 sset[key].init_lex(morph[0], morph[3], morph[4])
+                if not sset[key].can_lexicalize():
+                    del sset[key]
     fset.set_start_fs(alltrees.start_fs)
     return fset
 
@@ -1015,7 +1570,24 @@ class TAGTree(Tree):
     The TAG Tree can be lexicalized, which means we can attach a word
     to the substitution node and unify the feature structures in the 
     tree with the feature structures of the attachd node.
+
+    A TAG Tree made by ``cow_copy()`` is copy-on-write. It shares its
+    subtrees and feature structures with the original tree, and gets
+    its own ones from ``materialize()`` before it is changed. The
+    methods that give out its nodes or feature structures, like
+    ``search()`` and ``get_substitution_node()``, materialize it first,
+    since the caller may change them.
+
+    The substitution nodes, the foot node, the head nodes and the nodes of
+    every label are kept in a ``TreeIndex``, which is built when the
+    grammar is loaded and stored in the cache with the tree. Every node
+    knows its parent, so a method changing the children of a node drops
+    the index of the node and of all the nodes above it.
     """    
+    _shared = False
+    _index = None
+    _parent = None
+
     def __init__(self, node_with_fs, children, attr=None):
         self.attr = attr
         self._lex = False
@@ -1043,6 +1615,9 @@ class TAGTree(Tree):
         if isinstance(children, basestring):
             raise TypeError("%s() argument 2 should be a list, not a "
                             "string" % type(self).__name__)
+        for child in self:
+            if isinstance(child, TAGTree):
+                child._parent = self
 
     def set_comment(self, comment):
         comment = comment.replace("\\\"","\"")
@@ -1068,33 +1643,114 @@ class TAGTree(Tree):
             return copy.deepcopy(self)
         else:
             clone = copy.copy(self)
+            clone._shared = self._shared
+            # The index of self has self as the root
+            clone._index = None
             if clone._lex:
                 clone._lex_fs = copy.deepcopy(self._lex_fs)
         return clone
 
-    def __get_node(self, name_or_attr):
-        nodes = []
-        results = []
-        nodes.append(self)
-        while len(nodes) > 0:
-            last = nodes.pop()
-            try:
-                label = last.node
-            except NotImplementedError:
-                label = last._label
-            if label == name_or_attr or last.attr == name_or_attr:
-                results.append(last)
-            else:
-                for child in last:
-                    if isinstance(child, TAGTree):
-                        nodes.append(child)
-        return results
+    def __getstate__(self):
+        # Deep copies and pickles own their subtrees, and do not go up
+        # to the parent
+        state = self.__dict__.copy()
+        state.pop('_shared', None)
+        state.pop('_parent', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # A pickle gives the children before the state
+        for child in self:
+            if isinstance(child, TAGTree) and child._parent == None:
+                child._parent = self
+
+    def __deepcopy__(self, memo):
+        # Like the generic deep copy, which gives the children after the
+        # state, and then the children get their parent
+        clone = type(self).__new__(type(self))
+        memo[id(self)] = clone
+        clone.__dict__.update(copy.deepcopy(self.__getstate__(), memo))
+        clone.replace_children([copy.deepcopy(child, memo)
+                                for child in self])
+        return clone
+
+    def cow_copy(self):
+        """
+        Return a copy-on-write copy of ``self``. It is much cheaper
+        than a deep copy when most copies are never changed, like the
+        trees of a family during lexicalization.
+        """
+        clone = self.copy(False)
+        clone._shared = True
+        # The nodes are those of self until the clone is materialized
+        clone._index = self._index
+        return clone
+
+    def materialize(self):
+        """
+        Give a copy-on-write tree its own subtrees and feature
+        structures, keeping the references between them. Nothing
+        is done if the tree is not shared.
+        """
+        if not self._shared:
+            return
+        memo = {}
+        self.top_fs = copy.deepcopy(self.top_fs, memo)
+        self.bot_fs = copy.deepcopy(self.bot_fs, memo)
+        self._shared = False
+        self.replace_children([copy.deepcopy(child, memo) for child in self])
+
+    def node_index(self):
+        """
+        :return: The index of the nodes of the tree, which is built
+        if the tree does not have one. The nodes of a copy-on-write
+        tree are those of the original tree, so they must not be
+        changed; its index is the one of the original tree, except
+        that the root is not the copy.
+        :rtype: TreeIndex
+        """
+        if self._index == None:
+            self._index = TreeIndex(self)
+        return self._index
+
+    def _own_index(self):
+        # The index of the nodes, after a copy-on-write tree has got
+        # its own nodes, for the methods giving them to the caller
+        self.materialize()
+        return self.node_index()
+
+    def reindex(self):
+        """
+        Drop the index of the nodes of this node and of the nodes above
+        it, they will be built again when they are used. The methods of
+        TAG Tree that change the children of a node call this, so it is
+        only needed after changing the children as a list, e.g.
+        ``tree[0] = node``.
+        """
+        node = self
+        while node != None:
+            node._index = None
+            node = node._parent
+
+    def replace_children(self, children):
+        """
+        Replace all the children of the current TAGTree
+
+        :param children: The new children
+        :type children: list
+        """
+        self[:] = children
+        for child in children:
+            if isinstance(child, TAGTree):
+                child._parent = self
+        self.reindex()
 
     def get_head(self):
         """
         Get the head node of the TAG Tree
         """
-        return self.__get_node('head')
+        return list(self._own_index().heads)
 
     def set_children(self, children):
         """
@@ -1104,6 +1760,9 @@ class TAGTree(Tree):
             raise TypeError("%s() argument 2 should be a list, not a "
                             "string" % type(self).__name__)
         self.append(children)
+        if isinstance(children, TAGTree):
+            children._parent = self
+        self.reindex()
 
     def init_lex(self, morph, fs1, fs2):
         """
@@ -1118,11 +1777,14 @@ class TAGTree(Tree):
         for nf in fs1+fs2:
             for key in nf.keys():
                 tf = FeatStruct()
+                # The features of word_to_features() are frozen and shared,
+                # lexicalize() only reads them
+                value = nf[key]
                 if key[-2:] not in ['.t', '.b']:
                     tf[global_featname(morph[0][1], False)] = FeatStruct()
-                    tf[global_featname(morph[0][1], False)][key] = nf[key]
+                    tf[global_featname(morph[0][1], False)][key] = value
                 else:
-                    tf[key] = nf[key]
+                    tf[key] = value
                 self._lex_fs.append(tf)
         self._lex = True
 
@@ -1131,72 +1793,108 @@ class TAGTree(Tree):
         Do lexicalization operation, attach the lex
         to the substitution node, unify the feature
         structure defined in grammar files
+        :return: False if the features of the word do not unify with
+        those of the tree, e.g. a base form in a gerund tree, or else
+        True. The tree is not changed if it is False, and it should be
+        dropped, like lex_search() does.
+        :rtype: bool
+        """
+        self.materialize()
+        anchors = []
+        for head in self.get_head():
+            for m in self._morph:
+                if head.get_node_name().replace('_','') == m[1]:
+                    anchors.append((head, m[0]))
+        if len(anchors) == 0:
+            return True
+        unified = self._unify_lex_fs()
+        if unified == None:
+            return False
+        (all_fs, engine) = unified
+        # The nodes not reached by the unification are resolved too
+        engine.add_tree(self)
+        memo = {}
+        for key in all_fs:
+            all_fs[key] = engine.resolve(all_fs[key], memo)
+        self.set_all_fs(all_fs)
+        for (head, word) in anchors:
+            head.set_children(TAGTree(word, [], 'lex'))
+        return True
+
+    def can_lexicalize(self):
+        """
+        Check whether lexicalize() would succeed, without copying a
+        copy-on-write tree
+
+        :rtype: bool
         """
-        morph = self._morph
-        fs = self._lex_fs
-        heads = self.get_head()
-        for head in heads:
-            for m in morph:
+        for head in self.node_index().heads:
+            for m in self._morph:
                 if head.get_node_name().replace('_','') == m[1]:
-                    lex = TAGTree(m[0], [], 'lex')
-                    head.set_children(lex)
-                    all_fs = self.get_all_fs()
-                    for f in fs:
-                        stack = []
-                        for node in f:
-                            for attr in f[node]:
-                                if node in all_fs:
-                                    all_fs[node][attr] = f[node][attr]
-                                else:
-                                    all_fs[node] = FeatStruct()
-                                    all_fs[attr] = f[node][attr]
-                        for node in f:
-                            keys = f[node].keys()
-                            stack = []
-                            for key in keys:
-                                stack.append([f[node], key])
-                            while len(stack) > 0:
-                                path = stack.pop()
-                                feat = path[0]
-                                for e in range(1, len(path)):
-                                    feat = feat[path[e]]
-                                first_key = feat.keys()[0]
-                                if first_key[:5] == '__or_':
-                                    mapping = feat[first_key].split(':')
-                                    if len(mapping) == 2:
-                                        m_node = mapping[0]
-                                        m_attr = mapping[1][1:-1]
-                                        if not m_attr in all_fs[m_node]:
-                                            all_fs[m_node][m_attr]['__or_'] = ''
-                                        m_key = all_fs[m_node][m_attr].keys()[0]
-                                        c_feat = all_fs[node]
-                                        for e in range(1, len(path)-1):
-                                            c_feat = c_feat[path[e]]
-                                        c_feat[path[-1]] = all_fs[m_node][m_attr]
-                                    else:
-                                        continue
-                                else:
-                                    feat_list = []
-                                    for key in feat:
-                                        items = copy.copy(path)
-                                        items.append(key)
-                                        feat_list.append(items)
-                                    stack += feat_list
-                        
-                    self.set_all_fs(all_fs)
+                    return self._unify_lex_fs() != None
+        return True
+
+    def _unify_lex_fs(self):
+        # Unify the features given by init_lex() with the feature
+        # structures of the nodes, in a UnificationEngine like unify().
+        # Return the feature structures of the nodes and the engine, or
+        # None if they do not unify. Nothing is changed here, and only
+        # the nodes reached by the unification are added to the engine.
+        all_fs = self._node_fs()
+        engine = UnificationEngine()
+        for f in self._lex_fs:
+            for node in f:
+                if node not in all_fs:
+                    continue
+                value = self._lex_value(f[node], all_fs, engine, {})
+                if engine.unify(all_fs[node], value) == False:
+                    return None
+        return (all_fs, engine)
+
+    def _lex_value(self, fs, all_fs, engine, memo):
+        # A feature structure of init_lex() in which a leaf like
+        # V.t:<agr> is replaced by the <agr> node of V.t, so that the
+        # engine makes the two share one node
+        if id(fs) in memo:
+            return memo[id(fs)]
+        if test_leaf(fs):
+            value = leaf_value(fs)
+            new_fs = fs
+            if value != None and len(value) == 1:
+                mapping = iter(value).next().split(':')
+                if len(mapping) == 2:
+                    m_attr = mapping[1][1:-1]
+                    target = FeatStruct()
+                    target[m_attr] = make_leaf()
+                    # Add the feature to the node if it has none
+                    engine.unify(all_fs[mapping[0]], target)
+                    new_fs = target[m_attr]
+            memo[id(fs)] = new_fs
+            return new_fs
+        new_fs = FeatStruct()
+        memo[id(fs)] = new_fs
+        for key in fs:
+            new_fs[key] = self._lex_value(fs[key], all_fs, engine, memo)
+        return new_fs
 
     def unify(self, fs):
         """
-        Unify feature structure with TAG tree:
-        :param: unified feature structure
+        Unify feature structure with TAG tree. The nodes shared between
+        the feature structures of the tree nodes remain shared.
+        :param: unified feature structure, whose keys are those returned
+        by get_all_fs(), e.g. S_r.t
         :type: FeatStruct
         """
         all_fs = self.get_all_fs()
-        temp = all_fs.unify(f)
-        if temp:
-            all_fs = temp
-        else:
-            raise NameError("Unify return None")
+        engine = UnificationEngine()
+        engine.add_tree(self)
+        for key in fs:
+            if key in all_fs:
+                if engine.unify(all_fs[key], fs[key]) == False:
+                    raise NameError("Unify return None")
+        memo = {}
+        for key in all_fs:
+            all_fs[key] = engine.resolve(all_fs[key], memo)
         self.set_all_fs(all_fs)
 
     #def _find_value(self, fs, idn, cfs):
@@ -1219,8 +1917,15 @@ class TAGTree(Tree):
 
     def get_all_fs(self):
         """
-        Get the overall feature structure of the TAGTree
+        Get the overall feature structure of the TAGTree. The feature
+        structures are those of the nodes, so a copy-on-write tree
+        is materialized first.
         """
+        self.materialize()
+        return self._node_fs()
+
+    def _node_fs(self):
+        # The feature structures of the nodes by label, as they are
         stack = []
         all_feat = FeatStruct()
         stack.append(self)
@@ -1243,6 +1948,7 @@ class TAGTree(Tree):
         """
         if not all_fs:
             return
+        self.materialize()
         nodes = []
         nodes.append(self)
         while len(nodes) > 0:
@@ -1265,6 +1971,7 @@ class TAGTree(Tree):
         :return: leaves of this tree
         :rtype: list
         """
+        self.materialize()
         leaves = []
         if len(self) == 0:
             leaves.append(self)
@@ -1278,6 +1985,7 @@ class TAGTree(Tree):
         """
         if self.attr == 'subst':
             self.attr = None
+            self.reindex()
         else:
             raise TypeError("No substitution node for this tree")
 
@@ -1286,11 +1994,7 @@ class TAGTree(Tree):
         :return: substitution subtree
         :rtype: TAGTree
         """
-        sub = []
-        for leaf in self.leaves():
-            if leaf.attr == 'subst':
-                sub.append(leaf)
-        return sub
+        return list(self._own_index().subst)
 
     def prefix_search(self, tree_name):
         """
@@ -1298,18 +2002,7 @@ class TAGTree(Tree):
         :return: subtree with tree_name as prefix
         :rtype: TAGTree
         """
-        trees = []
-        try:
-            label = self.node
-        except NotImplementedError:
-            label = self._label
-        name = label.split('_')
-        prefix = name[0]
-        if prefix == tree_name:
-            trees.append(self)
-        for child in self:
-            trees.extend(child.prefix_search(tree_name))
-        return trees
+        return list(self._own_index().prefixes.get(tree_name, ()))
 
     def delete_all_child(self):
         """
@@ -1317,7 +2010,11 @@ class TAGTree(Tree):
         """
         result = []
         while(len(self)) > 0:
-            self.pop()
+            child = self.pop()
+            # The child may have been appended to another node already
+            if isinstance(child, TAGTree) and child._parent is self:
+                child._parent = None
+        self.reindex()
 
     def cancel_adjunction(self):
         """
@@ -1325,6 +2022,7 @@ class TAGTree(Tree):
         """
         if self.attr == 'foot':
             self.attr = None
+            self.reindex()
         else:
             raise TypeError("No adjunction node")
 
@@ -1334,39 +2032,34 @@ class TAGTree(Tree):
         :return: subtree with tree_name as root name
         :rtype: TAGTree
         """
-        try:
-            label = self.node
-        except NotImplementedError:
-            label = self._label
-        if label == tree_name:
-            return self
-        else:
-            for child in self:
-                tree = child.search(tree_name)
-                if tree != None:
-                    return tree
-        return None
+        return self._own_index().names.get(tree_name)
 
     def get_child_node(self):
+        self.materialize()
         return [child for child in self]
 
     def append_new_child(self, tree):
         self.append(tree)
+        if isinstance(tree, TAGTree):
+            tree._parent = self
+        self.reindex()
 
     def get_top_feature(self):
+        self.materialize()
         return self.top_fs
 
     def get_bottom_feature(self):
+        self.materialize()
         return self.bot_fs
 
+    def set_top_feature(self, fs):
+        self.top_fs = fs
+
     def set_bottom_feature(self, fs):
-        self.bot_fs[key]['__or_'+value] = value
+        self.bot_fs = fs
 
     def get_foot_node(self):
-        for leaf in self.leaves():
-            if leaf.attr == 'foot':
-                return leaf
-        return None 
+        return self._own_index().foot
 
     def correct_name(self):
         """
@@ -1400,6 +2093,164 @@ class TAGTree(Tree):
                 count = child.check_name(names, count)
         return count
 
+    def compact(self):
+        """
+        Convert the tree into ``TAGNode`` objects, which take much
+        less memory. The feature structures are shared, not copied.
+        :return: The compact form of the tree
+        :rtype: TAGNode
+        """
+        extra = None
+        for key in self.__dict__:
+            # The index and the parent refer to TAG tree nodes, they
+            # are built again by the tree from to_tree()
+            if key not in TAGNode.tree_fields and \
+               key not in ['_index', '_parent']:
+                if extra == None:
+                    extra = {}
+                extra[key] = self.__dict__[key]
+        if self._lex:
+            if extra == None:
+                extra = {}
+            extra['_lex'] = True
+        children = []
+        for child in self:
+            if isinstance(child, TAGTree):
+                children.append(child.compact())
+            else:
+                children.append(child)
+        return TAGNode(self.get_node_name(), self.attr, self.top_fs,
+                       self.bot_fs, tuple(children), self.comment,
+                       self.start_feat, extra)
+
+class TAGNode(object):
+    """
+    A compact form of a TAG Tree node for keeping large forests in
+    memory. All the fields are slots, the label is stored only once,
+    and the children are kept in a tuple. ``TAGTree.compact()`` and
+    ``TAGNode.to_tree()`` convert between the two forms without
+    losing anything.
+
+    Attributes of the TAG Tree other than the fields below, like
+    ``_morph`` and ``_lex_fs`` of a lexicalized tree, are kept in
+    the ``extra`` dictionary.
+    """
+    __slots__ = ('label', 'attr', 'top_fs', 'bot_fs', 'children',
+                 'comment', 'start_feat', 'extra')
+
+    # The attributes of TAGTree stored in slots
+    tree_fields = frozenset(['node', '_label', 'attr', '_lex', 'top_fs',
+                             'bot_fs', 'comment', 'start_feat'])
+
+    def __init__(self, label, attr, top_fs, bot_fs, children=(),
+                 comment=None, start_feat=False, extra=None):
+        self.label = label
+        self.attr = attr
+        self.top_fs = top_fs
+        self.bot_fs = bot_fs
+        self.children = children
+        self.comment = comment
+        self.start_feat = start_feat
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.children)
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __getitem__(self, index):
+        return self.children[index]
+
+    def __repr__(self):
+        return '<TAGNode %s with %d children>' % (self.label,
+                                                   len(self.children))
+
+    def get_node_name(self):
+        """
+        Get node name of this node
+        """
+        return self.label
+
+    def to_tree(self):
+        """
+        Convert the node and its children back into a TAG Tree
+        :return: The TAG tree
+        :rtype: TAGTree
+        """
+        children = []
+        for child in self.children:
+            if isinstance(child, TAGNode):
+                children.append(child.to_tree())
+            else:
+                children.append(child)
+        tree = TAGTree((self.label, self.top_fs, self.bot_fs), children,
+                       self.attr)
+        tree.comment = self.comment
+        tree.start_feat = self.start_feat
+        if self.extra:
+            tree.__dict__.update(self.extra)
+        return tree
+
+class TreeIndex(object):
+    """
+    The nodes of a TAG tree that parsing looks for, found in one walk
+    over the tree, so that looking for them is a dictionary lookup
+    instead of a walk.
+
+    ``subst`` are the substitution nodes from left to right, ``foot`` is
+    the foot node or None, ``heads`` are the head nodes, ``prefixes``
+    maps a label prefix (the label without the '_XXX' suffix) to the
+    nodes having it, and ``names`` maps a label to the first node having
+    it. The index is not changed after it is built; a tree whose
+    structure is changed drops its index, see ``TAGTree.reindex()``, and
+    builds a new one.
+    """
+    __slots__ = ('subst', 'foot', 'heads', 'prefixes', 'names')
+
+    def __init__(self, tree):
+        subst = []
+        foot = None
+        prefixes = {}
+        names = {}
+        # Pre-order, the order in which the nodes were searched for
+        nodes = [tree]
+        while len(nodes) > 0:
+            last = nodes.pop()
+            label = last.get_node_name()
+            if label not in names:
+                names[label] = last
+            prefix = label.split('_')[0]
+            if prefix not in prefixes:
+                prefixes[prefix] = []
+            prefixes[prefix].append(last)
+            if len(last) == 0:
+                if last.attr == 'subst':
+                    subst.append(last)
+                elif last.attr == 'foot' and foot == None:
+                    foot = last
+            for child in reversed(last):
+                if isinstance(child, TAGTree):
+                    nodes.append(child)
+
+        # The nodes below a head node are not heads
+        heads = []
+        nodes = [tree]
+        while len(nodes) > 0:
+            last = nodes.pop()
+            if last.get_node_name() == 'head' or last.attr == 'head':
+                heads.append(last)
+            else:
+                for child in last:
+                    if isinstance(child, TAGTree):
+                        nodes.append(child)
+
+        self.subst = tuple(subst)
+        self.foot = foot
+        self.heads = tuple(heads)
+        self.prefixes = dict([(k, tuple(v)) for (k, v) in prefixes.items()])
+        self.names = names
+
 ######################################################################
 #{ Helper Functions
 #{ Parse grammar file
@@ -1412,7 +2263,7 @@ def parse_tree_list(text, fs):
 
 def build_tree(tree_list, fs):
     node = parse_node(tree_list[0])
-    node_name = node[0]
+    node_name = intern_atom(node[0])
     node_attr = node[1]
     top_fs = FeatStruct()
     bot_fs = FeatStruct()
@@ -1505,16 +2356,15 @@ def grammar_file_parse(text):
     """
     Get a TAGTreeSet from grammar files
 
-    :param text is a string describing TAG trees, the form is defined in
-    UPenn Xtag project
+    :param text is a string or a file object describing TAG trees, the form
+    is defined in UPenn Xtag project
     """
-    calist = analyze_tree_3(analyze_tree_2(analyze_tree_1(text)))
-    arglist = analyze_tree_5(analyze_tree_4(calist))
     tagset = TAGTreeSet()      
-    for element in arglist:
-        new_tree = parse_tree_list(element[2], element[4])
-        tree_name = element[0]
-        new_tree.set_comment(element[5]['COMMENTS'])
+    for (tree_name, tree_list, features, comments) in iter_tree_file(text):
+        new_tree = build_tree(tree_list, features)
+        new_tree.set_comment(comments)
+        # Built here so that it is stored in the cache with the tree
+        new_tree.node_index()
         tagset[tree_name] = new_tree
     return tagset
 
@@ -1534,9 +2384,10 @@ def parse_from_files(cata, files, language):
     directory = tree_list[1]
     for fn in file_names:
         path = os.sep.join(['xtag_grammar', language, directory, fn])
-        text = nltk.data.find(path).open().read()
+        fp = nltk.data.find(path).open()
         tagset[files][fn] = TAGTreeSet()
-        tagset[files][fn] += grammar_file_parse(text)
+        tagset[files][fn] += grammar_file_parse(fp)
+        fp.close()
  
     return tagset
 
@@ -1549,11 +2400,10 @@ def draw_trees(*trees):
 
 def remove_or_tag(feat):
     """
-    Remove "__or_" key in feature structure when display
+    Replace the disjunctions in feature structure with strings when display
     :type: FeatStruct
     """
     keys = feat.keys()
-    length = len(keys)
     for key in keys:
         try:
             key.decode('ascii')
@@ -1563,21 +2413,8 @@ def remove_or_tag(feat):
                 feat['eps'+key[2:]] = value
                 del feat[key]
                 key = 'eps'+key[2:]
-        if key[:5] == '__or_' and length > 1:
-            values = feat.values()
-            value = ''
-            for v in values:
-                value = value + v + '/'
-            feat['__value__'] = value[:-1]
-            for key in keys:
-                del feat[key]
-            return
-        elif key[:5] == '__or_':
-            value = feat[key]
-            feat['__value__'] = value
-            del feat[key]
-        elif key == '__value__':
-            kvalue = feat[key]
+        if key == VALUE_KEY:
+            feat[key] = str(feat[key])
         else:
             remove_or_tag(feat[key])
 
@@ -1778,6 +2615,20 @@ def feat_widget(fs, allfs, canvas, name, **attribs):
         return TextWidget(canvas, '[ ]', justify='center')
 
 
+def debug_lexicalize():
+    # A base form does not unify with the mode of the trees of TQnx0,
+    # which are then dropped instead of being anchored without the
+    # features of the word
+    t = load('english')
+    fset = lex_search(word_to_features('make'), {}, t)
+    assert len(fset['make.V INF']['TQnx0.trees']) == 0
+    sset = fset['make.V short.A work.N of.P INF']['Tnx0VAN1Pnx2.trees']
+    for name in sset:
+        tree = sset[name]
+        assert tree.lexicalize() == True
+        assert str(leaf_value(tree.get_all_fs()['V.b']['mode'])) == 'base'
+    print len(sset), 'trees lexicalized for make.V INF'
+
 def demo():
     gramfile = 'xtag_grammar/english/english.gram'
     cata_str = nltk.data.find(gramfile).open().read()